@@ -93,6 +93,8 @@ def do_teardown():
     # Remove windows workstation lookup caching
     if exists(".windows_workstations"):
         remove(".windows_workstations")
+    if exists(".countMVS/windows_verdicts.db"):
+        remove(".countMVS/windows_verdicts.db")
 
     print_count_mvs_log()
 
@@ -6,21 +6,38 @@ SPDX-License-Identifier: Apache-2.0
 
 import argparse
 import csv
+import functools
+import gzip
 import logging
 import warnings
 import getpass
+import hashlib
+import itertools
+import json
 import os
+import random
+import re
 import time
 import sys
 import socket
 from socket import gaierror
+import sqlite3
 import subprocess
+import tempfile
+import threading
 import six
+from six.moves import intern, queue
+from six.moves.urllib.parse import urlsplit
 import requests
-from requests.exceptions import RequestException
+from requests.exceptions import ConnectionError as RequestsConnectionError, ConnectTimeout, RequestException
+from requests.packages.urllib3.exceptions import NewConnectionError  # pylint: disable=import-error
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from psycopg2 import DatabaseError
+try:
+    import zstandard  # pylint: disable=import-error
+except ImportError:
+    zstandard = None
 
 # Disable insecure HTTPS warnings as most customers do not have
 # certificate validation correctly configured for consoles
@@ -80,6 +97,9 @@ WINDOWS_SERVER_EVENT_IDS = [
     4758, 4759, 4760, 4761, 4762, 4763, 4768, 4770, 4771, 4776, 4777
 ]
 
+# State kept between runs of the script is stored in this directory under the current working directory
+STATE_DIRECTORY = '.countMVS'
+
 
 class RESTException(Exception):
 
@@ -123,11 +143,15 @@ class MyVerException(Exception):
     pass
 
 
+class MVSCountException(Exception):
+    pass
+
+
 class QuitSelected(Exception):
     pass
 
 
-class CommandLineParser(object):
+class CommandLineParser(object):  # pylint: disable=too-many-instance-attributes,too-many-public-methods
 
     DEFAULT_LOG_FILE = '/var/log/countMVS.log'
     DEFAULT_CSV_OUTPUT_FILE = 'mvsCount.csv'
@@ -138,6 +162,24 @@ class CommandLineParser(object):
         self.debug = False
         self.skip_windows_check = False
         self.insecure = False
+        self.max_concurrent_searches = AQLConcurrencyGovernor.DEFAULT_MAX_SEARCHES
+        self.max_retries = RetryPolicy.DEFAULT_MAX_RETRIES
+        self.retry_backoff = RetryPolicy.DEFAULT_BACKOFF_SECONDS
+        self.dns_workers = HostnameResolver.DEFAULT_MAX_WORKERS
+        self.dns_timeout = HostnameResolver.DEFAULT_LOOKUP_TIMEOUT_SECONDS
+        self.dns_overall_timeout = HostnameResolver.DEFAULT_OVERALL_TIMEOUT_SECONDS
+        self.dns_cache_ttl = DNSCache.DEFAULT_TTL_SECONDS
+        self.dns_negative_ttl = DNSCache.DEFAULT_NEGATIVE_TTL_SECONDS
+        self.dns_overrides = None
+        self.windows_cache_ttl = WindowsVerdictStore.DEFAULT_TTL_SECONDS
+        self.memory_limit = SpillStore.DEFAULT_MEMORY_LIMIT_MB
+        self.compression = None
+        self.split_output = False
+        self.json_output = False
+        self.results_db = None
+        self.diff_run_id = None
+        self.cache_identifiers = False
+        self.resume = False
 
     def parse_args(self, args):
         self._parse_csv_file(args)
@@ -145,6 +187,15 @@ class CommandLineParser(object):
         self._parse_debug(args)
         self._parse_skip_windows_check(args)
         self._parse_insecure(args)
+        self._parse_max_concurrent_searches(args)
+        self._parse_retry_policy(args)
+        self._parse_dns_resolution(args)
+        self._parse_dns_cache(args)
+        self._parse_windows_cache_ttl(args)
+        self._parse_memory_limit(args)
+        self._parse_output_format(args)
+        self._parse_cache_identifiers(args)
+        self._parse_resume(args)
 
     def _parse_csv_file(self, args):
         if args and 'o' in args and args['o']:
@@ -166,6 +217,60 @@ class CommandLineParser(object):
         if args and 'insecure' in args:
             self.insecure = args['insecure']
 
+    def _parse_max_concurrent_searches(self, args):
+        if args and 'max_concurrent_searches' in args and args['max_concurrent_searches']:
+            self.max_concurrent_searches = max(1, args['max_concurrent_searches'])
+
+    def _parse_retry_policy(self, args):
+        if args and 'max_retries' in args and args['max_retries'] is not None:
+            self.max_retries = max(0, args['max_retries'])
+        if args and 'retry_backoff' in args and args['retry_backoff'] is not None:
+            self.retry_backoff = max(0, args['retry_backoff'])
+
+    def _parse_dns_resolution(self, args):
+        if args and 'dns_workers' in args and args['dns_workers']:
+            self.dns_workers = max(1, args['dns_workers'])
+        if args and 'dns_timeout' in args and args['dns_timeout']:
+            self.dns_timeout = max(0.1, args['dns_timeout'])
+        if args and 'dns_overall_timeout' in args and args['dns_overall_timeout']:
+            self.dns_overall_timeout = max(0.1, args['dns_overall_timeout'])
+
+    def _parse_dns_cache(self, args):
+        if args and 'dns_cache_ttl' in args and args['dns_cache_ttl'] is not None:
+            self.dns_cache_ttl = max(0, args['dns_cache_ttl'])
+        if args and 'dns_negative_ttl' in args and args['dns_negative_ttl'] is not None:
+            self.dns_negative_ttl = max(0, args['dns_negative_ttl'])
+        if args and 'dns_overrides' in args and args['dns_overrides']:
+            self.dns_overrides = args['dns_overrides']
+
+    def _parse_windows_cache_ttl(self, args):
+        if args and 'windows_cache_ttl' in args and args['windows_cache_ttl'] is not None:
+            self.windows_cache_ttl = max(0, args['windows_cache_ttl'])
+
+    def _parse_memory_limit(self, args):
+        if args and 'memory_limit' in args and args['memory_limit'] is not None:
+            self.memory_limit = max(0, args['memory_limit'])
+
+    def _parse_resume(self, args):
+        if args and 'resume' in args:
+            self.resume = args['resume']
+
+    def _parse_cache_identifiers(self, args):
+        if args and 'cache_identifiers' in args:
+            self.cache_identifiers = args['cache_identifiers']
+
+    def _parse_output_format(self, args):
+        if args and 'compress' in args and args['compress']:
+            self.compression = args['compress']
+        if args and 'split_output' in args:
+            self.split_output = args['split_output']
+        if args and 'json' in args:
+            self.json_output = args['json']
+        if args and 'results_db' in args and args['results_db']:
+            self.results_db = args['results_db']
+        if args and 'diff' in args and args['diff'] is not None:
+            self.diff_run_id = args['diff']
+
     def get_csv_file(self):
         return self.csv_file
 
@@ -181,9 +286,71 @@ class CommandLineParser(object):
     def is_skip_windows_check(self):
         return self.skip_windows_check
 
+    def get_max_concurrent_searches(self):
+        return self.max_concurrent_searches
+
+    def get_max_retries(self):
+        return self.max_retries
+
+    def get_retry_backoff(self):
+        return self.retry_backoff
+
+    def get_dns_workers(self):
+        return self.dns_workers
+
+    def get_dns_timeout(self):
+        return self.dns_timeout
+
+    def get_dns_overall_timeout(self):
+        return self.dns_overall_timeout
+
+    def get_dns_cache_ttl(self):
+        return self.dns_cache_ttl
+
+    def get_dns_negative_ttl(self):
+        return self.dns_negative_ttl
+
+    def get_dns_overrides(self):
+        return self.dns_overrides
+
+    def get_windows_cache_ttl(self):
+        return self.windows_cache_ttl
+
+    def get_memory_limit(self):
+        return self.memory_limit
+
+    def get_compression(self):
+        return self.compression
+
+    def is_split_output(self):
+        return self.split_output
+
+    def is_json_output(self):
+        return self.json_output
+
+    def get_results_db(self):
+        return self.results_db
+
+    def is_cache_identifiers(self):
+        return self.cache_identifiers
+
+    def is_resume(self):
+        return self.resume
+
+    def get_diff_run_id(self):
+        # 0 compares with the previous run
+        return self.diff_run_id
+
 
 class LogSource(object):
 
+    # Large consoles have hundreds of thousands of log sources, slots avoid a dict per instance and the
+    # repeated hostnames, sp configs and domain lists are shared between instances
+    __slots__ = ('sensor_device_id', 'hostname', 'device_name', 'domains', 'device_type_id', 'sp_config',
+                 'timestamp_last_seen')
+    ROW_FIELDS = __slots__
+    interned_domains = {}
+
     # pylint: disable=too-many-arguments
     def __init__(self,
                  device_id=None,
@@ -194,16 +361,24 @@ class LogSource(object):
                  spconfig=None,
                  timestamp_last_seen=None):
         self.sensor_device_id = device_id
-        self.hostname = hostname
+        self.hostname = self._intern(hostname)
         self.device_name = devicename
-        if domains:
-            self.domains = domains
-        else:
-            self.domains = []
+        self.domains = self._intern_domains(domains or ())
         self.device_type_id = devicetypeid
-        self.sp_config = spconfig
+        self.sp_config = self._intern(spconfig)
         self.timestamp_last_seen = timestamp_last_seen
 
+    @staticmethod
+    def _intern(value):
+        if isinstance(value, str):
+            return intern(value)
+        return value
+
+    @classmethod
+    def _intern_domains(cls, domains):
+        domains = tuple(domains)
+        return cls.interned_domains.setdefault(domains, domains)
+
     def get_sensor_device_id(self):
         return self.sensor_device_id
 
@@ -214,18 +389,21 @@ class LogSource(object):
         return self.hostname
 
     def set_hostname(self, hostname):
-        self.hostname = hostname
+        self.hostname = self._intern(hostname)
 
     def get_domains(self):
         return self.domains
 
     def add_domain(self, domain):
         if not domain in self.domains:
-            self.domains.append(domain)
+            self.domains = self._intern_domains(self.domains + (domain, ))
 
     def set_domains(self, domains):
-        domains = list(dict.fromkeys(domains))
-        self.domains = domains
+        unique_domains = []
+        for domain in domains:
+            if domain not in unique_domains:
+                unique_domains.append(domain)
+        self.domains = self._intern_domains(unique_domains)
 
     def get_first_domain(self):
         if not self.domains:
@@ -241,6 +419,32 @@ class LogSource(object):
     def get_sp_config(self):
         return self.sp_config
 
+    def get_timestamp_last_seen(self):
+        return self.timestamp_last_seen
+
+    def to_row(self):
+        row = dict((field, getattr(self, field)) for field in self.ROW_FIELDS)
+        row['domains'] = list(self.domains)
+        return row
+
+    def to_values(self):
+        return [getattr(self, field) for field in self.ROW_FIELDS]
+
+    @staticmethod
+    def to_native_string(value):
+        # json and sqlite return unicode text on python 2, where the script and the csv module work with utf8 str
+        if six.PY2 and isinstance(value, six.text_type):
+            return value.encode('utf8')
+        return value
+
+    @classmethod
+    def from_values(cls, values):
+        sensor_device_id, hostname, device_name, domains, device_type_id, sp_config, timestamp_last_seen = [
+            cls.to_native_string(value) for value in values
+        ]
+        domains = [cls.to_native_string(domain) for domain in domains]
+        return cls(sensor_device_id, hostname, domains, device_name, device_type_id, sp_config, timestamp_last_seen)
+
     def is_multi_domain(self):
         if self.domains:
             return len(self.domains) > 1
@@ -271,7 +475,8 @@ class LogSourceToDomainMapping(object):
 
     def add_mapping_from_json(self, response_json):
         if response_json and 'logsourceid' in response_json and 'domainname_domainid' in response_json:
-            log_source_id = response_json['logsourceid']
+            # CSV search results return every column as a string
+            log_source_id = int(response_json['logsourceid'])
             domain_name = response_json['domainname_domainid']
             if log_source_id in self.logsource_to_domain:
                 self.logsource_to_domain[log_source_id].append(str(domain_name))
@@ -456,6 +661,153 @@ class PermissionCheckResult(object):
         return api_error_generator.generate_error_message()
 
 
+class AIMDLimiter(object):  # pylint: disable=too-many-instance-attributes
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, name, initial_limit, min_limit, max_limit, decrease_factor=0.5, cooldown_seconds=5):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.decrease_factor = decrease_factor
+        self.cooldown_seconds = cooldown_seconds
+        self.last_decrease = 0
+        self.in_flight = 0
+        self.peak_limit = self.limit
+        self.condition = threading.Condition()
+
+    def get_limit(self):
+        return int(self.limit)
+
+    def get_peak_limit(self):
+        return int(self.peak_limit)
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def on_success(self):
+        with self.condition:
+            # Additive increase is spread across a full window so the limit grows by one per round of requests
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            self.peak_limit = max(self.peak_limit, self.limit)
+            self.condition.notify_all()
+
+    def on_congestion(self, reason):
+        with self.condition:
+            now = time.time()
+            # Only back off once per cooldown so a burst of signals from the same window is not compounded
+            if now - self.last_decrease < self.cooldown_seconds:
+                return
+            self.last_decrease = now
+            previous_limit = int(self.limit)
+            self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+            logging.info('Reducing %s concurrency from %d to %d, Reason [%s]', self.name, previous_limit,
+                         int(self.limit), reason)
+
+
+class AQLConcurrencyGovernor(object):
+
+    DEFAULT_MAX_SEARCHES = 4
+    DEFAULT_MAX_REQUESTS = 8
+    INITIAL_SEARCHES = 1
+    INITIAL_REQUESTS = 2
+    LATENCY_THRESHOLD_SECONDS = 10
+    THROTTLE_RESPONSE_CODES = [429, 503]
+    QUEUED_SEARCH_STATUSES = ['WAIT', 'QUEUED']
+    TERMINAL_SEARCH_STATUSES = ['COMPLETED', 'ERROR', 'CANCELED']
+    MAX_THROTTLE_RETRIES = 5
+    THROTTLE_BACKOFF_SECONDS = 2
+
+    def __init__(self, max_searches=DEFAULT_MAX_SEARCHES, max_requests=DEFAULT_MAX_REQUESTS):
+        self.search_limiter = AIMDLimiter('ariel search', self.INITIAL_SEARCHES, 1, max_searches)
+        self.request_limiter = AIMDLimiter('ariel request', self.INITIAL_REQUESTS, 1, max_requests)
+        self.active_searches = set()
+        self.lock = threading.Lock()
+        self.throttled_count = 0
+
+    def get_max_searches(self):
+        return self.search_limiter.max_limit
+
+    def get_max_requests(self):
+        return self.request_limiter.max_limit
+
+    def acquire_search_slot(self):
+        self.search_limiter.acquire()
+
+    def register_search(self, search_id):
+        with self.lock:
+            self.active_searches.add(search_id)
+
+    def release_search(self, search_id):
+        with self.lock:
+            if search_id not in self.active_searches:
+                return
+            self.active_searches.remove(search_id)
+        self.search_limiter.release()
+
+    def release_search_slot(self):
+        self.search_limiter.release()
+
+    def observe_search(self, search):
+        if not search:
+            return
+        if search.get_status() in self.QUEUED_SEARCH_STATUSES:
+            self.search_limiter.on_congestion('search {} is queued by the console'.format(search.get_search_id()))
+        elif search.is_completed() or search.get_status() in self.TERMINAL_SEARCH_STATUSES:
+            self.search_limiter.on_success()
+            self.release_search(search.get_search_id())
+
+    @staticmethod
+    def _is_throttled(err):
+        return isinstance(err, RESTException) and err.get_api_error() and \
+            err.get_api_error().get_response_code() in AQLConcurrencyGovernor.THROTTLE_RESPONSE_CODES
+
+    def _record_throttle(self, err):
+        with self.lock:
+            self.throttled_count += 1
+        reason = 'HTTP {} returned by the console'.format(err.get_api_error().get_response_code())
+        self.request_limiter.on_congestion(reason)
+        self.search_limiter.on_congestion(reason)
+
+    def execute_request(self, request_function, measure_latency=True, **kwargs):
+        # A request that reads a whole streamed result takes as long as the result is large so its latency is not
+        # a sign of congestion
+        attempt = 0
+        while True:
+            self.request_limiter.acquire()
+            start = time.time()
+            try:
+                response = request_function(**kwargs)
+            except RESTException as err:
+                if not self._is_throttled(err) or attempt >= self.MAX_THROTTLE_RETRIES:
+                    raise
+                self._record_throttle(err)
+                attempt += 1
+                time.sleep(self.THROTTLE_BACKOFF_SECONDS * attempt)
+                continue
+            finally:
+                self.request_limiter.release()
+            if measure_latency and time.time() - start > self.LATENCY_THRESHOLD_SECONDS:
+                self.request_limiter.on_congestion('request latency of {:.1f}s'.format(time.time() - start))
+            else:
+                self.request_limiter.on_success()
+            return response
+
+    def get_summary(self):
+        return {
+            'peak_searches': self.search_limiter.get_peak_limit(),
+            'peak_requests': self.request_limiter.get_peak_limit(), 'throttled_responses': self.throttled_count
+        }
+
+
 class AQLClient(object):
 
     API_URL = '/api'
@@ -464,28 +816,105 @@ class AQLClient(object):
     ARIEL_SEARCH_ENDPOINT = ARIEL_SEARCHES_ENDPOINT + '/{}'
     ARIEL_SEARCH_RESULTS_ENDPOINT = ARIEL_SEARCH_ENDPOINT + '/results'
     SYSTEM_ABOUT_TEST_ENDPOINT = API_URL + '/system/about'
+    CSV_CONTENT_TYPE = 'application/csv'
+    NOT_ACCEPTABLE_RESPONSE_CODES = [406, 415]
 
-    def __init__(self, rest_client):
+    def __init__(self, rest_client, governor=None):
         self.rest_client = rest_client
+        self.governor = governor
+        self.compact_results_supported = True
+
+    def get_governor(self):
+        return self.governor
+
+    def _request(self, request_function, measure_latency=True, **kwargs):
+        if self.governor:
+            return self.governor.execute_request(request_function, measure_latency, **kwargs)
+        return request_function(**kwargs)
 
     def perform_search(self, query):
         params = {'query_expression': query}
-        response_json = self.rest_client.post(path=self.ARIEL_SEARCHES_ENDPOINT, success_code=201, params=params)
+        if not self.governor:
+            response_json = self.rest_client.post(path=self.ARIEL_SEARCHES_ENDPOINT, success_code=201, params=params)
+            return ArielSearch.from_json(response_json)
+        # A search slot is held from the POST until the search reaches a terminal status or is released
+        self.governor.acquire_search_slot()
+        try:
+            response_json = self._request(self.rest_client.post,
+                                          path=self.ARIEL_SEARCHES_ENDPOINT,
+                                          success_code=201,
+                                          params=params)
+        except Exception:
+            self.governor.release_search_slot()
+            raise
         search = ArielSearch.from_json(response_json)
+        if search:
+            self.governor.register_search(search.get_search_id())
+        else:
+            self.governor.release_search_slot()
         return search
 
     def get_search(self, search_id):
-        response_json = self.rest_client.get(path=self.ARIEL_SEARCH_ENDPOINT.format(search_id))
+        response_json = self._request(self.rest_client.get, path=self.ARIEL_SEARCH_ENDPOINT.format(search_id))
         search = ArielSearch.from_json(response_json)
+        if self.governor:
+            self.governor.observe_search(search)
         return search
 
+    def release_search(self, search_id):
+        if self.governor:
+            self.governor.release_search(search_id)
+
     def get_search_result(self, search_id, headers=None):
-        response_json = self.rest_client.get(path=self.ARIEL_SEARCH_RESULTS_ENDPOINT.format(search_id),
-                                             headers=headers)
+        response_json = self._request(self.rest_client.get,
+                                      path=self.ARIEL_SEARCH_RESULTS_ENDPOINT.format(search_id),
+                                      headers=headers)
         if response_json and 'events' in response_json:
             return response_json['events']
         return []
 
+    def get_compact_search_result(self, search_id, read_rows, headers=None):
+        # Streams the results as CSV and returns what read_rows returns for the decoded rows, or None when the console
+        # can not provide CSV results so the caller can fall back to JSON. The whole body is read while the request
+        # is governed and read_rows is called again from the start when a broken stream is retried
+        if not self.compact_results_supported:
+            return None
+        csv_headers = dict(headers or {})
+        csv_headers['Accept'] = self.CSV_CONTENT_TYPE
+        try:
+            return self._request(self.rest_client.read_stream,
+                                 measure_latency=False,
+                                 path=self.ARIEL_SEARCH_RESULTS_ENDPOINT.format(search_id),
+                                 read_response=functools.partial(self._read_csv_response, read_rows),
+                                 headers=csv_headers)
+        except RESTException as err:
+            if err.get_api_error() and err.get_api_error().get_response_code() in self.NOT_ACCEPTABLE_RESPONSE_CODES:
+                logging.info('CSV search results are not supported by the console, using JSON results instead')
+                self.compact_results_supported = False
+                return None
+            raise
+
+    def _read_csv_response(self, read_rows, response):
+        if self.CSV_CONTENT_TYPE not in response.headers.get('Content-Type', ''):
+            logging.info('Console returned %s instead of CSV search results, using JSON results instead',
+                         response.headers.get('Content-Type'))
+            self.compact_results_supported = False
+            return None
+        return read_rows(self._decode_csv_rows(response))
+
+    @staticmethod
+    def _decode_csv_rows(response):
+        if not response.encoding:
+            response.encoding = 'utf-8'
+        lines = response.iter_lines(decode_unicode=six.PY3)
+        reader = csv.reader(lines)
+        columns = next(reader, None)
+        if not columns:
+            return
+        for values in reader:
+            if values:
+                yield dict(zip(columns, values))
+
     def check_api_permissions(self):
         # We are using the system about REST API endpoint here because the
         # ariel search endpoint returns an empty list when using an authorized service token
@@ -500,14 +929,92 @@ class AQLClient(object):
         return permission_check_result
 
 
+class RetryPolicy(object):
+
+    DEFAULT_MAX_RETRIES = 3
+    DEFAULT_BACKOFF_SECONDS = 1
+    MAX_BACKOFF_SECONDS = 60
+    DEFAULT_CONNECT_TIMEOUT_SECONDS = 30
+    DEFAULT_READ_TIMEOUT_SECONDS = 300
+    # HTTP 429 and 503 are flow control signals that are handled by the AQLConcurrencyGovernor
+    RETRYABLE_RESPONSE_CODES = [502, 504]
+
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, backoff_seconds=DEFAULT_BACKOFF_SECONDS, timeout=None):
+        self.max_retries = max(0, max_retries)
+        self.backoff_seconds = backoff_seconds
+        self.timeout = timeout
+
+    def get_max_retries(self):
+        return self.max_retries
+
+    def get_timeout(self):
+        return self.timeout
+
+    def get_backoff_delay(self, attempt):
+        delay = min(self.MAX_BACKOFF_SECONDS, self.backoff_seconds * (2**attempt))
+        # Jitter stops concurrent workers that failed together from retrying in lock step
+        return random.uniform(delay / 2.0, delay)
+
+    def is_retryable_response(self, response_code):
+        return response_code in self.RETRYABLE_RESPONSE_CODES
+
+
+class RequestStats(object):
+
+    def __init__(self):
+        self.request_count = 0
+        self.retry_count = 0
+        self.failure_count = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.lock = threading.Lock()
+
+    def record_request(self, latency):
+        with self.lock:
+            self.request_count += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def record_retry(self):
+        with self.lock:
+            self.retry_count += 1
+
+    def record_failure(self):
+        with self.lock:
+            self.failure_count += 1
+
+    def get_request_count(self):
+        return self.request_count
+
+    def get_retry_count(self):
+        return self.retry_count
+
+    def get_failure_count(self):
+        return self.failure_count
+
+    def get_average_latency_ms(self):
+        if not self.request_count:
+            return 0
+        return int(round(self.total_latency * 1000 / self.request_count))
+
+    def get_max_latency_ms(self):
+        return int(round(self.max_latency * 1000))
+
+
 class RESTClient(object):
 
     SEC_HEADER = 'SEC'
+    ACCEPT_ENCODING = 'gzip, deflate'
 
-    def __init__(self, hostname, insecure=False):
+    def __init__(self, hostname, insecure=False, retry_policy=None):
         self.hostname = hostname
         self.client_auth = None
         self.verify = not insecure
+        if retry_policy:
+            self.retry_policy = retry_policy
+        else:
+            self.retry_policy = RetryPolicy(max_retries=0)
+        self.request_stats = RequestStats()
 
     def set_client_auth(self, client_auth):
         self.client_auth = client_auth
@@ -515,43 +1022,116 @@ class RESTClient(object):
     def get_client_auth(self):
         return self.client_auth
 
-    def get(self, path, success_code=200, headers=None):
-        try:
-            rest_headers = self._build_headers(headers)
-            response = requests.get(self._build_url(path),
-                                    headers=rest_headers,
-                                    auth=self._build_auth(),
-                                    verify=self.verify)
-        except (RequestException, ValueError) as err:
-            raise APIException(err)
+    def get_request_stats(self):
+        return self.request_stats
 
-        if response.status_code == 404:
-            return None
+    def get(self, path, success_code=200, headers=None):
+        response = self._send_with_retry(requests.get, path, headers=headers)
+        return self._handle_response(response, success_code)
+
+    def get_stream(self, path, success_code=200, headers=None):
+        # The body is left on the socket so large results can be decoded incrementally by the caller,
+        # compressed transfer is requested explicitly as the body is read through the raw stream
+        stream_headers = dict(headers or {})
+        stream_headers['Accept-Encoding'] = self.ACCEPT_ENCODING
+        response = self._send_with_retry(requests.get, path, headers=stream_headers, stream=True)
         if response.status_code == success_code:
-            return response.json()
-
+            return response
         try:
-            api_error = APIError.from_json(response.json())
-        except ValueError:
-            api_error = APIError.from_response_status_and_text(response.status_code, response.text)
-        raise RESTException(api_error.get_error_message(), api_error)
+            return self._handle_response(response, success_code)
+        finally:
+            response.close()
+
+    def read_stream(self, path, read_response, success_code=200, headers=None):
+        # The body is read inside the retry loop so a connection that breaks while the body is read is retried like
+        # a failed request, read_response starts again from the beginning of a new response
+        attempt = 0
+        while True:
+            response = self.get_stream(path, success_code, headers)
+            if response is None:
+                return None
+            try:
+                return read_response(response)
+            except RequestException as err:
+                if self._should_retry(attempt, True, err=err):
+                    self._wait_before_retry(attempt, path, err)
+                    attempt += 1
+                    continue
+                self.request_stats.record_failure()
+                raise APIException(err)
+            finally:
+                response.close()
 
     def post(self, path, success_code=200, params=None, headers=None):
-        try:
-            rest_headers = self._build_headers(headers)
-            response = requests.post(self._build_url(path),
-                                     headers=rest_headers,
-                                     params=params,
-                                     auth=self._build_auth(),
-                                     verify=self.verify)
-        except (RequestException, ValueError) as err:
-            raise APIException(err)
+        # A POST that reached the console may have created a search so it is only
+        # replayed when the request can not have been sent
+        response = self._send_with_retry(requests.post, path, headers=headers, params=params, idempotent=False)
+        return self._handle_response(response, success_code)
 
+    @staticmethod
+    def _is_unsent_request_error(err):
+        if isinstance(err, ConnectTimeout):
+            return True
+        if isinstance(err, RequestsConnectionError) and err.args:
+            return isinstance(getattr(err.args[0], 'reason', None), NewConnectionError)
+        return False
+
+    def _should_retry(self, attempt, idempotent, err=None, response=None):
+        if attempt >= self.retry_policy.get_max_retries():
+            return False
+        if err is not None:
+            return isinstance(err, RequestException) and (idempotent or self._is_unsent_request_error(err))
+        return idempotent and self.retry_policy.is_retryable_response(response.status_code)
+
+    def _wait_before_retry(self, attempt, path, reason):
+        delay = self.retry_policy.get_backoff_delay(attempt)
+        logging.warning('Request to %s failed, retrying in %.1f seconds (retry %d of %d), Reason [%s]', path, delay,
+                        attempt + 1, self.retry_policy.get_max_retries(), reason)
+        self.request_stats.record_retry()
+        time.sleep(delay)
+
+    # pylint: disable=too-many-arguments
+    def _send(self, request_function, path, headers=None, params=None, stream=False):
+        request_kwargs = {'headers': self._build_headers(headers), 'auth': self._build_auth(), 'verify': self.verify}
+        if request_function is requests.post:
+            request_kwargs['params'] = params
+        if stream:
+            request_kwargs['stream'] = True
+        if self.retry_policy.get_timeout():
+            request_kwargs['timeout'] = self.retry_policy.get_timeout()
+        return request_function(self._build_url(path), **request_kwargs)
+
+    # pylint: disable=too-many-arguments
+    def _send_with_retry(self, request_function, path, headers=None, params=None, idempotent=True, stream=False):
+        attempt = 0
+        while True:
+            start = time.time()
+            try:
+                response = self._send(request_function, path, headers, params, stream)
+            except (RequestException, ValueError) as err:
+                self.request_stats.record_request(time.time() - start)
+                if self._should_retry(attempt, idempotent, err=err):
+                    self._wait_before_retry(attempt, path, err)
+                    attempt += 1
+                    continue
+                self.request_stats.record_failure()
+                raise APIException(err)
+            self.request_stats.record_request(time.time() - start)
+            if self._should_retry(attempt, idempotent, response=response):
+                if stream:
+                    response.close()
+                self._wait_before_retry(attempt, path, 'HTTP {}'.format(response.status_code))
+                attempt += 1
+                continue
+            return response
+
+    def _handle_response(self, response, success_code):
         if response.status_code == 404:
             return None
         if response.status_code == success_code:
             return response.json()
 
+        self.request_stats.record_failure()
         try:
             api_error = APIError.from_json(response.json())
         except ValueError:
@@ -605,10 +1185,19 @@ class DatabaseClient(object):
 
 class MachineIdentifierParser(object):
 
+    normalized_identifiers = {}
+
     @staticmethod
     def parse_machine_identifier(machine_id):
         # If value is a url we need to retrieve the hostname/IP to use as identifier
         if '//' in machine_id:
+            try:
+                # urlsplit removes any userinfo, port and IPv6 brackets from the host
+                hostname = urlsplit(machine_id).hostname
+            except ValueError:
+                hostname = None
+            if hostname:
+                return hostname
             # remove substring before double slash
             machine_id = machine_id.split('//', 1)[1]
             # remove substring after next slash, if exists
@@ -617,6 +1206,92 @@ class MachineIdentifierParser(object):
             machine_id = machine_id.split(':', 1)[0]
         return machine_id
 
+    @staticmethod
+    def _parse_ip_address(value):
+        # The ipaddress module is not available on python 2, the socket functions give the same canonical form
+        for family in (socket.AF_INET, socket.AF_INET6):
+            try:
+                return socket.inet_ntop(family, socket.inet_pton(family, value))
+            except (socket.error, ValueError):
+                continue
+        return None
+
+    @classmethod
+    def is_ip_address(cls, value):
+        return bool(value) and cls._parse_ip_address(value) is not None
+
+    @staticmethod
+    def _strip_port(value):
+        # Only url forms carry userinfo, a bare user@host is kept whole so different users stay different devices
+        if value.startswith('['):
+            # bracketed IPv6 address with an optional port
+            return value[1:].split(']', 1)[0]
+        if value.count(':') == 1:
+            host, port = value.split(':')
+            if port.isdigit() or not port:
+                return host
+        return value
+
+    @classmethod
+    def _normalize(cls, machine_id):
+        value = machine_id.strip()
+        if '//' in value:
+            value = cls.parse_machine_identifier(value)
+        else:
+            value = cls._strip_port(value)
+        device_ip = cls._parse_ip_address(value)
+        if device_ip:
+            return device_ip
+        # Hostnames are case insensitive and a trailing dot only marks a fully qualified name
+        return value.lower().rstrip('.') or machine_id
+
+    @classmethod
+    def normalize_machine_identifier(cls, machine_id):
+        # Identifiers repeat across log sources so each distinct raw value is only normalized once
+        if not machine_id:
+            return machine_id
+        normalized = cls.normalized_identifiers.get(machine_id)
+        if normalized is None:
+            normalized = cls._normalize(machine_id)
+            cls.normalized_identifiers[machine_id] = normalized
+            if normalized != machine_id:
+                logging.debug('Normalized machine identifier %s to %s', machine_id, normalized)
+        return normalized
+
+
+class WindowsServerQIDCache(object):
+
+    DEFAULT_CACHE_FILE = os.path.join(STATE_DIRECTORY, 'windows_server_qids.json')
+
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE):
+        self.cache_file = cache_file
+
+    def load(self, fingerprint):
+        # Returns the cached qids and aql fragment when they were computed from the same DSM content, otherwise None
+        if not os.path.exists(self.cache_file):
+            return None
+        try:
+            with open(self.cache_file) as cache_file:
+                cached = json.load(cache_file)
+            if cached.get('fingerprint') == fingerprint:
+                logging.info('Loaded %d windows server qids from %s', len(cached['qids']), self.cache_file)
+                return cached['qids'], cached['aql_fragment']
+        except (IOError, ValueError, KeyError, AttributeError) as err:
+            logging.warning('Unable to read windows server qid cache file %s, Reason [%s]', self.cache_file, str(err))
+        return None
+
+    def save(self, fingerprint, qids, aql_fragment):
+        temp_file_name = '{}.tmp'.format(self.cache_file)
+        try:
+            directory = os.path.dirname(self.cache_file)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(temp_file_name, 'w') as cache_file:
+                json.dump({'fingerprint': fingerprint, 'qids': qids, 'aql_fragment': aql_fragment}, cache_file)
+            os.rename(temp_file_name, self.cache_file)
+        except (IOError, OSError) as err:
+            logging.warning('Unable to write windows server qid cache file %s, Reason [%s]', self.cache_file, str(err))
+
 
 class DatabaseService(object):
 
@@ -627,6 +1302,10 @@ class DatabaseService(object):
     CONFIG_PARAM_VALUE_QUERY = ('SELECT value '
                                 'FROM sensorprotocolconfigparameters '
                                 'WHERE sensorprotocolconfigid = {} and name = \'{}\'')
+    PROTOCOL_CONFIG_QUERY = ('SELECT config.id, config.spid, parameter.value '
+                             'FROM sensorprotocolconfig config '
+                             'LEFT JOIN sensorprotocolconfigparameters parameter '
+                             'ON parameter.sensorprotocolconfigid = config.id AND parameter.name IN ({})')
     DOMAIN_COUNT_QUERY = ('SELECT COUNT(id) FROM domains WHERE deleted=false')
     WINDOWS_SERVER_QIDS_QUERY = ('SELECT qid '
                                  'FROM qidmap '
@@ -634,10 +1313,20 @@ class DatabaseService(object):
                                  'FROM dsmevent '
                                  'WHERE devicetypeid = {} '
                                  'AND deviceeventid in ({}))')
+    DSM_FINGERPRINT_QUERY = ('SELECT COUNT(dsmevent.id) AS count, '
+                             'md5(string_agg(concat_ws(\':\', dsmevent.id, dsmevent.deviceeventid, dsmevent.qidmapid, '
+                             'qidmap.qid), \',\' ORDER BY dsmevent.id)) AS content_hash '
+                             'FROM dsmevent '
+                             'LEFT JOIN qidmap ON qidmap.id = dsmevent.qidmapid '
+                             'WHERE dsmevent.devicetypeid = {}')
     EXECUTING_QUERY_TEMPLATE = 'Executing query %s'
 
-    def __init__(self, db_client):
+    def __init__(self, db_client, windows_server_qid_cache=None):
         self.db_client = db_client
+        self.windows_server_qid_cache = windows_server_qid_cache
+        self.windows_server_qids = None
+        self.windows_server_qid_fragment = None
+        self.windows_server_qids_lock = threading.Lock()
 
     def _execute_log_source_query(self, time_period):
         log_source_retrieval_query = self.LOG_SOURCE_RETRIEVAL_QUERY.format(time_period)
@@ -700,20 +1389,39 @@ class DatabaseService(object):
                     machine_id = MachineIdentifierParser.parse_machine_identifier(param_value)
         return machine_id
 
-    # Determine a unique identifier for this log source
-    def get_machine_identifier(self, log_source):
-        error_message = 'Unable to retrieve machine identifier'
+    def find_machine_identifier(self, log_source):
         # If machine is not a special case then the
         # default identifier is the hostname
         machine_id = log_source.get_hostname()
+        sp_id = self._get_sensor_protocol_id(log_source)
+        if sp_id and sp_id in SENSOR_PROTOCOL_MAP:
+            machine_id = self._parse_machine_identifier(sp_id, log_source, machine_id)
+        return machine_id
+
+    # Determine a unique identifier for this log source
+    def get_machine_identifier(self, log_source):
+        error_message = 'Unable to retrieve machine identifier'
         try:
-            sp_id = self._get_sensor_protocol_id(log_source)
-            if sp_id and sp_id in SENSOR_PROTOCOL_MAP:
-                machine_id = self._parse_machine_identifier(sp_id, log_source, machine_id)
+            return self.find_machine_identifier(log_source)
         except (DatabaseError, TooManyResultsError) as err:
             logging.error('%s using hostname instead, '\
                           'Reason [%s]', error_message, err)
-        return machine_id
+        return log_source.get_hostname()
+
+    def get_protocol_configs(self):
+        # The protocol and identifier parameter values of every sensor protocol config in a single query, a machine
+        # identifier can only change when one of them changes
+        param_names = sorted(set(param_name for param_name in SENSOR_PROTOCOL_MAP.values() if param_name))
+        protocol_config_query = self.PROTOCOL_CONFIG_QUERY.format(','.join("'{}'".format(param_name)
+                                                                           for param_name in param_names))
+        logging.debug(self.EXECUTING_QUERY_TEMPLATE, protocol_config_query)
+        param_values = {}
+        for row in self.db_client.fetch_all(protocol_config_query):
+            config_values = param_values.setdefault(row['id'], (row['spid'], []))
+            if row['value'] is not None:
+                config_values[1].append(row['value'])
+        return dict((config_id, '{}|{}'.format(sp_id, '|'.join(sorted(values))))
+                    for config_id, (sp_id, values) in param_values.items())
 
     def get_domain_count(self):
         error_message_template = 'Unable to retrieve domain count from the database, {}'
@@ -726,7 +1434,18 @@ class DatabaseService(object):
         except (DatabaseError, TooManyResultsError) as err:
             raise DomainRetrievalException(error_message_template.format(err))
 
-    def get_windows_server_qids(self):
+    def get_dsm_fingerprint(self):
+        # Changes whenever a windows security DSM event, its device event id, its qid mapping or the mapped qid changes
+        dsm_fingerprint_query = self.DSM_FINGERPRINT_QUERY.format(MS_WINDOWS_SECURITY_EVENT_LOG_SOURCE_TYPE)
+        logging.debug(self.EXECUTING_QUERY_TEMPLATE, dsm_fingerprint_query)
+        row = self.db_client.fetch_one(dsm_fingerprint_query)
+        if not row:
+            return None
+        content = '{}|{}|{}'.format(row['count'], row['content_hash'],
+                                    ','.join(str(event_id) for event_id in WINDOWS_SERVER_EVENT_IDS))
+        return hashlib.sha1(content.encode('utf8')).hexdigest()
+
+    def _query_windows_server_qids(self):
         qids = []
         event_ids = ','.join("'{}'".format(event_id) for event_id in WINDOWS_SERVER_EVENT_IDS)
         windows_server_qids_query = self.WINDOWS_SERVER_QIDS_QUERY.format(MS_WINDOWS_SECURITY_EVENT_LOG_SOURCE_TYPE,
@@ -737,6 +1456,39 @@ class DatabaseService(object):
             qids.append(row['qid'])
         return qids
 
+    def _load_windows_server_qids(self):
+        fingerprint = None
+        if self.windows_server_qid_cache:
+            try:
+                fingerprint = self.get_dsm_fingerprint()
+            except (DatabaseError, TooManyResultsError) as err:
+                logging.warning('Unable to fingerprint the windows security DSM, Reason [%s]', err)
+        if fingerprint:
+            cached = self.windows_server_qid_cache.load(fingerprint)
+            if cached:
+                return cached
+        qids = self._query_windows_server_qids()
+        qid_fragment = ','.join("{}".format(qid) for qid in qids)
+        if fingerprint:
+            self.windows_server_qid_cache.save(fingerprint, qids, qid_fragment)
+        return qids, qid_fragment
+
+    def get_windows_server_qids(self):
+        # The qids do not change during a run and every windows device check needs them, across runs they are
+        # reused until the DSM content they are derived from changes
+        if self.windows_server_qids is None:
+            # Windows devices are checked concurrently so only the first caller loads the qids
+            with self.windows_server_qids_lock:
+                if self.windows_server_qids is None:
+                    qids, self.windows_server_qid_fragment = self._load_windows_server_qids()
+                    self.windows_server_qids = qids
+        return self.windows_server_qids
+
+    def get_windows_server_qid_fragment(self):
+        # The qids rendered for the IN clause of the windows server ariel search
+        self.get_windows_server_qids()
+        return self.windows_server_qid_fragment
+
 
 class Auth(object):
 
@@ -874,7 +1626,270 @@ class ProgressUtils(object):
             sys.stdout.flush()
 
 
-class DomainAppender(object):
+class WorkerPool(object):
+
+    # Results are waited on with a timeout so that the main thread still responds to a KeyboardInterrupt
+    RESULT_POLL_SECONDS = 0.5
+
+    def __init__(self, max_workers=1):
+        self.max_workers = max(1, max_workers)
+
+    @staticmethod
+    def _work(func, tasks, results, stop_event):
+        while not stop_event.is_set():
+            try:
+                index, item = tasks.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results.put((index, True, func(item)))
+            except Exception as err:
+                results.put((index, False, err))
+
+    def _start_workers(self, func, tasks, results, stop_event, worker_count):
+        for _ in range(worker_count):
+            worker = threading.Thread(target=self._work, args=(func, tasks, results, stop_event))
+            # Daemon threads never keep the script alive if the main thread exits on an error
+            worker.daemon = True
+            worker.start()
+
+    def imap(self, func, items):
+        items = list(items)
+        if self.max_workers == 1 or len(items) <= 1:
+            for item in items:
+                yield func(item)
+            return
+        tasks = queue.Queue()
+        results = queue.Queue()
+        stop_event = threading.Event()
+        for index, item in enumerate(items):
+            tasks.put((index, item))
+        self._start_workers(func, tasks, results, stop_event, min(self.max_workers, len(items)))
+        pending = {}
+        next_index = 0
+        try:
+            while next_index < len(items):
+                try:
+                    index, success, value = results.get(timeout=self.RESULT_POLL_SECONDS)
+                except queue.Empty:
+                    continue
+                if not success:
+                    raise value
+                pending[index] = value
+                while next_index in pending:
+                    yield pending.pop(next_index)
+                    next_index += 1
+        finally:
+            stop_event.set()
+
+    def map(self, func, items):
+        return list(self.imap(func, items))
+
+
+class PhaseScheduler(object):
+
+    DEFAULT_MAX_WORKERS = 4
+    RESULT_POLL_SECONDS = 0.5
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        self.max_workers = max(1, max_workers)
+        self.tasks = []
+        self.dependencies = {}
+        self.functions = {}
+        self.results = {}
+        self.timings = {}
+        self.start_time = None
+
+    def add_task(self, name, function, dependencies=()):
+        # The results of the dependencies are passed to the function in the order they are declared
+        self.tasks.append(name)
+        self.functions[name] = function
+        self.dependencies[name] = tuple(dependencies)
+
+    def _run_task(self, name, result_queue):
+        started = time.time()
+        try:
+            result = self.functions[name](*[self.results[dependency] for dependency in self.dependencies[name]])
+            result_queue.put((name, started, True, result))
+        except Exception as err:
+            result_queue.put((name, started, False, err))
+
+    def _get_ready_tasks(self, pending):
+        return [
+            name for name in self.tasks
+            if name in pending and all(dependency in self.results for dependency in self.dependencies[name])
+        ]
+
+    def _start_ready_tasks(self, pending, running, result_queue):
+        for name in self._get_ready_tasks(pending):
+            if len(running) >= self.max_workers:
+                return
+            pending.remove(name)
+            running.add(name)
+            task_thread = threading.Thread(target=self._run_task, args=(name, result_queue))
+            # Daemon threads never keep the script alive if the main thread exits on an error
+            task_thread.daemon = True
+            task_thread.start()
+
+    def run(self):
+        # Every task starts as soon as all of its dependencies have completed, independent tasks run concurrently
+        self.start_time = time.time()
+        pending = set(self.tasks)
+        running = set()
+        result_queue = queue.Queue()
+        while pending or running:
+            self._start_ready_tasks(pending, running, result_queue)
+            if not running:
+                raise ValueError('Unable to schedule phases {}, their dependencies can not be satisfied'.format(
+                    ', '.join(sorted(pending))))
+            try:
+                name, started, success, value = result_queue.get(timeout=self.RESULT_POLL_SECONDS)
+            except queue.Empty:
+                continue
+            running.remove(name)
+            self.timings[name] = (started - self.start_time, time.time() - started)
+            if not success:
+                raise value
+            self.results[name] = value
+        return self.results
+
+    def get_result(self, name):
+        return self.results.get(name)
+
+    def get_timings(self):
+        timings = []
+        for name in sorted(self.timings, key=lambda task: self.timings[task][0]):
+            started, seconds = self.timings[name]
+            timings.append({'task': name, 'started': round(started, 3), 'seconds': round(seconds, 3)})
+        return timings
+
+
+class PhaseCheckpoint(object):
+
+    DEFAULT_DIRECTORY = os.path.join(STATE_DIRECTORY, 'checkpoints')
+    # Checkpoints of a run that was interrupted longer ago than this describe a deployment that has moved on
+    DEFAULT_MAX_AGE_SECONDS = 86400
+    FILE_SUFFIX = '.json'
+
+    def __init__(self, directory=None, run_key=None, max_age=DEFAULT_MAX_AGE_SECONDS):
+        # Without a directory no checkpoints are written and there is nothing to resume from
+        self.directory = directory
+        self.run_key = run_key
+        self.max_age = max_age
+        self.resumed_phases = []
+
+    def _get_file_name(self, phase):
+        return os.path.join(self.directory, '{}{}'.format(phase.replace(' ', '_'), self.FILE_SUFFIX))
+
+    def start(self, resume):
+        # A run that is not resumed discards the checkpoints of an earlier run so they are never mixed
+        if self.directory and not resume:
+            self.clear()
+
+    def save(self, phase, value):
+        if not self.directory:
+            return
+        file_name = self._get_file_name(phase)
+        temp_file_name = '{}.tmp'.format(file_name)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(temp_file_name, 'w') as checkpoint_file:
+                json.dump({'run_key': self.run_key, 'created_at': time.time(), 'value': value}, checkpoint_file)
+            # The rename replaces the checkpoint in one step so an interrupted write never leaves a partial file
+            os.rename(temp_file_name, file_name)
+        except (IOError, OSError, TypeError, ValueError) as err:
+            logging.warning('Unable to write checkpoint for phase %s, Reason [%s]', phase, err)
+            if os.path.exists(temp_file_name):
+                os.remove(temp_file_name)
+
+    def load(self, phase):
+        # Returns a tuple of whether a usable checkpoint was found and the value it holds
+        if not self.directory or not os.path.exists(self._get_file_name(phase)):
+            return False, None
+        try:
+            with open(self._get_file_name(phase)) as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+        except (IOError, OSError, ValueError) as err:
+            logging.warning('Unable to read checkpoint for phase %s, Reason [%s]', phase, err)
+            return False, None
+        if checkpoint.get('run_key') != self.run_key:
+            logging.info('Checkpoint for phase %s was written for a different run and is not used', phase)
+            return False, None
+        if time.time() - checkpoint.get('created_at', 0) >= self.max_age:
+            logging.info('Checkpoint for phase %s has expired and is not used', phase)
+            return False, None
+        self.resumed_phases.append(phase)
+        return True, checkpoint.get('value')
+
+    def wrap(self, phase, function, encode=None, decode=None):
+        # The phase only runs when it has no checkpoint, decode receives the stored value and the phase arguments
+        def run_phase(*args):
+            found, value = self.load(phase)
+            if found:
+                logging.info('Phase %s resumed from its checkpoint', phase)
+                return decode(value, *args) if decode else value
+            result = function(*args)
+            self.save(phase, encode(result) if encode else result)
+            return result
+
+        return run_phase
+
+    def get_resumed_phases(self):
+        return self.resumed_phases
+
+    def clear(self):
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        for file_name in os.listdir(self.directory):
+            if file_name.endswith(self.FILE_SUFFIX):
+                try:
+                    os.remove(os.path.join(self.directory, file_name))
+                except OSError as err:
+                    logging.warning('Unable to remove checkpoint %s, Reason [%s]', file_name, err)
+
+
+class PipelineStage(object):
+
+    def __init__(self, name, function=None):
+        self.name = name
+        self.function = function
+        self.items_in = 0
+        self.items_out = 0
+        self.elapsed_seconds = 0.0
+
+    def run(self, items):
+        # A stage passes on whatever its function returns, None drops the item from the stream
+        for item in items:
+            self.items_in += 1
+            start = time.time()
+            result = self.function(item)
+            self.elapsed_seconds += time.time() - start
+            if result is not None:
+                self.items_out += 1
+                yield result
+
+    def run_batch(self, function, items_in, get_items_out):
+        # Stages that need every item before they can start are timed as a single step
+        start = time.time()
+        function()
+        self.elapsed_seconds += time.time() - start
+        self.items_in += items_in
+        self.items_out += get_items_out()
+
+    def get_throughput(self):
+        if self.elapsed_seconds:
+            return int(self.items_in / self.elapsed_seconds)
+        return 0
+
+    def get_summary(self):
+        return {
+            'stage': self.name, 'items_in': self.items_in, 'items_out': self.items_out,
+            'seconds': round(self.elapsed_seconds, 3), 'throughput': self.get_throughput()
+        }
+
+
+class DomainAppender(object):  # pylint: disable=too-many-instance-attributes
 
     DEFAULT_DOMAIN = 'Default Domain'
     DOMAIN_AQL_QUERY_TEMPLATE = ('SELECT logsourceid,DOMAINNAME(domainid) '
@@ -882,10 +1897,13 @@ class DomainAppender(object):
                                  'ORDER BY logsourceid LAST {} DAYS')
     MAX_SEARCH_RESULTS_PER_REQUEST = 49
 
-    def __init__(self, multi_domain, aql_client=None, period_in_days=1):
+    # pylint: disable=too-many-arguments
+    def __init__(self, multi_domain, aql_client=None, period_in_days=1, max_page_workers=1, compact_results=False):
         self.multi_domain = multi_domain
         self.aql_client = aql_client
         self.period_in_days = period_in_days
+        self.max_page_workers = max_page_workers
+        self.compact_results = compact_results
         self.ariel_search = None
         self.range_start = 0
         self.range_end = self.MAX_SEARCH_RESULTS_PER_REQUEST
@@ -912,18 +1930,46 @@ class DomainAppender(object):
                 time.sleep(1)
         logging.info('Ariel search with id %s completed', self.ariel_search.get_search_id())
 
-    def _build_mapping_from_results(self):
-        # Retrieve results for the AQL query
-        mapping = LogSourceToDomainMapping()
+    def _build_range_headers(self):
+        all_range_headers = []
         range_headers = self._build_range_header()
         while range_headers:
-            search_results = self.aql_client.get_search_result(self.ariel_search.get_search_id(), range_headers)
+            all_range_headers.append(range_headers)
+            self.range_start = self.range_end + 1
+            self.range_end = self.range_start + self.MAX_SEARCH_RESULTS_PER_REQUEST
+            range_headers = self._build_range_header()
+        return all_range_headers
+
+    def _get_search_result_page(self, range_headers):
+        return self.aql_client.get_search_result(self.ariel_search.get_search_id(), range_headers)
+
+    def _read_compact_results(self, search_results):
+        # A new mapping is built for every attempt so rows of a retried stream are never added twice
+        mapping = LogSourceToDomainMapping()
+        row_count = 0
+        for search_result in search_results:
+            mapping.add_mapping_from_json(search_result)
+            row_count += 1
+        logging.info('Streamed %d CSV rows for ariel search with id %s', row_count, self.ariel_search.get_search_id())
+        logging.debug('Mapping result %s', str(mapping))
+        return mapping.get_logsource_to_domain()
+
+    def _build_mapping_from_compact_results(self):
+        # The whole result set is streamed as compressed CSV and fed row by row into the mapping
+        return self.aql_client.get_compact_search_result(self.ariel_search.get_search_id(), self._read_compact_results)
+
+    def _build_mapping_from_results(self):
+        if self.compact_results:
+            logsource_to_domain = self._build_mapping_from_compact_results()
+            if logsource_to_domain is not None:
+                return logsource_to_domain
+        # Retrieve results for the AQL query, pages are fetched concurrently but consumed in order
+        mapping = LogSourceToDomainMapping()
+        worker_pool = WorkerPool(self.max_page_workers)
+        for search_results in worker_pool.imap(self._get_search_result_page, self._build_range_headers()):
             if search_results is not None:
                 for search_result in search_results:
                     mapping.add_mapping_from_json(search_result)
-                self.range_start = self.range_end + 1
-                self.range_end = self.range_start + self.MAX_SEARCH_RESULTS_PER_REQUEST
-                range_headers = self._build_range_header()
             else:
                 logging.debug('No search results returned from Ariel API search')
         logging.debug('Mapping result %s', str(mapping))
@@ -957,6 +2003,9 @@ class DomainAppender(object):
             return self._build_mapping_from_results()
         except (APIException, RESTException) as err:
             raise DomainRetrievalException(error_message_template.format(err))
+        finally:
+            if self.ariel_search:
+                self.aql_client.release_search(self.ariel_search.get_search_id())
 
     def add_domains(self, log_source_map):
         if self.multi_domain:
@@ -972,49 +2021,155 @@ class DomainAppender(object):
         logging.info('Completed adding domain information to log sources')
 
 
+class WindowsVerdictStore(object):
+
+    DEFAULT_STORE_FILE = os.path.join(STATE_DIRECTORY, 'windows_verdicts.db')
+    LEGACY_WORKSTATION_FILE = '.windows_workstations'
+    DEFAULT_TTL_SECONDS = 604800
+    WORKSTATION = 'workstation'
+    SERVER = 'server'
+    CREATE_TABLE_QUERY = ('CREATE TABLE IF NOT EXISTS windows_verdicts ('
+                          'machine_identifier TEXT PRIMARY KEY, '
+                          'verdict TEXT NOT NULL, '
+                          'checked_at REAL NOT NULL, '
+                          'period_in_days INTEGER, '
+                          'log_source_ids TEXT)')
+    SELECT_VERDICT_QUERY = ('SELECT verdict, checked_at, period_in_days, log_source_ids '
+                            'FROM windows_verdicts WHERE machine_identifier = ?')
+    INSERT_VERDICT_QUERY = 'INSERT OR REPLACE INTO windows_verdicts VALUES (?, ?, ?, ?, ?)'
+    INSERT_LEGACY_VERDICT_QUERY = 'INSERT OR IGNORE INTO windows_verdicts VALUES (?, ?, ?, NULL, NULL)'
+
+    def __init__(self, store_file=None, ttl=DEFAULT_TTL_SECONDS, legacy_file=LEGACY_WORKSTATION_FILE):
+        # Without a store file the verdicts are only kept in memory for the current run
+        self.store_file = store_file
+        self.ttl = ttl
+        self.legacy_file = legacy_file
+        self.conn = None
+        self.lock = threading.Lock()
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def _connect(self):
+        if self.store_file:
+            try:
+                directory = os.path.dirname(self.store_file)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                return sqlite3.connect(self.store_file, check_same_thread=False)
+            except (OSError, sqlite3.Error) as err:
+                logging.warning('Unable to open windows verdict store %s, verdicts will not be kept, Reason [%s]',
+                                self.store_file, err)
+        return sqlite3.connect(':memory:', check_same_thread=False)
+
+    def load(self):
+        self.conn = self._connect()
+        # Every write is a transaction so an interrupted run never leaves a partly written store
+        with self.lock, self.conn:
+            self.conn.execute(self.CREATE_TABLE_QUERY)
+        self._import_legacy_file()
+
+    def _import_legacy_file(self):
+        # Workstations found by earlier versions of the script are valid for any period until they expire
+        if not self.legacy_file or not os.path.exists(self.legacy_file):
+            return
+        with open(self.legacy_file) as legacy_file:
+            machine_identifiers = [line.strip() for line in legacy_file.read().splitlines() if line.strip()]
+        checked_at = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany(self.INSERT_LEGACY_VERDICT_QUERY, [(machine_identifier, self.WORKSTATION, checked_at)
+                                                                     for machine_identifier in machine_identifiers])
+        logging.info('Imported %d windows workstations from %s', len(machine_identifiers), self.legacy_file)
+
+    @staticmethod
+    def _format_log_source_ids(log_source_ids):
+        return ','.join(sorted(str(log_source_id) for log_source_id in log_source_ids))
+
+    def _is_valid(self, row, period_in_days, log_source_ids):
+        verdict, checked_at, stored_period_in_days, stored_log_source_ids = row
+        if time.time() - checked_at >= self.ttl:
+            return False
+        if stored_period_in_days is None:
+            return True
+        stored_log_source_ids = set(stored_log_source_ids.split(',')) if stored_log_source_ids else set()
+        log_source_ids = set(str(log_source_id) for log_source_id in log_source_ids)
+        # No server events over a period and set of log sources means there are none over a shorter period or
+        # fewer log sources, a server event that was found is still found over a longer period or more log sources
+        if verdict == self.WORKSTATION:
+            return period_in_days <= stored_period_in_days and log_source_ids <= stored_log_source_ids
+        return period_in_days >= stored_period_in_days and stored_log_source_ids <= log_source_ids
+
+    def lookup(self, machine_identifier, period_in_days, log_source_ids):
+        # Returns the stored verdict when it is still valid for the period and log sources, otherwise None
+        with self.lock:
+            row = self.conn.execute(self.SELECT_VERDICT_QUERY, (machine_identifier, )).fetchone()
+        if row and self._is_valid(row, period_in_days, log_source_ids):
+            self.hit_count += 1
+            return row[0]
+        self.miss_count += 1
+        return None
+
+    def store(self, machine_identifier, is_workstation, period_in_days, log_source_ids):
+        verdict = self.WORKSTATION if is_workstation else self.SERVER
+        with self.lock, self.conn:
+            self.conn.execute(self.INSERT_VERDICT_QUERY, (machine_identifier, verdict, time.time(), period_in_days,
+                                                          self._format_log_source_ids(log_source_ids)))
+
+    def is_loaded(self):
+        return self.conn is not None
+
+    def get_hit_count(self):
+        return self.hit_count
+
+    def get_miss_count(self):
+        return self.miss_count
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+
 class WindowsDeviceProcessor(object):
 
     WINDOWS_SERVER_QUERY_TEMPLATE = ('SELECT qid '
                                      'FROM events '
                                      'WHERE logsourceid IN ({}) '
                                      'AND qid IN ({}) LIMIT 1 LAST {} DAYS')
-    WINDOWS_WORKSTATION_CACHE_FILE = '.windows_workstations'
 
-    def __init__(self, aql_client, db_service, mvs_results, period_in_days=1):
+    # pylint: disable=too-many-arguments
+    def __init__(self, aql_client, db_service, mvs_results, period_in_days=1, max_workers=1, verdict_store=None):
         self.aql_client = aql_client
         self.db_service = db_service
         self.mvs_results = mvs_results
         self.period_in_days = period_in_days
-        self.cached_windows_workstations = []
+        self.max_workers = max_workers
+        self.verdict_store = verdict_store
         self.windows_workstations = []
-        self.ariel_search = None
 
     def _perform_aql_query(self, machine_identifier, log_source_ids):
-        print('\nPerforming AQL query to check if {} is a windows server or workstation, '
-              'Please wait...'.format(machine_identifier))
-        windows_server_qids = self.db_service.get_windows_server_qids()
+        logging.info('Performing AQL query to check if %s is a windows server or workstation', machine_identifier)
+        qids = self.db_service.get_windows_server_qid_fragment()
         ls_ids = ','.join("{}".format(ls_id) for ls_id in log_source_ids)
-        qids = ','.join("{}".format(qid) for qid in windows_server_qids)
         windows_server_aql_query = self.WINDOWS_SERVER_QUERY_TEMPLATE.format(ls_ids, qids, self.period_in_days)
         logging.debug('Attempting to execute AQL query %s', windows_server_aql_query)
         return self.aql_client.perform_search(windows_server_aql_query)
 
-    def _poll_query_for_completion(self):
-        logging.info('Polling for completion of search with id %s', self.ariel_search.get_search_id())
-        while not self.ariel_search.is_completed():
-            current_ariel_search = self.aql_client.get_search(self.ariel_search.get_search_id())
+    def _poll_query_for_completion(self, ariel_search):
+        logging.info('Polling for completion of search with id %s', ariel_search.get_search_id())
+        while not ariel_search.is_completed():
+            current_ariel_search = self.aql_client.get_search(ariel_search.get_search_id())
             if current_ariel_search:
-                self.ariel_search = current_ariel_search
-                logging.info('Ariel search with id %s has status %s', self.ariel_search.get_search_id(),
-                             self.ariel_search.get_status())
-                ProgressUtils.print_progress_bar(self.ariel_search.get_progress())
+                ariel_search = current_ariel_search
+                logging.info('Ariel search with id %s has status %s', ariel_search.get_search_id(),
+                             ariel_search.get_status())
                 time.sleep(1)
-        logging.info('Ariel search with id %s completed', self.ariel_search.get_search_id())
+        logging.info('Ariel search with id %s completed', ariel_search.get_search_id())
+        return ariel_search
 
-    def _get_result_count(self):
+    def _get_result_count(self, ariel_search):
         error_message_template = 'Unable to retrieve windows workstation query result. ERROR {}'
-        error_message = 'No ariel search result found for {}'.format(self.ariel_search.get_search_id())
-        search_results = self.aql_client.get_search_result(self.ariel_search.get_search_id())
+        error_message = 'No ariel search result found for {}'.format(ariel_search.get_search_id())
+        search_results = self.aql_client.get_search_result(ariel_search.get_search_id())
         if search_results is not None:
             return len(search_results)
         else:
@@ -1023,38 +2178,30 @@ class WindowsDeviceProcessor(object):
     def get_windows_workstations(self):
         return self.windows_workstations
 
-    def _read_machine_identifiers_from_cache(self):
-        if os.path.exists(self.WINDOWS_WORKSTATION_CACHE_FILE):
-            with open(self.WINDOWS_WORKSTATION_CACHE_FILE) as cache_file:
-                self.cached_windows_workstations = cache_file.read().splitlines()
-
-    def _store_machine_identifier(self, machine_identifier):
-        with open(self.WINDOWS_WORKSTATION_CACHE_FILE, 'a') as cache_file:
-            cache_file.write(machine_identifier + '\n')
-
     def _perform_windows_workstation_check(self, machine_identifier, windows_sec_event_log_source_ids):
         error_message_template = 'Unable to perform windows workstation check. ERROR {}'
         logging.info('Performing workstation check on %s', machine_identifier)
+        ariel_search = None
         try:
-            self.ariel_search = self._perform_aql_query(machine_identifier, windows_sec_event_log_source_ids)
-            if self.ariel_search:
-                self._poll_query_for_completion()
-                result_count = self._get_result_count()
-                logging.info('Event result count was %d for %s', result_count, machine_identifier)
-                if result_count == 0:
-                    logging.debug('Result count was 0 for machine identifier %s', machine_identifier)
-                    self.windows_workstations.append(machine_identifier)
-                    if machine_identifier not in self.cached_windows_workstations:
-                        self._store_machine_identifier(machine_identifier)
-            else:
+            ariel_search = self._perform_aql_query(machine_identifier, windows_sec_event_log_source_ids)
+            if not ariel_search:
                 error_message = 'POST to ariel API returned a 404'
                 raise WindowsWorkstationRetrievalException(error_message_template.format(error_message))
+            ariel_search = self._poll_query_for_completion(ariel_search)
+            result_count = self._get_result_count(ariel_search)
+            logging.info('Event result count was %d for %s', result_count, machine_identifier)
+            if result_count == 0:
+                logging.debug('Result count was 0 for machine identifier %s', machine_identifier)
+            return result_count == 0
         except (APIException, RESTException) as err:
             raise WindowsWorkstationRetrievalException(error_message_template.format(err))
+        finally:
+            if ariel_search:
+                self.aql_client.release_search(ariel_search.get_search_id())
 
-    def _perform_windows_server_log_sources_check(self, machine_identifier, log_sources):
+    @staticmethod
+    def _get_windows_security_log_source_ids(machine_identifier, log_sources):
         windows_sec_event_log_source_ids = []
-        windows_server = False
         for log_source in log_sources:
             if log_source.get_device_type_id() == MS_WINDOWS_SECURITY_EVENT_LOG_SOURCE_TYPE:
                 logging.info('Found windows workstation log source associated with machine identifier %s, '\
@@ -1064,46 +2211,698 @@ class WindowsDeviceProcessor(object):
             if log_source.get_device_type_id() in WINDOWS_SERVER_LOG_SOURCE_TYPES:
                 logging.info('Log source %d associated with machine identifier %s is a windows server',
                              log_source.get_sensor_device_id(), machine_identifier)
-                windows_server = True
-                break
-        if not windows_server and windows_sec_event_log_source_ids:
-            self._perform_windows_workstation_check(machine_identifier, windows_sec_event_log_source_ids)
+                return []
+        return windows_sec_event_log_source_ids
+
+    def _check_device(self, device_check):
+        machine_identifier, windows_sec_event_log_source_ids = device_check
+        return self._perform_windows_workstation_check(machine_identifier, windows_sec_event_log_source_ids)
+
+    def _perform_device_checks(self, device_checks):
+        if not device_checks:
+            return {}
+        print('\nPerforming AQL queries to check if {} machine identifier(s) are windows servers or workstations, '
+              'Please wait...'.format(len(device_checks)))
+        verdicts = {}
+        worker_pool = WorkerPool(self.max_workers)
+        for index, is_workstation in enumerate(worker_pool.imap(self._check_device, device_checks)):
+            machine_identifier, windows_sec_event_log_source_ids = device_checks[index]
+            verdicts[machine_identifier] = is_workstation
+            self.verdict_store.store(machine_identifier, is_workstation, self.period_in_days,
+                                     windows_sec_event_log_source_ids)
+            ProgressUtils.print_progress_bar(int((index + 1) * 100 / len(device_checks)))
+        return verdicts
+
+    def _get_stored_verdicts(self, device_checks):
+        stored_verdicts = {}
+        for machine_identifier, windows_sec_event_log_source_ids in device_checks:
+            verdict = self.verdict_store.lookup(machine_identifier, self.period_in_days,
+                                                windows_sec_event_log_source_ids)
+            if verdict:
+                logging.info(
+                    'Machine identifier %s was found in the windows verdict store as a %s, '
+                    'skipping ariel search', machine_identifier, verdict)
+                stored_verdicts[machine_identifier] = verdict == WindowsVerdictStore.WORKSTATION
+        return stored_verdicts
 
     def process_devices(self):
-        self._read_machine_identifiers_from_cache()
+        device_checks = []
         for machine_identifier, log_sources in self.mvs_results.get_device_map().items():
-            if machine_identifier in self.cached_windows_workstations:
-                logging.info('Machine identifier %s was found in the windows workstation cache, skipping ariel search',
-                             machine_identifier)
+            windows_sec_event_log_source_ids = self._get_windows_security_log_source_ids(
+                machine_identifier, log_sources)
+            if windows_sec_event_log_source_ids:
+                device_checks.append((machine_identifier, windows_sec_event_log_source_ids))
+        if not device_checks:
+            return
+        owns_verdict_store = self.verdict_store is None
+        if owns_verdict_store:
+            self.verdict_store = WindowsVerdictStore()
+        # The store is only opened once there is a device to check
+        if not self.verdict_store.is_loaded():
+            self.verdict_store.load()
+        try:
+            verdicts = self._get_stored_verdicts(device_checks)
+            verdicts.update(
+                self._perform_device_checks(
+                    [device_check for device_check in device_checks if device_check[0] not in verdicts]))
+        finally:
+            if owns_verdict_store:
+                self.verdict_store.close()
+                self.verdict_store = None
+        for machine_identifier in self.mvs_results.get_device_map().keys():
+            if verdicts.get(machine_identifier):
                 self.windows_workstations.append(machine_identifier)
-                continue
-            self._perform_windows_server_log_sources_check(machine_identifier, log_sources)
+
+
+class DNSCache(object):  # pylint: disable=too-many-instance-attributes
+
+    DEFAULT_CACHE_FILE = os.path.join(STATE_DIRECTORY, 'dns_cache.json')
+    DEFAULT_TTL_SECONDS = 86400
+    DEFAULT_NEGATIVE_TTL_SECONDS = 3600
+
+    def __init__(self,
+                 cache_file=DEFAULT_CACHE_FILE,
+                 ttl=DEFAULT_TTL_SECONDS,
+                 negative_ttl=DEFAULT_NEGATIVE_TTL_SECONDS,
+                 override_file=None):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.override_file = override_file
+        # hostname -> (ip or None for a failed lookup, expiry time)
+        self.entries = {}
+        self.overrides = {}
+        self.lock = threading.Lock()
+        self.modified = False
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def load(self):
+        self._read_overrides()
+        if not os.path.exists(self.cache_file):
+            return
+        now = time.time()
+        try:
+            with open(self.cache_file) as cache_file:
+                for hostname, (device_ip, expiry) in json.load(cache_file).items():
+                    # Entries never outlive the currently configured ttl
+                    expiry = min(float(expiry), now + (self.ttl if device_ip else self.negative_ttl))
+                    if expiry > now:
+                        self.entries[hostname] = (device_ip, expiry)
+        except (IOError, ValueError, TypeError, AttributeError) as err:
+            logging.warning('Unable to read dns cache file %s, Reason [%s]', self.cache_file, str(err))
+            self.entries = {}
+        logging.info('Loaded %d entries from dns cache file %s', len(self.entries), self.cache_file)
+
+    def _read_overrides(self):
+        # The override file uses the hosts file format: an ip address followed by one or more hostnames
+        if not self.override_file:
+            return
+        with open(self.override_file) as override_file:
+            for line in override_file:
+                fields = line.split('#', 1)[0].split()
+                for hostname in fields[1:]:
+                    # Looked up machine identifiers are normalized so the hostnames in the file have to match them
+                    self.overrides[MachineIdentifierParser.normalize_machine_identifier(hostname)] = fields[0]
+        logging.info('Loaded %d dns overrides from %s', len(self.overrides), self.override_file)
+
+    def save(self):
+        if not self.modified:
+            return
+        now = time.time()
+        temp_file_name = '{}.tmp'.format(self.cache_file)
+        try:
+            directory = os.path.dirname(self.cache_file)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(temp_file_name, 'w') as cache_file:
+                json.dump(
+                    dict((hostname, [entry[0], int(entry[1])]) for hostname, entry in self.entries.items()
+                         if entry[1] > now), cache_file)
+            os.rename(temp_file_name, self.cache_file)
+            self.modified = False
+        except (IOError, OSError) as err:
+            logging.warning('Unable to write dns cache file %s, Reason [%s]', self.cache_file, str(err))
+
+    def lookup(self, hostname):
+        # Returns a tuple of whether the hostname was found and the cached ip, which is None for a failed lookup
+        if hostname in self.overrides:
+            return True, self.overrides[hostname]
+        with self.lock:
+            entry = self.entries.get(hostname)
+            if entry and entry[1] > time.time():
+                self.hit_count += 1
+                return True, entry[0]
+            self.miss_count += 1
+            return False, None
+
+    def store(self, hostname, device_ip):
+        ttl = self.ttl if device_ip else self.negative_ttl
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.entries[hostname] = (device_ip, time.time() + ttl)
+            self.modified = True
+
+    def get_hit_count(self):
+        return self.hit_count
+
+    def get_miss_count(self):
+        return self.miss_count
 
 
 class IPParser(object):
 
-    @staticmethod
-    def get_device_ip(hostname):
+    dns_cache = None
+
+    @classmethod
+    def set_dns_cache(cls, dns_cache):
+        cls.dns_cache = dns_cache
+
+    @classmethod
+    def get_device_ip(cls, hostname):
+        if cls.dns_cache:
+            found, device_ip = cls.dns_cache.lookup(hostname)
+            if found:
+                return device_ip
         try:
-            return socket.gethostbyname(hostname)
+            device_ip = socket.gethostbyname(hostname)
         except gaierror as err:
             logging.error('Unable to resolve hostname %s to IP, ' \
                           'Reason [%s]', hostname, str(err))
+            # A temporary resolver failure says nothing about the hostname so it is not cached
+            if cls.dns_cache and err.errno != socket.EAI_AGAIN:
+                cls.dns_cache.store(hostname, None)
             return None
+        if cls.dns_cache:
+            cls.dns_cache.store(hostname, device_ip)
+        return device_ip
 
 
-class MVSResults(object):
+class HostnameResolver(object):  # pylint: disable=too-many-instance-attributes
 
-    def __init__(self):
-        self.device_map = {}
+    DEFAULT_MAX_WORKERS = 16
+    DEFAULT_LOOKUP_TIMEOUT_SECONDS = 10
+    DEFAULT_OVERALL_TIMEOUT_SECONDS = 600
+    RESULT_POLL_SECONDS = 0.1
+
+    def __init__(self,
+                 max_workers=DEFAULT_MAX_WORKERS,
+                 lookup_timeout=DEFAULT_LOOKUP_TIMEOUT_SECONDS,
+                 overall_timeout=DEFAULT_OVERALL_TIMEOUT_SECONDS):
+        self.max_workers = max(1, max_workers)
+        self.lookup_timeout = lookup_timeout
+        self.overall_timeout = overall_timeout
+        self.resolved_count = 0
+        self.failed_count = 0
+        self.timed_out_count = 0
+        self.lookups = {}
+        # Identifiers whose lookup timed out or never started before the overall deadline, they are not retried
+        self.abandoned = set()
+        # Identifiers handed to a worker that has not returned yet, including abandoned lookups that are still running
+        self.unfinished = set()
+        self.work_queue = queue.Queue()
+        self.result_queue = queue.Queue()
+        self.workers = []
+
+    @staticmethod
+    def _lookup(machine_identifier, result_queue):
+        try:
+            device_ip = IPParser.get_device_ip(machine_identifier)
+        except Exception as err:  # pylint: disable=broad-except
+            logging.info('Unable to resolve machine identifier %s to an ip address. Error %s', machine_identifier,
+                         str(err))
+            device_ip = None
+        result_queue.put((machine_identifier, device_ip))
+
+    def _work(self):
+        while True:
+            self._lookup(self.work_queue.get(), self.result_queue)
+
+    def _start_workers(self):
+        # socket lookups can not be interrupted so the pool is never grown to replace a worker stuck in an abandoned
+        # lookup, at most max_workers lookups are ever running
+        while len(self.workers) < self.max_workers:
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def _start_lookup(self, machine_identifier, in_flight, now):
+        logging.info('Attempting to resolve machine identifier %s to an ip address', machine_identifier)
+        in_flight[machine_identifier] = now
+        self.unfinished.add(machine_identifier)
+        self.work_queue.put(machine_identifier)
+
+    def _record_result(self, machine_identifier, device_ip, resolved):
+        resolved[machine_identifier] = device_ip
+        self.lookups[machine_identifier] = device_ip
+        if device_ip:
+            self.resolved_count += 1
+        else:
+            self.failed_count += 1
+
+    def _receive_result(self, in_flight, resolved, block=True):
+        try:
+            machine_identifier, device_ip = self.result_queue.get(block, self.RESULT_POLL_SECONDS)
+        except queue.Empty:
+            return False
+        self.unfinished.discard(machine_identifier)
+        if machine_identifier in in_flight:
+            del in_flight[machine_identifier]
+            self._record_result(machine_identifier, device_ip, resolved)
+        else:
+            # The late result of an abandoned lookup is kept for any later resolution of the identifier
+            self.abandoned.discard(machine_identifier)
+            self.lookups[machine_identifier] = device_ip
+        return True
+
+    def _abandon(self, machine_identifiers):
+        self.timed_out_count += len(machine_identifiers)
+        self.abandoned.update(machine_identifiers)
+
+    def _expire_lookups(self, in_flight, now):
+        for machine_identifier, started in list(in_flight.items()):
+            if now - started >= self.lookup_timeout:
+                logging.warning('Resolving machine identifier %s timed out after %s seconds', machine_identifier,
+                                self.lookup_timeout)
+                del in_flight[machine_identifier]
+                self._abandon([machine_identifier])
+
+    def resolve(self, machine_identifiers):
+        # Returns a map of machine identifier to resolved ip, identifiers that failed or were abandoned are omitted.
+        # Completed lookups are kept so identifiers resolved ahead of time are not looked up again
+        in_flight = {}
+        resolved = {}
+        while self._receive_result(in_flight, resolved, block=False):
+            pass
+        pending = []
+        for machine_identifier in reversed(machine_identifiers):
+            if machine_identifier in self.lookups:
+                resolved[machine_identifier] = self.lookups[machine_identifier]
+            elif machine_identifier not in self.abandoned:
+                pending.append(machine_identifier)
+        deadline = time.time() + self.overall_timeout
+        while pending or in_flight:
+            now = time.time()
+            if now >= deadline:
+                logging.warning(
+                    'Hostname resolution exceeded the overall deadline of %s seconds, '
+                    '%d lookups abandoned', self.overall_timeout,
+                    len(in_flight) + len(pending))
+                self._abandon(list(in_flight) + pending)
+                break
+            self._start_workers()
+            while pending and len(self.unfinished) < self.max_workers:
+                self._start_lookup(pending.pop(), in_flight, now)
+            self._expire_lookups(in_flight, now)
+            self._receive_result(in_flight, resolved)
+        return dict((machine_identifier, device_ip) for machine_identifier, device_ip in resolved.items() if device_ip)
+
+    def get_summary(self):
+        return {'resolved': self.resolved_count, 'failed': self.failed_count, 'timed_out': self.timed_out_count}
+
+    def get_abandoned(self):
+        return self.abandoned
+
+    def add_lookups(self, lookups):
+        self.lookups.update(lookups)
+
+
+class IdentifierCache(object):  # pylint: disable=too-many-instance-attributes
+
+    DEFAULT_STATE_FILE = os.path.join(STATE_DIRECTORY, 'identifier_cache.db')
+    # Cached machine identifiers are looked up again once they are this old
+    DEFAULT_MAX_AGE_SECONDS = 604800
+    CREATE_TABLE_QUERY = ('CREATE TABLE IF NOT EXISTS log_sources ('
+                          'log_source_id INTEGER PRIMARY KEY, '
+                          'fingerprint TEXT NOT NULL, '
+                          'machine_identifier TEXT, '
+                          'processed_at REAL NOT NULL)')
+    SELECT_QUERY = 'SELECT log_source_id, fingerprint, machine_identifier, processed_at FROM log_sources'
+    INSERT_QUERY = ('INSERT INTO log_sources (log_source_id, fingerprint, machine_identifier, processed_at) '
+                    'VALUES (?, ?, ?, ?)')
+
+    def __init__(self, state_file=None, max_age=DEFAULT_MAX_AGE_SECONDS):
+        # Only the machine identifiers are cached, the domains, hostname resolutions and the count are always worked
+        # out again. Without a state file every log source is identified and nothing is kept for the next run
+        self.state_file = state_file
+        self.max_age = max_age
+        self.conn = None
+        self.protocol_configs = None
+        self.previous_state = {}
+        self.current_state = {}
+        self.unchanged_ids = set()
+        self.changed_ids = set()
+        self.failed_ids = set()
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        if self.state_file:
+            try:
+                directory = os.path.dirname(self.state_file)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                return sqlite3.connect(self.state_file, check_same_thread=False)
+            except (OSError, sqlite3.Error) as err:
+                logging.warning('Unable to open identifier cache %s, every log source will be processed, Reason [%s]',
+                                self.state_file, err)
+        return sqlite3.connect(':memory:', check_same_thread=False)
+
+    def load(self):
+        self.conn = self._connect()
+        with self.conn:
+            self.conn.execute(self.CREATE_TABLE_QUERY)
+        for log_source_id, fingerprint, machine_identifier, processed_at in self.conn.execute(self.SELECT_QUERY):
+            self.previous_state[log_source_id] = (fingerprint, LogSource.to_native_string(machine_identifier),
+                                                  processed_at)
+        logging.info('Loaded cached machine identifiers for %d log sources', len(self.previous_state))
+
+    def set_protocol_configs(self, protocol_configs):
+        # Without the protocol configs a changed identifier parameter can not be detected so nothing is reused
+        self.protocol_configs = protocol_configs
+
+    @staticmethod
+    def get_fingerprint(log_source, protocol_config):
+        # The machine identifier of a log source only depends on its protocol, the value of its identifier
+        # parameter, its hostname and its type
+        values = [
+            log_source.get_sp_config(), protocol_config,
+            log_source.get_hostname(),
+            log_source.get_device_type_id()
+        ]
+        return hashlib.sha1(json.dumps(values).encode('utf8')).hexdigest()
+
+    def identify(self, log_source, get_machine_identifier):
+        log_source_id = log_source.get_sensor_device_id()
+        if self.protocol_configs is None:
+            with self.lock:
+                self.changed_ids.add(log_source_id)
+            return get_machine_identifier(log_source)
+        fingerprint = self.get_fingerprint(log_source, self.protocol_configs.get(log_source.get_sp_config()))
+        previous_state = self.previous_state.get(log_source_id)
+        if previous_state and previous_state[0] == fingerprint and time.time() - previous_state[2] < self.max_age:
+            with self.lock:
+                self.unchanged_ids.add(log_source_id)
+                self.current_state[log_source_id] = previous_state
+            return previous_state[1]
+        machine_identifier = get_machine_identifier(log_source)
+        with self.lock:
+            self.changed_ids.add(log_source_id)
+            # A hostname used after a database error is not kept so the log source is identified again next run
+            if log_source_id not in self.failed_ids:
+                self.current_state[log_source_id] = (fingerprint, machine_identifier, time.time())
+        return machine_identifier
+
+    def add_failed_log_source(self, log_source):
+        with self.lock:
+            self.failed_ids.add(log_source.get_sensor_device_id())
+
+    def get_unchanged_count(self):
+        return len(self.unchanged_ids)
+
+    def get_changed_count(self):
+        return len(self.changed_ids)
+
+    def save(self):
+        # Log sources that were not seen in this run are dropped from the state
+        rows = [(log_source_id, fingerprint, machine_identifier, processed_at)
+                for log_source_id, (fingerprint, machine_identifier, processed_at) in self.current_state.items()]
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM log_sources')
+            self.conn.executemany(self.INSERT_QUERY, rows)
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+
+class SpillStore(object):  # pylint: disable=too-many-instance-attributes
+
+    DEFAULT_MEMORY_LIMIT_MB = 2048
+    MEMORY_CHECK_INTERVAL = 1000
+    BATCH_SIZE = 1000
+    READ_PAGE_SIZE = 1000
+    CREATE_TABLE_QUERY = ('CREATE TABLE log_sources ('
+                          'seq INTEGER PRIMARY KEY, '
+                          'container INTEGER NOT NULL, '
+                          'key TEXT, '
+                          'row TEXT NOT NULL)')
+    CREATE_INDEX_QUERY = 'CREATE INDEX log_sources_key ON log_sources (container, key)'
+    INSERT_QUERY = 'INSERT INTO log_sources (container, key, row) VALUES (?, ?, ?)'
+    SELECT_QUERY = 'SELECT seq, row FROM log_sources WHERE container = ? AND seq > ? ORDER BY seq LIMIT ?'
+    SELECT_KEY_QUERY = ('SELECT seq, row FROM log_sources '
+                        'WHERE container = ? AND key = ? AND seq > ? ORDER BY seq LIMIT ?')
+    DELETE_KEY_QUERY = 'DELETE FROM log_sources WHERE container = ? AND key = ?'
+
+    def __init__(self, memory_limit_mb=0, directory=STATE_DIRECTORY):
+        # Log sources are kept in memory until the process uses more than the memory limit, from then on they are
+        # kept in a temporary sqlite file. A memory limit of 0 keeps everything in memory
+        self.memory_limit_bytes = memory_limit_mb * 1024 * 1024
+        self.directory = directory
+        self.lock = threading.RLock()
+        self.containers = []
+        self.spilling = False
+        self.conn = None
+        self.file_name = None
+        self.pending_rows = []
+        self.addition_count = 0
+        self.spilled_count = 0
+
+    def register(self, container):
+        with self.lock:
+            self.containers.append(container)
+            return len(self.containers) - 1
+
+    @staticmethod
+    def get_resident_memory():
+        # Resident set size of the process, only available where /proc is mounted
+        try:
+            with open('/proc/self/statm') as statm_file:
+                return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (IOError, OSError, ValueError, IndexError):
+            return 0
+
+    def is_spilling(self):
+        return self.spilling
+
+    def check_memory(self):
+        # Returns whether additions go to disk, the memory use is only sampled every MEMORY_CHECK_INTERVAL additions
+        with self.lock:
+            if self.spilling or not self.memory_limit_bytes:
+                return self.spilling
+            self.addition_count += 1
+            if self.addition_count % self.MEMORY_CHECK_INTERVAL == 0:
+                resident_memory = self.get_resident_memory()
+                if resident_memory > self.memory_limit_bytes:
+                    self._start_spilling(resident_memory)
+            return self.spilling
+
+    def _connect(self):
+        if self.directory and not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        file_descriptor, self.file_name = tempfile.mkstemp(prefix='spill-', suffix='.db', dir=self.directory or None)
+        os.close(file_descriptor)
+        conn = sqlite3.connect(self.file_name, check_same_thread=False)
+        # The file is scratch space removed at the end of the run so it does not need to survive a crash
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('PRAGMA journal_mode = OFF')
+        conn.execute(self.CREATE_TABLE_QUERY)
+        conn.execute(self.CREATE_INDEX_QUERY)
+        return conn
+
+    def _start_spilling(self, resident_memory):
+        try:
+            self.conn = self._connect()
+        except (OSError, sqlite3.Error) as err:
+            logging.warning('Unable to create spill file, log sources will stay in memory, Reason [%s]', err)
+            self.memory_limit_bytes = 0
+            return
+        logging.warning('Memory use of %d MB is above the limit of %d MB, log sources are now kept in %s',
+                        resident_memory // (1024 * 1024), self.memory_limit_bytes // (1024 * 1024), self.file_name)
+        self.spilling = True
+        for container in self.containers:
+            container.spill()
+
+    def _flush(self):
+        if self.pending_rows:
+            self.conn.executemany(self.INSERT_QUERY, self.pending_rows)
+            self.conn.commit()
+            self.pending_rows = []
+
+    def write(self, container_id, key, log_source):
+        with self.lock:
+            self.pending_rows.append((container_id, key, json.dumps(log_source.to_values())))
+            self.spilled_count += 1
+            if len(self.pending_rows) >= self.BATCH_SIZE:
+                self._flush()
+
+    def read(self, container_id, key=None):
+        # Rows are read a page at a time so a long list never has to fit in memory
+        last_seq = 0
+        while True:
+            with self.lock:
+                if not self.conn:
+                    return
+                self._flush()
+                if key is None:
+                    rows = self.conn.execute(self.SELECT_QUERY,
+                                             (container_id, last_seq, self.READ_PAGE_SIZE)).fetchall()
+                else:
+                    rows = self.conn.execute(self.SELECT_KEY_QUERY,
+                                             (container_id, key, last_seq, self.READ_PAGE_SIZE)).fetchall()
+            if not rows:
+                return
+            for _, row in rows:
+                yield LogSource.from_values(json.loads(row))
+            last_seq = rows[-1][0]
+
+    def delete(self, container_id, key):
+        with self.lock:
+            self._flush()
+            self.conn.execute(self.DELETE_KEY_QUERY, (container_id, key))
+            self.conn.commit()
+
+    def get_spilled_count(self):
+        return self.spilled_count
+
+    def close(self):
+        with self.lock:
+            if self.conn:
+                self.conn.close()
+                self.conn = None
+            if self.file_name and os.path.exists(self.file_name):
+                os.remove(self.file_name)
+            self.pending_rows = []
+
+
+class SpillableList(object):
+
+    def __init__(self, spill_store):
+        self.spill_store = spill_store
+        self.log_sources = []
+        self.count = 0
+        self.container_id = spill_store.register(self)
+
+    def spill(self):
+        for log_source in self.log_sources:
+            self.spill_store.write(self.container_id, None, log_source)
+        self.log_sources = []
+
+    def append(self, log_source):
+        with self.spill_store.lock:
+            self.count += 1
+            if self.spill_store.check_memory():
+                self.spill_store.write(self.container_id, None, log_source)
+            else:
+                self.log_sources.append(log_source)
+
+    def __iter__(self):
+        # Once spilling starts every log source is on disk, before that every log source is in memory
+        return itertools.chain(self.spill_store.read(self.container_id), list(self.log_sources))
+
+    def __len__(self):
+        return self.count
+
+
+class SpillableDeviceMap(object):
+
+    def __init__(self, spill_store):
+        # Log sources of a machine identifier are read as a tuple whether they are in memory or on disk. Every change
+        # goes through extend, append, assignment or deletion so it is never made to a copy that is then thrown away
+        self.spill_store = spill_store
+        # machine identifier -> list of log sources, or None once its log sources have been moved to disk
+        self.entries = {}
+        self.container_id = spill_store.register(self)
+
+    def spill(self):
+        for machine_identifier, log_sources in self.entries.items():
+            if log_sources is not None:
+                for log_source in log_sources:
+                    self.spill_store.write(self.container_id, machine_identifier, log_source)
+                self.entries[machine_identifier] = None
+
+    def extend(self, machine_identifier, log_sources):
+        with self.spill_store.lock:
+            if self.spill_store.check_memory():
+                for log_source in log_sources:
+                    self.spill_store.write(self.container_id, machine_identifier, log_source)
+                self.entries[machine_identifier] = None
+            else:
+                self.entries.setdefault(machine_identifier, []).extend(log_sources)
+
+    def append(self, machine_identifier, log_source):
+        self.extend(machine_identifier, [log_source])
+
+    def keys(self):
+        return list(self.entries.keys())
+
+    def items(self):
+        # Log sources that are on disk are only read when their machine identifier is reached
+        for machine_identifier, log_sources in list(self.entries.items()):
+            if log_sources is None:
+                yield machine_identifier, tuple(self.spill_store.read(self.container_id, machine_identifier))
+            else:
+                yield machine_identifier, tuple(log_sources)
+
+    def values(self):
+        for _, log_sources in self.items():
+            yield log_sources
+
+    def get(self, machine_identifier, default=None):
+        if machine_identifier in self.entries:
+            return self[machine_identifier]
+        return default
+
+    def __getitem__(self, machine_identifier):
+        log_sources = self.entries[machine_identifier]
+        if log_sources is None:
+            return tuple(self.spill_store.read(self.container_id, machine_identifier))
+        return tuple(log_sources)
+
+    def __setitem__(self, machine_identifier, log_sources):
+        with self.spill_store.lock:
+            if machine_identifier in self.entries:
+                del self[machine_identifier]
+            self.entries[machine_identifier] = []
+            self.extend(machine_identifier, log_sources)
+
+    def __delitem__(self, machine_identifier):
+        with self.spill_store.lock:
+            if self.entries.pop(machine_identifier) is None:
+                self.spill_store.delete(self.container_id, machine_identifier)
+
+    def __contains__(self, machine_identifier):
+        return machine_identifier in self.entries
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class MVSResults(object):  # pylint: disable=too-many-instance-attributes,too-many-public-methods
+
+    def __init__(self, spill_store=None):
+        self.spill_store = spill_store if spill_store else SpillStore()
+        self.device_map = SpillableDeviceMap(self.spill_store)
         self.domain_count_map = {}
         self.mvs_count = 0
-        self.excluded_log_sources = []
-        self.skipped_log_sources = []
-        self.windows_workstation_device_map = {}
+        self.excluded_log_sources = SpillableList(self.spill_store)
+        self.skipped_log_sources = SpillableList(self.spill_store)
+        self.windows_workstation_device_map = SpillableDeviceMap(self.spill_store)
         self.log_source_count = 0
+        self.resolution_summary = None
+        self.merged_identifiers = {}
 
     def set_device_map(self, device_map):
+        if not isinstance(device_map, SpillableDeviceMap):
+            spillable_device_map = SpillableDeviceMap(self.spill_store)
+            for machine_identifier, log_sources in device_map.items():
+                spillable_device_map[machine_identifier] = log_sources
+            device_map = spillable_device_map
         self.device_map = device_map
 
     def set_domain_count_map(self, domain_count_map):
@@ -1136,8 +2935,20 @@ class MVSResults(object):
     def get_log_source_count(self):
         return self.log_source_count
 
+    def set_resolution_summary(self, resolution_summary):
+        self.resolution_summary = resolution_summary
+
+    def get_resolution_summary(self):
+        return self.resolution_summary
+
+    def set_merged_identifiers(self, merged_identifiers):
+        self.merged_identifiers = merged_identifiers
+
+    def get_merged_identifiers(self):
+        return self.merged_identifiers
+
     def get_excluded_log_source_count(self):
-        return len(self.excluded_log_sources) + len(self.windows_workstation_device_map.values())
+        return len(self.excluded_log_sources) + len(self.windows_workstation_device_map)
 
     def add_excluded_log_source(self, log_source):
         self.excluded_log_sources.append(log_source)
@@ -1148,86 +2959,209 @@ class MVSResults(object):
     def add_windows_workstation(self, machine_identifier, log_sources):
         self.windows_workstation_device_map[machine_identifier] = log_sources
 
+    def add_log_source_to_device(self, machine_identifier, log_source):
+        self.device_map.append(machine_identifier, log_source)
+
     def increment_mvs_count(self):
         self.mvs_count += 1
 
 
-class LogSourceProcessor(object):
+class DomainBitset(object):
+
+    def __init__(self):
+        # Each distinct domain name is interned to a bit position so a set of domains is a single int
+        self.domain_ids = {}
+        self.domain_names = []
+        self.masks = {}
+
+    def get_domain_id(self, domain):
+        domain_id = self.domain_ids.get(domain)
+        if domain_id is None:
+            domain_id = len(self.domain_names)
+            self.domain_ids[domain] = domain_id
+            self.domain_names.append(domain)
+        return domain_id
+
+    def get_mask(self, domains):
+        # Log sources share a handful of distinct domain lists so the masks are memoized per list
+        key = tuple(domains)
+        mask = self.masks.get(key)
+        if mask is None:
+            mask = 0
+            for domain in key:
+                mask |= 1 << self.get_domain_id(domain)
+            self.masks[key] = mask
+        return mask
+
+    def get_domains(self, mask):
+        domains = []
+        domain_id = 0
+        while mask:
+            if mask & 1:
+                domains.append(self.domain_names[domain_id])
+            mask >>= 1
+            domain_id += 1
+        return domains
+
+    @staticmethod
+    def count(mask):
+        return bin(mask).count('1')
+
+    def count_domains(self, masks):
+        # Identical masks are tallied once and then spread over their set bits
+        mask_counts = {}
+        for mask in masks:
+            mask_counts[mask] = mask_counts.get(mask, 0) + 1
+        domain_counts = {}
+        for mask, device_count in mask_counts.items():
+            for domain in self.get_domains(mask):
+                domain_counts[domain] = domain_counts.get(domain, 0) + device_count
+        return domain_counts
+
+
+class DeviceConsolidator(object):
+
+    DNS_MERGE_REASON = 'dns'
+
+    def __init__(self):
+        # Disjoint set forest over machine identifiers and the ips they resolve to
+        self.parents = {}
+        self.sizes = {}
+        self.representatives = {}
+        self.merges = {}
+
+    def add(self, identifier):
+        if identifier not in self.parents:
+            self.parents[identifier] = identifier
+            self.sizes[identifier] = 1
+            self.representatives[identifier] = identifier
+
+    def _find(self, identifier):
+        self.add(identifier)
+        while self.parents[identifier] != identifier:
+            # path halving keeps the trees flat so lookups stay close to constant time
+            self.parents[identifier] = self.parents[self.parents[identifier]]
+            identifier = self.parents[identifier]
+        return identifier
+
+    def union(self, identifier, target, reason):
+        # Merges the set of identifier into the set of target, the representative of target's set is kept
+        identifier_root = self._find(identifier)
+        target_root = self._find(target)
+        if identifier_root == target_root:
+            return
+        representative = self.representatives[target_root]
+        if self.sizes[identifier_root] > self.sizes[target_root]:
+            identifier_root, target_root = target_root, identifier_root
+        self.parents[identifier_root] = target_root
+        self.sizes[target_root] += self.sizes[identifier_root]
+        self.representatives[target_root] = representative
+        del self.representatives[identifier_root]
+        self.merges[identifier] = (target, reason)
+
+    def get_representative(self, identifier):
+        return self.representatives[self._find(identifier)]
 
-    def __init__(self, db_service, aql_client, multi_domain=False):
+    def is_merged(self, identifier):
+        return self.sizes[self._find(identifier)] > 1
+
+    def get_merges(self):
+        return self.merges
+
+
+class LogSourceProcessor(object):  # pylint: disable=too-many-instance-attributes
+
+    # pylint: disable=too-many-arguments
+    def __init__(self,
+                 db_service,
+                 aql_client,
+                 multi_domain=False,
+                 max_search_workers=1,
+                 hostname_resolver=None,
+                 machine_identifiers=None,
+                 windows_verdict_store=None,
+                 spill_store=None):
         self.db_service = db_service
         self.aql_client = aql_client
         self.multi_domain = multi_domain
-        self.mvs_results = MVSResults()
-        self.multidomain_device_list = []
-        self.additions = {}
-        self.removals = []
-
-    def _update_multidomain_list(self, device_ip, machine_identifier):
-        if device_ip not in self.multidomain_device_list:
-            logging.debug('Adding device_ip %s to multidomain_device_list', device_ip)
-            self.multidomain_device_list.append(device_ip)
-        if machine_identifier in self.multidomain_device_list:
-            logging.debug('Removing machine_identifier %s from multidomain_device_list', machine_identifier)
-            self.multidomain_device_list.remove(machine_identifier)
-
-    def _add_to_additions_map(self, device_ip, log_sources):
-        if device_ip not in self.additions:
-            self.additions[device_ip] = log_sources
-        else:
-            self.additions[device_ip].extend(log_sources)
-
-    def _consolidate_device_map(self, device_ip, machine_identifier, log_sources):
-        if device_ip in self.mvs_results.get_device_map():
-            logging.debug('Device ip %s is already present in device map, '\
-                          'appending log sources to this IP', device_ip)
-            self.mvs_results.get_device_map()[device_ip].extend(log_sources)
-        else:
-            logging.debug('Adding device ip %s to additions map', device_ip)
-            self._add_to_additions_map(device_ip, log_sources)
-        logging.debug('Adding machine identifier %s to removals list', machine_identifier)
-        self.removals.append(machine_identifier)
-        self._update_multidomain_list(device_ip, machine_identifier)
+        self.max_search_workers = max_search_workers
+        self.hostname_resolver = hostname_resolver if hostname_resolver else HostnameResolver()
+        # Machine identifiers already looked up for log sources, keyed by sensor device id
+        self.machine_identifiers = machine_identifiers if machine_identifiers else {}
+        self.windows_verdict_store = windows_verdict_store
+        self.mvs_results = MVSResults(spill_store)
+        self.multidomain_devices = set()
+        self.device_consolidator = DeviceConsolidator()
+        self.domain_bitset = DomainBitset()
+        self.device_domain_masks = []
+        self.pipeline_stages = []
+
+    def _consolidate_device_map(self, device_ip, machine_identifier):
+        logging.debug('Merging machine identifier %s into device ip %s', machine_identifier, device_ip)
+        self.device_consolidator.union(machine_identifier, device_ip, DeviceConsolidator.DNS_MERGE_REASON)
 
     def _update_device_map(self):
-        self.mvs_results.get_device_map().update(self.additions)
-        for machine_identifier in self.removals:
-            del self.mvs_results.get_device_map()[machine_identifier]
+        # Identifiers that kept their own key stay in place, merged sets follow in the order they were first seen.
+        # The map is updated in place so log sources that are kept on disk are only moved when they are merged
+        device_map = self.mvs_results.get_device_map()
+        for machine_identifier in device_map.keys():
+            representative = self.device_consolidator.get_representative(machine_identifier)
+            if representative != machine_identifier:
+                log_sources = device_map[machine_identifier]
+                del device_map[machine_identifier]
+                device_map.extend(representative, log_sources)
+        # A merged device can combine log sources from different domains so its domains need to be combined
+        for machine_identifier in device_map:
+            if self.device_consolidator.is_merged(machine_identifier):
+                self.multidomain_devices.add(machine_identifier)
+        self.mvs_results.set_merged_identifiers(self.device_consolidator.get_merges())
 
     def _resolve_hostnames_to_ips(self):
         logging.info('Attempting to resolve hostnames to ips')
-        for machine_identifier, log_sources in self.mvs_results.get_device_map().items():
-            logging.info('Attempting to resolve machine identifier %s to an ip address', machine_identifier)
-            try:
-                device_ip = IPParser.get_device_ip(machine_identifier)
-            except Exception as err:
-                logging.info('Unable to resolve machine identifier %s to an ip address. Error %s', machine_identifier,
-                             str(err))
-                continue
+        # IP address literals are already canonical so they never need a lookup
+        hostnames = [
+            machine_identifier for machine_identifier in self.mvs_results.get_device_map()
+            if not MachineIdentifierParser.is_ip_address(machine_identifier)
+        ]
+        logging.info('Skipping resolution of %d ip address machine identifiers',
+                     len(self.mvs_results.get_device_map()) - len(hostnames))
+        device_ips = self.hostname_resolver.resolve(hostnames)
+        # Consolidate in device map order so the results do not depend on which lookups finished first
+        for machine_identifier in self.mvs_results.get_device_map().keys():
+            device_ip = device_ips.get(machine_identifier)
             if device_ip and device_ip != machine_identifier:
                 logging.info('Resolved machine identifier %s to ip address %s', machine_identifier, device_ip)
-                self._consolidate_device_map(device_ip, machine_identifier, log_sources)
+                self._consolidate_device_map(device_ip, machine_identifier)
         self._update_device_map()
-
-    def _update_count(self, domain):
-        self.mvs_results.increment_mvs_count()
-        if domain in self.mvs_results.get_domain_count_map():
-            self.mvs_results.get_domain_count_map()[domain] += 1
-        else:
-            self.mvs_results.get_domain_count_map()[domain] = 1
+        summary = self.hostname_resolver.get_summary()
+        logging.info('Hostname resolution summary: resolved = %d, failed = %d, timed out = %d', summary['resolved'],
+                     summary['failed'], summary['timed_out'])
+        # Devices whose lookup was abandoned are counted without being consolidated with their ip address
+        summary['abandoned'] = [
+            machine_identifier for machine_identifier in hostnames
+            if machine_identifier in self.hostname_resolver.get_abandoned()
+        ]
+        if summary['abandoned']:
+            logging.warning('%d devices counted without consolidation as their hostname lookups were abandoned = %s',
+                            len(summary['abandoned']), ', '.join(summary['abandoned']))
+        self.mvs_results.set_resolution_summary(summary)
+
+    def _update_counts(self):
+        # Every set bit of a device mask is one MVS in that domain
+        domain_count_map = self.mvs_results.get_domain_count_map()
+        for domain, count in self.domain_bitset.count_domains(self.device_domain_masks).items():
+            domain_count_map[domain] = domain_count_map.get(domain, 0) + count
+        self.mvs_results.set_mvs_count(self.mvs_results.get_mvs_count() +
+                                       sum(DomainBitset.count(mask) for mask in self.device_domain_masks))
 
     def _process_multi_domain_device(self, machine_identifier, log_sources):
-        # Need to build a list of all domains for this machine identifier
-        domains = []
+        # Need to combine all domains for this machine identifier
+        mask = 0
         for log_source in log_sources:
-            if not domains:
-                domains = log_source.get_domains()
-            else:
-                union = list(set(domains) | set(log_source.get_domains()))
-                domains = union
-        logging.info("Machine Identifier %s is associated with domains %s", machine_identifier, str(domains))
-        for domain in domains:
-            self._update_count(domain)
+            mask |= self.domain_bitset.get_mask(log_source.get_domains())
+        logging.info("Machine Identifier %s is associated with domains %s", machine_identifier,
+                     str(self.domain_bitset.get_domains(mask)))
+        self.device_domain_masks.append(mask)
 
     def _process_single_domain_device(self, machine_identifier, log_sources):
         # This machine identifier is not associated with multiple domains
@@ -1239,42 +3173,79 @@ class LogSourceProcessor(object):
                 domain = log_source.get_first_domain()
                 logging.info('Machine Identifier %s is associated with domain %s', machine_identifier, domain)
             if domain:
-                self._update_count(domain)
+                self.device_domain_masks.append(self.domain_bitset.get_mask([domain]))
 
     # In a system with log sources that have multiple domains we can't just count the number of IP/hostname(s)
     # We need to count each separate domain listed under an IP/hostname as a separate MVS
     def _process_domain_devices(self):
         for machine_identifier, log_sources in self.mvs_results.get_device_map().items():
-            if machine_identifier in self.multidomain_device_list:
+            if machine_identifier in self.multidomain_devices:
                 self._process_multi_domain_device(machine_identifier, log_sources)
             else:
                 self._process_single_domain_device(machine_identifier, log_sources)
+        self._update_counts()
 
     def _add_to_device_map(self, machine_identifier, log_source):
-        if machine_identifier in self.mvs_results.get_device_map():
-            self.mvs_results.get_device_map()[machine_identifier].append(log_source)
-        else:
-            self.mvs_results.get_device_map()[machine_identifier] = [log_source]
+        self.mvs_results.add_log_source_to_device(machine_identifier, log_source)
 
-    def _process_log_source(self, log_source):
+    def _exclude_log_source(self, log_source):
         if log_source.get_device_type_id() in LOG_SOURCE_EXCLUDE:
             self.mvs_results.add_excluded_log_source(log_source)
             logging.info('Device type id %s is in LOG_SOURCE_EXCLUDE, skipping...', log_source.get_device_type_id())
-            return
+            return None
         if not log_source.get_domains():
             self.mvs_results.add_skipped_log_source(log_source)
             logging.error('Log source with id %d has no domains, skipping...', log_source.get_sensor_device_id())
-            return
-        machine_identifier = self.db_service.get_machine_identifier(log_source)
+            return None
+        return log_source
+
+    def _identify_log_source(self, log_source):
+        machine_identifier = self.machine_identifiers.get(log_source.get_sensor_device_id())
+        if machine_identifier is None:
+            machine_identifier = MachineIdentifierParser.normalize_machine_identifier(
+                self.db_service.get_machine_identifier(log_source))
+        return machine_identifier
+
+    def _group_log_source(self, log_source):
+        machine_identifier = self._identify_log_source(log_source)
         # If this log source has multiple domains then keep track of this IP as it will
         # require extra processing during the count
         if log_source.is_multi_domain():
-            self.multidomain_device_list.append(machine_identifier)
+            self.multidomain_devices.add(machine_identifier)
         self._add_to_device_map(machine_identifier, log_source)
+        return log_source
+
+    def _add_pipeline_stage(self, name, function=None):
+        stage = PipelineStage(name, function)
+        self.pipeline_stages.append(stage)
+        return stage
+
+    def _stream_log_sources(self, log_sources):
+        # Log sources stream one at a time through load, exclude and group. The machine identifiers are worked out
+        # before the stream starts, only a log source missing from them is identified as it is grouped
+        load_stage = self._add_pipeline_stage('load', lambda log_source: log_source)
+        exclude_stage = self._add_pipeline_stage('exclude', self._exclude_log_source)
+        group_stage = self._add_pipeline_stage('group', self._group_log_source)
+        for _ in group_stage.run(exclude_stage.run(load_stage.run(log_sources))):
+            pass
+        self.mvs_results.set_log_source_count(load_stage.items_in)
+
+    def _run_device_stage(self, name, function):
+        # Resolution, classification and counting need every device so they run as whole-map stages
+        stage = self._add_pipeline_stage(name)
+        stage.run_batch(function, len(self.mvs_results.get_device_map()),
+                        lambda: len(self.mvs_results.get_device_map()))
+
+    def get_pipeline_summary(self):
+        return [stage.get_summary() for stage in self.pipeline_stages]
 
     def _remove_windows_workstations(self, period_in_days):
-        windows_device_processor = WindowsDeviceProcessor(self.aql_client, self.db_service, self.mvs_results,
-                                                          period_in_days)
+        windows_device_processor = WindowsDeviceProcessor(self.aql_client,
+                                                          self.db_service,
+                                                          self.mvs_results,
+                                                          period_in_days,
+                                                          max_workers=self.max_search_workers,
+                                                          verdict_store=self.windows_verdict_store)
         windows_device_processor.process_devices()
         windows_workstations = windows_device_processor.get_windows_workstations()
         for windows_workstation in windows_workstations:
@@ -1284,37 +3255,69 @@ class LogSourceProcessor(object):
             self.mvs_results.add_windows_workstation(windows_workstation, log_sources)
             del self.mvs_results.get_device_map()[windows_workstation]
 
+    def _count_devices(self):
+        if self.multi_domain:
+            self._process_domain_devices()
+        else:
+            self.mvs_results.set_mvs_count(len(self.mvs_results.get_device_map()))
+
     def process_log_sources(self, log_sources, period_in_days=1, skip_windows_check=False):
-        self.mvs_results.set_log_source_count(len(log_sources))
-        for log_source in log_sources:
-            self._process_log_source(log_source)
-        self._resolve_hostnames_to_ips()
+        self._stream_log_sources(log_sources)
+        self._run_device_stage('resolve', self._resolve_hostnames_to_ips)
         if skip_windows_check:
             print('Skipping windows workstation checks, windows workstations will be included in the final MVS count')
             logging.info(
                 'Skipping windows workstation checks, windows workstations will be included in the final MVS count')
         else:
-            self._remove_windows_workstations(period_in_days)
-        if self.multi_domain:
-            self._process_domain_devices()
-        else:
-            self.mvs_results.set_mvs_count(len(self.mvs_results.get_device_map()))
+            self._run_device_stage('classify', lambda: self._remove_windows_workstations(period_in_days))
+        self._run_device_stage('count', self._count_devices)
 
     def get_mvs_results(self):
         return self.mvs_results
 
 
+class ReportWriter(object):
+
+    DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self, output_file, buffer_size=DEFAULT_BUFFER_SIZE):
+        # Report lines are small so they are collected and handed to the file in large blocks
+        self.output_file = output_file
+        self.buffer_size = buffer_size
+        self.chunks = []
+        self.buffered_size = 0
+
+    def write(self, text):
+        self.chunks.append(text)
+        self.buffered_size += len(text)
+        if self.buffered_size >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.chunks:
+            self.output_file.write(''.join(self.chunks))
+            self.chunks = []
+            self.buffered_size = 0
+
+
 class ResultsGenerator(object):
 
     LOG_SOURCE_COLUMN_ORDER = [
         'sensor_device_id', 'device_name', 'hostname', 'device_type_id', 'timestamp_last_seen', 'sp_config', 'domains'
     ]
     LOG_SOURCE_COLUMN_NAMES = ['ID', 'Name', 'Log Source Identifier', 'Type ID', 'Last Seen', 'SP Config', 'Domains']
+    LOG_SOURCE_HEADER = ','.join(LOG_SOURCE_COLUMN_NAMES) + '\n'
+    COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+    # Level 6 gives most of the gzip size reduction at a fraction of the cpu used by level 9
+    GZIP_COMPRESS_LEVEL = 6
+    SPLIT_WRITER_THREADS = 4
 
-    def __init__(self, mvs_results, period_in_days, skip_windows_check):
+    def __init__(self, mvs_results, period_in_days, skip_windows_check, request_stats=None):
         self.mvs_results = mvs_results
         self.period_in_days = period_in_days
         self.skip_windows_check = skip_windows_check
+        self.request_stats = request_stats
+        self.domain_cells = {}
 
     @staticmethod
     def add_blank_row(csv_file):
@@ -1343,14 +3346,32 @@ class ResultsGenerator(object):
         csv_file.write('Log Sources Skipped = {}\n'.format(len(self.mvs_results.get_skipped_log_sources())))
         csv_file.write('Log Sources Excluded = {}'.format(self.mvs_results.get_excluded_log_source_count()))
 
+    def _write_api_request_summary(self, csv_file):
+        if self.request_stats:
+            csv_file.write('\nAPI Requests = {}\n'.format(self.request_stats.get_request_count()))
+            csv_file.write('API Request Retries = {}\n'.format(self.request_stats.get_retry_count()))
+            csv_file.write('API Request Failures = {}\n'.format(self.request_stats.get_failure_count()))
+            csv_file.write('API Request Average Latency (ms) = {}\n'.format(
+                self.request_stats.get_average_latency_ms()))
+            csv_file.write('API Request Max Latency (ms) = {}'.format(self.request_stats.get_max_latency_ms()))
+
+    def _write_resolution_summary(self, csv_file):
+        summary = self.mvs_results.get_resolution_summary()
+        if summary:
+            csv_file.write('\nHostname Lookups Resolved = {}\n'.format(summary['resolved']))
+            csv_file.write('Hostname Lookups Failed = {}\n'.format(summary['failed']))
+            csv_file.write('Hostname Lookups Timed Out = {}'.format(summary['timed_out']))
+            if summary.get('abandoned'):
+                csv_file.write('\nDevices Counted Without Hostname Resolution = {}'.format(' '.join(
+                    summary['abandoned'])))
+
     def _write_mvs_device_list(self, csv_file):
         csv_file.write('MVS List:\n')
-        index = 0
-        for machine_identifier in self.mvs_results.get_device_map().keys():
-            csv_file.write(machine_identifier)
-            if index < len(self.mvs_results.get_device_map().keys()) - 1:
-                self.add_carriage_return(csv_file)
-            index += 1
+        # The separator is written ahead of every entry but the first so the report is written in a single pass
+        separator = ''
+        for machine_identifier in self.mvs_results.get_device_map():
+            csv_file.write(separator + machine_identifier)
+            separator = '\n'
 
     def _write_excluded_log_source_details(self, csv_file, writer):
         if self.mvs_results.get_excluded_log_source_count() > 0:
@@ -1359,19 +3380,30 @@ class ResultsGenerator(object):
             self._write_windows_workstation_list(csv_file, writer)
             self._write_excluded_log_sources(csv_file, writer)
 
-    def _write_log_sources(self, csv_file, writer, log_sources):
-        csv_file.write(','.join(self.LOG_SOURCE_COLUMN_NAMES) + '\n')
+    def _get_domain_cell(self, domains):
+        # Domain tuples are shared between log sources so each one is only formatted once
+        domain_cell = self.domain_cells.get(domains)
+        if domain_cell is None:
+            domain_cell = self.domain_cells[domains] = str(list(domains))
+        return domain_cell
+
+    def _get_log_source_rows(self, log_sources):
         for log_source in log_sources:
-            writer.writerow(vars(log_source))
+            yield (log_source.sensor_device_id, log_source.device_name, log_source.hostname, log_source.device_type_id,
+                   log_source.timestamp_last_seen, log_source.sp_config, self._get_domain_cell(log_source.domains))
+
+    def _write_log_sources(self, csv_file, writer, log_sources):
+        csv_file.write(self.LOG_SOURCE_HEADER)
+        writer.writerows(self._get_log_source_rows(log_sources))
 
     def _write_windows_workstation_list(self, csv_file, writer):
         if self.mvs_results.get_windows_workstation_device_map():
             csv_file.write('Windows Workstations:\n')
+            separator = ''
             for machine_identifier, log_sources in self.mvs_results.get_windows_workstation_device_map().items():
-                csv_file.write('MVS Device Id = {}\n'.format(machine_identifier))
+                csv_file.write('{}MVS Device Id = {}\n'.format(separator, machine_identifier))
                 self._write_log_sources(csv_file, writer, log_sources)
-                if machine_identifier != self.mvs_results.get_windows_workstation_device_map().keys()[-1]:
-                    self.add_carriage_return(csv_file)
+                separator = '\n'
 
     def _write_excluded_log_sources(self, csv_file, writer):
         if self.mvs_results.get_excluded_log_sources():
@@ -1387,15 +3419,27 @@ class ResultsGenerator(object):
             csv_file.write('Skipped Log Source Details:\n')
             self._write_log_sources(csv_file, writer, self.mvs_results.get_skipped_log_sources())
 
+    def _get_merged_identifiers_by_target(self):
+        merged_identifiers = {}
+        for machine_identifier, (target, reason) in self.mvs_results.get_merged_identifiers().items():
+            merged_identifiers.setdefault(target, []).append('{} ({})'.format(machine_identifier, reason))
+        return merged_identifiers
+
+    def _write_device_log_sources(self, csv_file, writer, machine_identifier, log_sources, merged_identifiers):
+        csv_file.write('MVS Device Id = {}\n'.format(machine_identifier))
+        if machine_identifier in merged_identifiers:
+            csv_file.write('Merged Machine Identifiers = {}\n'.format(', '.join(
+                sorted(merged_identifiers[machine_identifier]))))
+        self._write_log_sources(csv_file, writer, log_sources)
+
     def _write_mvs_log_source_details(self, csv_file, writer):
         csv_file.write('Log Source Details:\n')
-        index = 0
+        merged_identifiers = self._get_merged_identifiers_by_target()
+        separator = ''
         for machine_identifier, log_sources in self.mvs_results.get_device_map().items():
-            csv_file.write('MVS Device Id = {}\n'.format(machine_identifier))
-            self._write_log_sources(csv_file, writer, log_sources)
-            if index < len(self.mvs_results.get_device_map().keys()) - 1:
-                self.add_carriage_return(csv_file)
-            index += 1
+            csv_file.write(separator)
+            self._write_device_log_sources(csv_file, writer, machine_identifier, log_sources, merged_identifiers)
+            separator = '\n'
 
     def _write_log_source_details(self, csv_file, writer):
         self._write_mvs_log_source_details(csv_file, writer)
@@ -1404,20 +3448,233 @@ class ResultsGenerator(object):
 
     def _write_results_summary(self, csv_file):
         self._write_mvs_count_summary(csv_file)
+        self._write_api_request_summary(csv_file)
+        self._write_resolution_summary(csv_file)
         self._write_domain_count_summary(csv_file)
 
-    def write_results_to_csv(self, csv_filename):
+    @classmethod
+    def get_report_filename(cls, csv_filename, compression=None):
+        extension = cls.COMPRESSION_EXTENSIONS.get(compression, '')
+        if csv_filename.endswith(extension):
+            return csv_filename
+        return csv_filename + extension
+
+    @classmethod
+    def get_split_filename(cls, csv_filename, name, compression=None):
+        base_name, extension = os.path.splitext(csv_filename)
+        return cls.get_report_filename('{}_{}{}'.format(base_name, name, extension), compression)
+
+    @classmethod
+    def open_report_file(cls, filename, compression=None):
+        if compression == 'gzip':
+            return gzip.open(filename, 'wt', compresslevel=cls.GZIP_COMPRESS_LEVEL)
+        if compression == 'zstd':
+            return zstandard.open(filename, 'wt')
+        return open(filename, 'w')
+
+    def _write_report_file(self, report_file):
+        filename, compression, write_report = report_file
+        with self.open_report_file(filename, compression) as output_file:
+            csv_file = ReportWriter(output_file)
+            write_report(csv_file)
+            csv_file.flush()
+        return filename
+
+    def _get_domain_devices(self):
+        # A single pass over the device map finds the devices of every domain so each domain file only reads its
+        # own devices
+        domain_devices = {}
+        for machine_identifier, log_sources in self.mvs_results.get_device_map().items():
+            device_domains = set()
+            for log_source in log_sources:
+                device_domains.update(log_source.get_domains())
+            for domain in device_domains:
+                domain_devices.setdefault(domain, []).append(machine_identifier)
+        return domain_devices
+
+    @staticmethod
+    def _get_domain_file_names(domains):
+        file_names = {}
+        used_names = set()
+        name_counts = {}
+        for domain in sorted(domains):
+            name = 'domain_' + re.sub(r'[^A-Za-z0-9_.-]+', '_', domain)
+            unique_name = name
+            while unique_name in used_names:
+                name_counts[name] = name_counts.get(name, 0) + 1
+                unique_name = '{}_{}'.format(name, name_counts[name])
+            used_names.add(unique_name)
+            file_names[domain] = unique_name
+        return file_names
+
+    def _write_domain_report(self, domain, machine_identifiers, merged_identifiers, csv_file):
+        writer = csv.writer(csv_file)
+        csv_file.write('Domain = {}\n'.format(domain))
+        csv_file.write('Devices In Domain = {}'.format(len(machine_identifiers)))
+        self.add_blank_row(csv_file)
+        csv_file.write('MVS List:\n')
+        csv_file.write('\n'.join(machine_identifiers))
+        self.add_blank_row(csv_file)
+        csv_file.write('Log Source Details:\n')
+        separator = ''
+        for machine_identifier in machine_identifiers:
+            log_sources = [
+                log_source for log_source in self.mvs_results.get_device_map()[machine_identifier]
+                if domain in log_source.get_domains()
+            ]
+            csv_file.write(separator)
+            self._write_device_log_sources(csv_file, writer, machine_identifier, log_sources, merged_identifiers)
+            separator = '\n'
+
+    def _write_excluded_report(self, csv_file):
+        writer = csv.writer(csv_file)
+        self._write_excluded_log_source_details(csv_file, writer)
+        self._write_skipped_log_source_details(csv_file, writer)
+
+    def write_split_results_to_csv(self, csv_filename, compression=None):
+        # The summary is written before the device map is read so it is available while the detail files, one per
+        # domain, are written in parallel
+        if not self.mvs_results.get_device_map():
+            return []
+        summary_filename = self.get_report_filename(csv_filename, compression)
+        self._write_report_file((summary_filename, compression, self._write_results_summary))
+        domain_devices = self._get_domain_devices()
+        file_names = self._get_domain_file_names(domain_devices.keys())
+        merged_identifiers = self._get_merged_identifiers_by_target()
+        report_files = []
+        for domain in sorted(domain_devices):
+            write_report = functools.partial(self._write_domain_report, domain, domain_devices[domain],
+                                             merged_identifiers)
+            report_files.append((self.get_split_filename(csv_filename, file_names[domain],
+                                                         compression), compression, write_report))
+        if self.mvs_results.get_excluded_log_source_count() > 0 or self.mvs_results.get_skipped_log_sources():
+            report_files.append((self.get_split_filename(csv_filename, 'excluded',
+                                                         compression), compression, self._write_excluded_report))
+        return WorkerPool(self.SPLIT_WRITER_THREADS).map(self._write_report_file, report_files)
+
+    def write_results_to_csv(self, csv_filename, compression=None):
         if self.mvs_results.get_device_map():
-            with open(csv_filename, 'w') as csv_file:
-                writer = csv.DictWriter(csv_file, self.LOG_SOURCE_COLUMN_ORDER)
+            with self.open_report_file(self.get_report_filename(csv_filename, compression),
+                                       compression) as output_file:
+                csv_file = ReportWriter(output_file)
+                writer = csv.writer(csv_file)
                 self._write_results_summary(csv_file)
                 self.add_blank_row(csv_file)
                 self._write_mvs_device_list(csv_file)
                 self.add_blank_row(csv_file)
                 self._write_log_source_details(csv_file, writer)
+                csv_file.flush()
+
+    @staticmethod
+    def get_json_filenames(csv_filename):
+        base_name = os.path.splitext(csv_filename)[0]
+        return base_name + '.jsonl', base_name + '_summary.json'
+
+    def _get_json_records(self):
+        merged_identifiers = {}
+        for machine_identifier, (target, reason) in self.mvs_results.get_merged_identifiers().items():
+            merged_identifiers.setdefault(target, {})[machine_identifier] = reason
+        for machine_identifier, log_sources in self.mvs_results.get_device_map().items():
+            yield {
+                'record': 'device', 'machine_identifier': machine_identifier,
+                'merged_identifiers': merged_identifiers.get(machine_identifier, {}),
+                'log_sources': [log_source.to_row() for log_source in log_sources]
+            }
+        for machine_identifier, log_sources in self.mvs_results.get_windows_workstation_device_map().items():
+            for log_source in log_sources:
+                yield {
+                    'record': 'excluded_log_source', 'reason': 'windows_workstation',
+                    'machine_identifier': machine_identifier, 'log_source': log_source.to_row()
+                }
+        for log_source in self.mvs_results.get_excluded_log_sources():
+            yield {'record': 'excluded_log_source', 'reason': 'excluded_type', 'log_source': log_source.to_row()}
+        for log_source in self.mvs_results.get_skipped_log_sources():
+            yield {'record': 'skipped_log_source', 'reason': 'no_domain', 'log_source': log_source.to_row()}
+
+    def get_json_summary(self):
+        summary = {
+            'mvs_count': self.mvs_results.get_mvs_count(), 'period_in_days': self.period_in_days,
+            'windows_workstation_check_skipped': self.skip_windows_check,
+            'log_sources_processed': self.mvs_results.get_log_source_count(),
+            'log_sources_skipped': len(self.mvs_results.get_skipped_log_sources()),
+            'log_sources_excluded': self.mvs_results.get_excluded_log_source_count(),
+            'mvs_count_by_domain': self.mvs_results.get_domain_count_map()
+        }
+        if self.request_stats:
+            summary['api_requests'] = {
+                'requests': self.request_stats.get_request_count(), 'retries': self.request_stats.get_retry_count(),
+                'failures': self.request_stats.get_failure_count(),
+                'average_latency_ms': self.request_stats.get_average_latency_ms(),
+                'max_latency_ms': self.request_stats.get_max_latency_ms()
+            }
+        if self.mvs_results.get_resolution_summary():
+            summary['hostname_lookups'] = self.mvs_results.get_resolution_summary()
+        return summary
+
+    def write_results_to_json(self, csv_filename, compression=None):
+        # Records are written one per line as they are produced, the summary is written last so it can refer to the
+        # complete records file
+        records_filename, summary_filename = self.get_json_filenames(csv_filename)
+        records_filename = self.get_report_filename(records_filename, compression)
+        record_count = 0
+        with self.open_report_file(records_filename, compression) as output_file:
+            json_file = ReportWriter(output_file)
+            for record in self._get_json_records():
+                json_file.write(json.dumps(record, sort_keys=True, separators=(',', ':')) + '\n')
+                record_count += 1
+            json_file.flush()
+        summary = self.get_json_summary()
+        summary['records_file'] = os.path.basename(records_filename)
+        summary['record_count'] = record_count
+        with open(summary_filename, 'w') as summary_file:
+            summary_file.write(json.dumps(summary, sort_keys=True, indent=2))
+        return records_filename, summary_filename
+
+    @staticmethod
+    def get_diff_filename(csv_filename):
+        return os.path.splitext(csv_filename)[0] + '_diff.csv'
+
+    @staticmethod
+    def _get_diff_totals(run_diff):
+        added = set()
+        removed = set()
+        for domain_added, domain_removed in run_diff.values():
+            added.update(domain_added)
+            removed.update(domain_removed)
+        # A device that moved between domains is neither added to nor removed from the deployment
+        return len(added - removed), len(removed - added)
+
+    def write_run_diff_to_csv(self, csv_filename, previous_run_id, run_diff):
+        added_count, removed_count = self._get_diff_totals(run_diff)
+        with open(csv_filename, 'w') as output_file:
+            csv_file = ReportWriter(output_file)
+            writer = csv.writer(csv_file)
+            csv_file.write('Run Diff:\n')
+            csv_file.write('Compared With Run = {}\n'.format(previous_run_id))
+            csv_file.write('MVS Devices Added = {}\n'.format(added_count))
+            csv_file.write('MVS Devices Removed = {}'.format(removed_count))
+            self.add_blank_row(csv_file)
+            csv_file.write('Domain Name,Change,Machine Identifier\n')
+            for domain in sorted(run_diff):
+                added, removed = run_diff[domain]
+                writer.writerows((domain, 'added', machine_identifier) for machine_identifier in added)
+                writer.writerows((domain, 'removed', machine_identifier) for machine_identifier in removed)
+            csv_file.flush()
+
+    def output_run_diff(self, previous_run_id, run_diff):
+        added_count, removed_count = self._get_diff_totals(run_diff)
+        print('MVS devices added since run {} is {}, removed is {}'.format(previous_run_id, added_count,
+                                                                           removed_count))
+        for domain in sorted(run_diff):
+            added, removed = run_diff[domain]
+            print('MVS devices added in domain {} is {}, removed is {}'.format(domain, len(added), len(removed)))
 
     def output_results(self):
         print('MVS count for the deployment is {}'.format(self.mvs_results.get_mvs_count()))
+        summary = self.mvs_results.get_resolution_summary()
+        if summary and summary.get('abandoned'):
+            print('{} devices were counted without hostname resolution as their lookups were abandoned, see the '
+                  'results file'.format(len(summary['abandoned'])))
         if self.mvs_results.get_domain_count_map():
             domains = list(self.mvs_results.get_domain_count_map().keys())
             domains.sort()
@@ -1425,6 +3682,278 @@ class ResultsGenerator(object):
                 print('MVS count for domain {} is {}'.format(domain, self.mvs_results.get_domain_count_map()[domain]))
 
 
+class ResultsDatabase(object):
+
+    BATCH_SIZE = 10000
+    CREATE_RUNS_TABLE_QUERY = ('CREATE TABLE IF NOT EXISTS runs ('
+                               'run_id INTEGER PRIMARY KEY, '
+                               'written_at REAL NOT NULL, '
+                               'period_in_days INTEGER, '
+                               'windows_workstation_check_skipped INTEGER, '
+                               'mvs_count INTEGER, '
+                               'log_sources_processed INTEGER, '
+                               'log_sources_skipped INTEGER, '
+                               'log_sources_excluded INTEGER)')
+    CREATE_DEVICES_TABLE_QUERY = ('CREATE TABLE IF NOT EXISTS devices ('
+                                  'run_id INTEGER NOT NULL, '
+                                  'machine_identifier TEXT NOT NULL, '
+                                  'log_source_count INTEGER)')
+    CREATE_MERGED_IDS_TABLE_QUERY = ('CREATE TABLE IF NOT EXISTS merged_identifiers ('
+                                     'run_id INTEGER NOT NULL, '
+                                     'machine_identifier TEXT NOT NULL, '
+                                     'merged_into TEXT NOT NULL, '
+                                     'reason TEXT)')
+    CREATE_LOG_SOURCES_TABLE_QUERY = ('CREATE TABLE IF NOT EXISTS log_sources ('
+                                      'run_id INTEGER NOT NULL, '
+                                      'log_source_id INTEGER, '
+                                      'machine_identifier TEXT, '
+                                      'status TEXT NOT NULL, '
+                                      'name TEXT, '
+                                      'hostname TEXT, '
+                                      'device_type_id INTEGER, '
+                                      'timestamp_last_seen INTEGER, '
+                                      'sp_config TEXT)')
+    CREATE_LS_DOMAINS_TABLE_QUERY = ('CREATE TABLE IF NOT EXISTS log_source_domains ('
+                                     'run_id INTEGER NOT NULL, '
+                                     'log_source_id INTEGER, '
+                                     'domain TEXT NOT NULL)')
+    CREATE_DOMAINS_TABLE_QUERY = ('CREATE TABLE IF NOT EXISTS domains ('
+                                  'run_id INTEGER NOT NULL, '
+                                  'domain TEXT NOT NULL, '
+                                  'mvs_count INTEGER)')
+    CREATE_VERDICTS_TABLE_QUERY = ('CREATE TABLE IF NOT EXISTS workstation_verdicts ('
+                                   'run_id INTEGER NOT NULL, '
+                                   'machine_identifier TEXT NOT NULL, '
+                                   'verdict TEXT NOT NULL)')
+    CREATE_TABLE_QUERIES = [
+        CREATE_RUNS_TABLE_QUERY, CREATE_DEVICES_TABLE_QUERY, CREATE_MERGED_IDS_TABLE_QUERY,
+        CREATE_LOG_SOURCES_TABLE_QUERY, CREATE_LS_DOMAINS_TABLE_QUERY, CREATE_DOMAINS_TABLE_QUERY,
+        CREATE_VERDICTS_TABLE_QUERY
+    ]
+    # Indexes are created after the rows of the first run are inserted which is quicker than updating them per row
+    CREATE_INDEX_QUERIES = [
+        'CREATE INDEX IF NOT EXISTS devices_machine_identifier ON devices (machine_identifier, run_id)',
+        'CREATE INDEX IF NOT EXISTS merged_identifiers_machine_identifier '
+        'ON merged_identifiers (machine_identifier, run_id)',
+        'CREATE INDEX IF NOT EXISTS log_sources_machine_identifier ON log_sources (machine_identifier, run_id)',
+        'CREATE INDEX IF NOT EXISTS log_sources_log_source_id ON log_sources (log_source_id, run_id)',
+        'CREATE INDEX IF NOT EXISTS log_source_domains_domain ON log_source_domains (domain, run_id)',
+        'CREATE INDEX IF NOT EXISTS log_source_domains_log_source_id ON log_source_domains (log_source_id, run_id)',
+        'CREATE INDEX IF NOT EXISTS domains_domain ON domains (domain, run_id)',
+        'CREATE INDEX IF NOT EXISTS workstation_verdicts_machine_identifier '
+        'ON workstation_verdicts (machine_identifier, run_id)'
+    ]
+    INSERT_RUN_QUERY = 'INSERT INTO runs VALUES (NULL, ?, ?, ?, ?, ?, ?, ?)'
+    INSERT_QUERIES = {
+        'devices': 'INSERT INTO devices VALUES (?, ?, ?)',
+        'merged_identifiers': 'INSERT INTO merged_identifiers VALUES (?, ?, ?, ?)',
+        'log_sources': 'INSERT INTO log_sources VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        'log_source_domains': 'INSERT INTO log_source_domains VALUES (?, ?, ?)',
+        'domains': 'INSERT INTO domains VALUES (?, ?, ?)',
+        'workstation_verdicts': 'INSERT INTO workstation_verdicts VALUES (?, ?, ?)'
+    }
+    COUNTED = 'counted'
+    WINDOWS_WORKSTATION = 'windows_workstation'
+    EXCLUDED = 'excluded'
+    SKIPPED = 'skipped'
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.conn = None
+        self.batches = {}
+
+    def _add_row(self, table, row):
+        batch = self.batches.setdefault(table, [])
+        batch.append(row)
+        if len(batch) >= self.BATCH_SIZE:
+            self._flush(table)
+
+    def _flush(self, table):
+        if self.batches.get(table):
+            self.conn.executemany(self.INSERT_QUERIES[table], self.batches[table])
+            self.batches[table] = []
+
+    def _add_log_sources(self, run_id, machine_identifier, status, log_sources):
+        for log_source in log_sources:
+            self._add_row('log_sources',
+                          (run_id, log_source.get_sensor_device_id(), machine_identifier, status,
+                           log_source.device_name, log_source.get_hostname(), log_source.get_device_type_id(),
+                           log_source.get_timestamp_last_seen(), log_source.get_sp_config()))
+            for domain in log_source.get_domains():
+                self._add_row('log_source_domains', (run_id, log_source.get_sensor_device_id(), domain))
+
+    def _insert_run(self, mvs_results, period_in_days, skip_windows_check):
+        cursor = self.conn.execute(
+            self.INSERT_RUN_QUERY,
+            (time.time(), period_in_days, int(bool(skip_windows_check)), mvs_results.get_mvs_count(),
+             mvs_results.get_log_source_count(), len(
+                 mvs_results.get_skipped_log_sources()), mvs_results.get_excluded_log_source_count()))
+        return cursor.lastrowid
+
+    def _insert_results(self, run_id, mvs_results):
+        # The device map is read once, the rows of every table are collected in batches as it is read
+        for machine_identifier, log_sources in mvs_results.get_device_map().items():
+            self._add_row('devices', (run_id, machine_identifier, len(log_sources)))
+            self._add_log_sources(run_id, machine_identifier, self.COUNTED, log_sources)
+        for machine_identifier, (merged_into, reason) in mvs_results.get_merged_identifiers().items():
+            self._add_row('merged_identifiers', (run_id, machine_identifier, merged_into, reason))
+        for machine_identifier, log_sources in mvs_results.get_windows_workstation_device_map().items():
+            self._add_row('workstation_verdicts', (run_id, machine_identifier, WindowsVerdictStore.WORKSTATION))
+            self._add_log_sources(run_id, machine_identifier, self.WINDOWS_WORKSTATION, log_sources)
+        self._add_log_sources(run_id, None, self.EXCLUDED, mvs_results.get_excluded_log_sources())
+        self._add_log_sources(run_id, None, self.SKIPPED, mvs_results.get_skipped_log_sources())
+        for domain, mvs_count in mvs_results.get_domain_count_map().items():
+            self._add_row('domains', (run_id, domain, mvs_count))
+        for table in self.INSERT_QUERIES:
+            self._flush(table)
+
+    def write_results(self, mvs_results, period_in_days, skip_windows_check):
+        # Every run is added to the database in a single transaction, an interrupted run leaves no partial rows.
+        # Transactions are managed explicitly as python 2 commits before every create statement
+        try:
+            self.conn = sqlite3.connect(self.db_file, isolation_level=None)
+            try:
+                self.conn.execute('BEGIN')
+                for query in self.CREATE_TABLE_QUERIES:
+                    self.conn.execute(query)
+                run_id = self._insert_run(mvs_results, period_in_days, skip_windows_check)
+                self._insert_results(run_id, mvs_results)
+                for query in self.CREATE_INDEX_QUERIES:
+                    self.conn.execute(query)
+                self.conn.execute('COMMIT')
+                return run_id
+            except sqlite3.Error:
+                self.conn.execute('ROLLBACK')
+                raise
+            finally:
+                self.conn.close()
+                self.conn = None
+                self.batches = {}
+        except sqlite3.Error as err:
+            raise MVSCountException('Unable to write results database {}, Reason [{}]'.format(self.db_file,
+                                                                                              err))
+
+
+class RunHistoryStore(object):
+
+    DEFAULT_STORE_FILE = os.path.join(STATE_DIRECTORY, 'run_history.db')
+    DEFAULT_MAX_RUNS = 30
+    # Machine identifiers and domains are stored once and referenced by id so a run is a list of integer pairs
+    CREATE_TABLE_QUERIES = [
+        'CREATE TABLE IF NOT EXISTS runs (run_id INTEGER PRIMARY KEY, finished_at REAL NOT NULL, '
+        'period_in_days INTEGER, mvs_count INTEGER)',
+        'CREATE TABLE IF NOT EXISTS identifiers (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)',
+        'CREATE TABLE IF NOT EXISTS domains (id INTEGER PRIMARY KEY, value TEXT NOT NULL UNIQUE)',
+        'CREATE TABLE IF NOT EXISTS run_devices (run_id INTEGER NOT NULL, domain_id INTEGER NOT NULL, '
+        'identifier_id INTEGER NOT NULL)', 'CREATE INDEX IF NOT EXISTS run_devices_run ON run_devices (run_id)'
+    ]
+    INSERT_RUN_QUERY = 'INSERT INTO runs VALUES (NULL, ?, ?, ?)'
+    INSERT_RUN_DEVICE_QUERY = 'INSERT INTO run_devices VALUES (?, ?, ?)'
+    SELECT_RUN_QUERY = 'SELECT run_id, finished_at, period_in_days, mvs_count FROM runs WHERE run_id = ?'
+    SELECT_PREVIOUS_RUN_QUERY = 'SELECT MAX(run_id) FROM runs WHERE run_id < ?'
+    SELECT_RUN_DEVICES_QUERY = ('SELECT d.value, i.value FROM run_devices r '
+                                'JOIN domains d ON d.id = r.domain_id '
+                                'JOIN identifiers i ON i.id = r.identifier_id WHERE r.run_id = ?')
+    SELECT_EXPIRED_RUNS_QUERY = 'SELECT run_id FROM runs ORDER BY run_id DESC LIMIT -1 OFFSET ?'
+    DELETE_UNUSED_IDENTIFIERS_QUERY = ('DELETE FROM identifiers WHERE id NOT IN '
+                                       '(SELECT DISTINCT identifier_id FROM run_devices)')
+
+    def __init__(self, store_file=None, max_runs=DEFAULT_MAX_RUNS):
+        # Without a store file the history is only kept in memory for the current run
+        self.store_file = store_file
+        self.max_runs = max_runs
+        self.conn = None
+
+    def _connect(self):
+        if self.store_file:
+            try:
+                directory = os.path.dirname(self.store_file)
+                if directory and not os.path.isdir(directory):
+                    os.makedirs(directory)
+                return sqlite3.connect(self.store_file)
+            except (OSError, sqlite3.Error) as err:
+                logging.warning('Unable to open run history %s, runs will not be kept, Reason [%s]', self.store_file,
+                                err)
+        return sqlite3.connect(':memory:')
+
+    def load(self):
+        self.conn = self._connect()
+        with self.conn:
+            for query in self.CREATE_TABLE_QUERIES:
+                self.conn.execute(query)
+
+    @staticmethod
+    def get_device_domains(mvs_results):
+        device_domains = {}
+        for machine_identifier, log_sources in mvs_results.get_device_map().items():
+            for log_source in log_sources:
+                for domain in log_source.get_domains():
+                    device_domains.setdefault(domain, set()).add(machine_identifier)
+        return device_domains
+
+    def _get_ids(self, table, values):
+        self.conn.executemany('INSERT OR IGNORE INTO {} (value) VALUES (?)'.format(table),
+                              ((value, ) for value in values))
+        ids = {}
+        for row_id, value in self.conn.execute('SELECT id, value FROM {}'.format(table)):
+            if value in values:
+                ids[value] = row_id
+        return ids
+
+    def _remove_expired_runs(self):
+        expired_run_ids = [(row[0], ) for row in self.conn.execute(self.SELECT_EXPIRED_RUNS_QUERY, (self.max_runs, ))]
+        if expired_run_ids:
+            self.conn.executemany('DELETE FROM run_devices WHERE run_id = ?', expired_run_ids)
+            self.conn.executemany('DELETE FROM runs WHERE run_id = ?', expired_run_ids)
+            self.conn.execute(self.DELETE_UNUSED_IDENTIFIERS_QUERY)
+
+    def record_run(self, device_domains, mvs_count, period_in_days):
+        machine_identifiers = set()
+        for domain_devices in device_domains.values():
+            machine_identifiers.update(domain_devices)
+        with self.conn:
+            run_id = self.conn.execute(self.INSERT_RUN_QUERY, (time.time(), period_in_days, mvs_count)).lastrowid
+            domain_ids = self._get_ids('domains', set(device_domains))
+            identifier_ids = self._get_ids('identifiers', machine_identifiers)
+            self.conn.executemany(self.INSERT_RUN_DEVICE_QUERY,
+                                  ((run_id, domain_ids[domain], identifier_ids[machine_identifier])
+                                   for domain, domain_devices in device_domains.items()
+                                   for machine_identifier in domain_devices))
+            self._remove_expired_runs()
+        return run_id
+
+    def get_run(self, run_id):
+        return self.conn.execute(self.SELECT_RUN_QUERY, (run_id, )).fetchone()
+
+    def get_previous_run_id(self, run_id):
+        return self.conn.execute(self.SELECT_PREVIOUS_RUN_QUERY, (run_id, )).fetchone()[0]
+
+    def get_run_device_domains(self, run_id):
+        device_domains = {}
+        for domain, machine_identifier in self.conn.execute(self.SELECT_RUN_DEVICES_QUERY, (run_id, )):
+            device_domains.setdefault(domain, set()).add(machine_identifier)
+        return device_domains
+
+    @staticmethod
+    def diff(previous_device_domains, device_domains):
+        # Returns domain -> (added, removed) for every domain with a change, the sets are hash joined so the diff
+        # is linear in the number of devices
+        run_diff = {}
+        for domain in set(previous_device_domains) | set(device_domains):
+            previous_devices = previous_device_domains.get(domain, set())
+            devices = device_domains.get(domain, set())
+            added = devices - previous_devices
+            removed = previous_devices - devices
+            if added or removed:
+                run_diff[domain] = (sorted(added), sorted(removed))
+        return run_diff
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+
 class Validator(object):
 
     @staticmethod
@@ -1441,6 +3970,11 @@ class Validator(object):
     def perform_api_permission_check(aql_client):
         return aql_client.check_api_permissions()
 
+    @staticmethod
+    def check_compression(compression):
+        if compression == 'zstd' and zstandard is None:
+            raise ValidatorException('zstd compression requires the zstandard python package, use gzip instead')
+
 
 class MyVer(object):
 
@@ -1465,21 +3999,99 @@ class MyVer(object):
         return MyVer._query('-c') == 'true'
 
 
-class MVSProcessor(object):
+class DatabasePrefetcher(object):
+
+    LOG_SOURCE_MAP = 'log source map'
+    DOMAIN_COUNT = 'domain count'
+    WINDOWS_SERVER_QIDS = 'windows server qids'
+
+    def __init__(self, init_db_service, max_time_period, windows_server_qids=True):
+        # init_db_service connects to the database and returns the database service to prefetch from
+        self.init_db_service = init_db_service
+        self.max_time_period = max_time_period
+        self.windows_server_qids = windows_server_qids
+        self.results = {}
+        self.errors = {}
+        self.thread = None
+
+    def start(self):
+        # The database phase runs while the operator answers the prompts
+        self.thread = threading.Thread(target=self._prefetch)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def _fetch(self, name, function, *args):
+        start_time = time.time()
+        try:
+            self.results[name] = function(*args)
+            logging.info('Prefetched %s in %.2f seconds', name, time.time() - start_time)
+        except Exception as err:  # pylint: disable=broad-except
+            # Errors are raised when the value is needed so they surface at the same point as without prefetching
+            logging.debug('Unable to prefetch %s, Reason [%s]', name, err)
+            self.errors[name] = err
+
+    def _prefetch(self):
+        try:
+            db_service = self.init_db_service()
+        except DatabaseError as err:
+            for name in (self.LOG_SOURCE_MAP, self.DOMAIN_COUNT, self.WINDOWS_SERVER_QIDS):
+                self.errors[name] = err
+            return
+        self._fetch(self.LOG_SOURCE_MAP, db_service.build_log_source_map, self.max_time_period)
+        self._fetch(self.DOMAIN_COUNT, db_service.get_domain_count)
+        if self.windows_server_qids:
+            # Fingerprints the DSM and loads the qids onto the database service the windows device checks use
+            self._fetch(self.WINDOWS_SERVER_QIDS, db_service.get_windows_server_qids)
+
+    def _get(self, name):
+        # Joining with a timeout keeps the main thread responsive to keyboard interrupts
+        while self.thread.is_alive():
+            self.thread.join(0.5)
+        if name in self.errors:
+            raise self.errors[name]
+        return self.results[name]
+
+    def get_log_source_map(self, time_period):
+        # The prefetched map covers the maximum period, log sources not seen in the selected period are dropped
+        log_source_map = self._get(self.LOG_SOURCE_MAP)
+        for log_source_id in list(log_source_map.keys()):
+            timestamp_last_seen = log_source_map[log_source_id].get_timestamp_last_seen()
+            if timestamp_last_seen is not None and timestamp_last_seen <= time_period:
+                del log_source_map[log_source_id]
+        return log_source_map
+
+    def get_domain_count(self):
+        return self._get(self.DOMAIN_COUNT)
+
+    def get_windows_server_qids(self):
+        return self._get(self.WINDOWS_SERVER_QIDS)
+
+
+class MVSProcessor(object):  # pylint: disable=too-many-instance-attributes
 
     DEFAULT_QRADAR_DB_NAME = 'qradar'
     DEFAULT_QRADAR_DB_USER = 'qradar'
     DEFAULT_PERIOD_IN_DAYS = 1
     MAXIMUM_PERIOD_IN_DAYS = 10
     DAY_IN_MILLISECONDS = 86400000
+    IDENTIFY_CHECKPOINT_SECONDS = 60
 
     def __init__(self, db_service=None, aql_client=None):
         self.command_line_parser = CommandLineParser()
         self.db_service = db_service
         self.aql_client = aql_client
         self.db_client = None
+        self.request_stats = None
         self.multi_domain = False
         self.period_in_days = self.DEFAULT_PERIOD_IN_DAYS
+        self.db_prefetcher = None
+        self.identifier_cache = None
+        self.phase_checkpoint = PhaseCheckpoint()
+        self.console_hostname = None
+        self.failed_identification_ids = set()
 
     def _init_logging(self):
         if self.command_line_parser.is_debug_enabled():
@@ -1499,11 +4111,12 @@ class MVSProcessor(object):
                              self.DEFAULT_QRADAR_DB_USER)
                 self.db_client.connect()
                 logging.info('Connected to qradar database successfully')
-                self.db_service = DatabaseService(self.db_client)
+                self.db_service = DatabaseService(self.db_client, WindowsServerQIDCache())
             except DatabaseError as err:
                 logging.error('Unable to connect to database\n'\
                               'Reason[%s]', err)
                 raise DatabaseError('Unable to connect to database')
+        return self.db_service
 
     def _init_aql_client(self, insecure):
         if not self.aql_client:
@@ -1513,11 +4126,18 @@ class MVSProcessor(object):
 
             logging.debug('retrieving console hostname')
             hostname = MyVer.get_hostname()
+            self.console_hostname = hostname
 
             logging.debug('initializing aql client')
-            api_client = RESTClient(hostname, insecure)
+            retry_policy = RetryPolicy(
+                self.command_line_parser.get_max_retries(), self.command_line_parser.get_retry_backoff(),
+                (RetryPolicy.DEFAULT_CONNECT_TIMEOUT_SECONDS, RetryPolicy.DEFAULT_READ_TIMEOUT_SECONDS))
+            api_client = RESTClient(hostname, insecure, retry_policy)
             api_client.set_client_auth(auth)
-            self.aql_client = AQLClient(api_client)
+            self.request_stats = api_client.get_request_stats()
+            max_searches = self.command_line_parser.get_max_concurrent_searches()
+            governor = AQLConcurrencyGovernor(max_searches, max_searches * 2)
+            self.aql_client = AQLClient(api_client, governor)
 
     def _parse_arguments(self):
         parser = argparse.ArgumentParser()
@@ -1532,45 +4152,391 @@ class MVSProcessor(object):
                             action='store_true')
         parser.add_argument('-o', metavar='<filename>', help='overrides the default output csv file')
         parser.add_argument('-l', metavar='<filename>', help='overrides the default file to log to')
+        parser.add_argument('--max-concurrent-searches',
+                            metavar='<count>',
+                            type=int,
+                            help='upper limit for concurrent ariel searches, the actual concurrency adapts to the '
+                            'load on the console (default {})'.format(AQLConcurrencyGovernor.DEFAULT_MAX_SEARCHES))
+        parser.add_argument('--max-retries',
+                            metavar='<count>',
+                            type=int,
+                            help='number of times a failed API request is retried (default {})'.format(
+                                RetryPolicy.DEFAULT_MAX_RETRIES))
+        parser.add_argument('--retry-backoff',
+                            metavar='<seconds>',
+                            type=float,
+                            help='initial delay before retrying a failed API request, doubled on each retry '
+                            '(default {})'.format(RetryPolicy.DEFAULT_BACKOFF_SECONDS))
+        parser.add_argument('--dns-workers',
+                            metavar='<count>',
+                            type=int,
+                            help='number of hostnames resolved concurrently (default {})'.format(
+                                HostnameResolver.DEFAULT_MAX_WORKERS))
+        parser.add_argument('--dns-timeout',
+                            metavar='<seconds>',
+                            type=float,
+                            help='time allowed for a single hostname lookup (default {})'.format(
+                                HostnameResolver.DEFAULT_LOOKUP_TIMEOUT_SECONDS))
+        parser.add_argument('--dns-overall-timeout',
+                            metavar='<seconds>',
+                            type=float,
+                            help='time allowed for resolving all hostnames (default {})'.format(
+                                HostnameResolver.DEFAULT_OVERALL_TIMEOUT_SECONDS))
+        parser.add_argument('--dns-cache-ttl',
+                            metavar='<seconds>',
+                            type=int,
+                            help='how long a resolved hostname is cached between runs, 0 disables caching '
+                            '(default {})'.format(DNSCache.DEFAULT_TTL_SECONDS))
+        parser.add_argument('--dns-negative-ttl',
+                            metavar='<seconds>',
+                            type=int,
+                            help='how long a hostname that failed to resolve is cached between runs '
+                            '(default {})'.format(DNSCache.DEFAULT_NEGATIVE_TTL_SECONDS))
+        parser.add_argument('--dns-overrides',
+                            metavar='<filename>',
+                            help='hosts file format list of ip addresses for hostnames the resolvers can not see')
+        parser.add_argument('--windows-cache-ttl',
+                            metavar='<seconds>',
+                            type=int,
+                            help='how long a windows workstation or server check is reused between runs, 0 disables '
+                            'reuse (default {})'.format(WindowsVerdictStore.DEFAULT_TTL_SECONDS))
+        parser.add_argument('--memory-limit',
+                            metavar='<MB>',
+                            type=int,
+                            help='memory use above which log sources are kept on disk, 0 keeps them in memory '
+                            '(default {})'.format(SpillStore.DEFAULT_MEMORY_LIMIT_MB))
+        parser.add_argument('--compress',
+                            metavar='<format>',
+                            choices=sorted(ResultsGenerator.COMPRESSION_EXTENSIONS),
+                            help='compresses the output csv files with gzip or zstd')
+        parser.add_argument('--split-output',
+                            action='store_true',
+                            help='writes a summary csv file and a detail csv file per domain')
+        parser.add_argument('--json',
+                            action='store_true',
+                            help='also writes the results as json lines with a json summary')
+        parser.add_argument('--results-db',
+                            metavar='<filename>',
+                            help='also adds the results to a sqlite database that can be queried')
+        parser.add_argument('--diff',
+                            metavar='<run id>',
+                            type=int,
+                            nargs='?',
+                            const=0,
+                            help='reports the mvs devices added and removed since a previous run, the last run when '
+                            'no run id is given')
+        parser.add_argument('--cache-identifiers',
+                            action='store_true',
+                            help='reuses the machine identifiers of log sources that are unchanged since the last run')
+        parser.add_argument('--resume',
+                            action='store_true',
+                            help='resumes an interrupted run from the last completed phase')
         self.command_line_parser.parse_args(vars(parser.parse_args()))
 
-    def _get_domain_appender(self):
-        if self.multi_domain:
-            return DomainAppender(multi_domain=True, aql_client=self.aql_client, period_in_days=self.period_in_days)
+    def _get_domain_appender(self, multi_domain):
+        if multi_domain:
+            return DomainAppender(multi_domain=True,
+                                  aql_client=self.aql_client,
+                                  period_in_days=self.period_in_days,
+                                  max_page_workers=self.command_line_parser.get_max_concurrent_searches() * 2,
+                                  compact_results=True)
         return DomainAppender(multi_domain=False)
 
-    def _append_domains(self, log_source_map):
+    def _append_domains(self, log_source_map, multi_domain):
         if log_source_map:
-            domain_appender = self._get_domain_appender()
+            domain_appender = self._get_domain_appender(multi_domain)
             domain_appender.add_domains(log_source_map)
+        return log_source_map
 
-    def _process_log_sources(self, log_sources):
+    def _check_permissions(self):
+        permission_check_result = Validator.perform_api_permission_check(self.aql_client)
+        if not permission_check_result.is_successful():
+            raise ValidatorException(permission_check_result.get_error_message())
+
+    def _load_windows_server_qids(self):
+        if self.command_line_parser.is_skip_windows_check() or not self.db_prefetcher:
+            return
+        # Loaded while the prompts were answered, onto the database service the windows device checks use
+        try:
+            self.db_prefetcher.get_windows_server_qids()
+        except (DatabaseError, TooManyResultsError) as err:
+            # Only a warm up, the qids are queried again when the first windows device is checked
+            logging.debug('Unable to load windows server qids ahead of time, Reason [%s]', err)
+
+    def _get_machine_identifier(self, log_source, identified=None):
+        if identified and log_source.get_sensor_device_id() in identified:
+            return identified[log_source.get_sensor_device_id()]
+        try:
+            machine_identifier = self.db_service.find_machine_identifier(log_source)
+        except (DatabaseError, TooManyResultsError) as err:
+            logging.error('Unable to retrieve machine identifier using hostname instead, Reason [%s]', err)
+            # The hostname fallback is neither checkpointed nor kept in the identifier cache
+            self.failed_identification_ids.add(log_source.get_sensor_device_id())
+            if self.identifier_cache:
+                self.identifier_cache.add_failed_log_source(log_source)
+            machine_identifier = log_source.get_hostname()
+        return MachineIdentifierParser.normalize_machine_identifier(machine_identifier)
+
+    def _load_protocol_configs(self):
+        try:
+            self.identifier_cache.set_protocol_configs(self.db_service.get_protocol_configs())
+        except (DatabaseError, TooManyResultsError) as err:
+            logging.warning(
+                'Unable to load the sensor protocol configs, every log source will be processed, '
+                'Reason [%s]', err)
+
+    def _identify_log_sources(self, log_source_map, identified=None):
+        # Identifying a log source queries the database so it runs while the domain search is in progress.
+        # Log sources identified before a resumed run was interrupted are not queried again
+        machine_identifiers = {}
+        if self.identifier_cache:
+            self._load_protocol_configs()
+        checkpoint_time = time.time()
+        for log_source_id, log_source in log_source_map.items():
+            if log_source.get_device_type_id() in LOG_SOURCE_EXCLUDE:
+                continue
+            if self.identifier_cache:
+                machine_identifiers[log_source_id] = self.identifier_cache.identify(
+                    log_source, functools.partial(self._get_machine_identifier, identified=identified))
+            else:
+                machine_identifiers[log_source_id] = self._get_machine_identifier(log_source, identified)
+            # Progress is checkpointed as it is made so a resumed run only identifies the remaining log sources
+            if time.time() - checkpoint_time >= self.IDENTIFY_CHECKPOINT_SECONDS:
+                self.phase_checkpoint.save('identify', self._encode_machine_identifiers(machine_identifiers))
+                checkpoint_time = time.time()
+        if self.identifier_cache:
+            logging.info('Identifier cache: %d log sources reused, %d log sources identified again',
+                         self.identifier_cache.get_unchanged_count(), self.identifier_cache.get_changed_count())
+        return machine_identifiers
+
+    @staticmethod
+    def _resolve_machine_identifiers(hostname_resolver, machine_identifiers):
+        # Lookups are kept by the resolver so the resolve stage of the processor reuses them
+        hostnames = set(machine_identifier for machine_identifier in machine_identifiers.values()
+                        if machine_identifier and not MachineIdentifierParser.is_ip_address(machine_identifier))
+        return hostname_resolver.resolve(sorted(hostnames))
+
+    @staticmethod
+    def _drain_log_sources(log_source_map):
+        # Each log source is removed from the map as it is handed over so only the device map keeps a reference
+        for sensor_device_id in list(log_source_map.keys()):
+            yield log_source_map.pop(sensor_device_id)
+
+    def _process_log_sources(self, log_source_map, machine_identifiers, hostname_resolver, spill_store):
         skip_windows_check = self.command_line_parser.is_skip_windows_check()
-        log_source_processor = LogSourceProcessor(self.db_service, self.aql_client, self.multi_domain)
-        log_source_processor.process_log_sources(log_sources, self.period_in_days, skip_windows_check)
+        windows_verdict_store = WindowsVerdictStore(WindowsVerdictStore.DEFAULT_STORE_FILE,
+                                                    self.command_line_parser.get_windows_cache_ttl())
+        log_source_processor = LogSourceProcessor(self.db_service,
+                                                  self.aql_client,
+                                                  self.multi_domain,
+                                                  self.command_line_parser.get_max_concurrent_searches(),
+                                                  hostname_resolver=hostname_resolver,
+                                                  machine_identifiers=machine_identifiers,
+                                                  windows_verdict_store=windows_verdict_store,
+                                                  spill_store=spill_store)
+        try:
+            # The processor consumes the log sources as a stream so no second copy of the map is built
+            log_source_processor.process_log_sources(self._drain_log_sources(log_source_map), self.period_in_days,
+                                                     skip_windows_check)
+        finally:
+            windows_verdict_store.close()
+        if self.identifier_cache:
+            self.identifier_cache.save()
+        if windows_verdict_store.get_hit_count() or windows_verdict_store.get_miss_count():
+            logging.info('Windows verdict store hits = %d, misses = %d', windows_verdict_store.get_hit_count(),
+                         windows_verdict_store.get_miss_count())
         return log_source_processor
 
+    @staticmethod
+    def _encode_log_source_map(log_source_map):
+        return [log_source.to_values() for log_source in log_source_map.values()]
+
+    @staticmethod
+    def _decode_log_source_map(values, *_):
+        log_source_map = {}
+        for log_source_values in values:
+            log_source = LogSource.from_values(log_source_values)
+            log_source_map[log_source.get_sensor_device_id()] = log_source
+        return log_source_map
+
+    def _restore_domain_setup(self, multi_domain, *_):
+        self.multi_domain = multi_domain
+        return multi_domain
+
+    def _encode_machine_identifiers(self, machine_identifiers):
+        return sorted((log_source_id, machine_identifier)
+                      for log_source_id, machine_identifier in machine_identifiers.items()
+                      if log_source_id not in self.failed_identification_ids)
+
+    def _restore_identified_log_sources(self, values, log_source_map):
+        # The log source map is identified again so only log sources missing from the checkpoint are queried
+        return self._identify_log_sources(
+            log_source_map,
+            dict((log_source_id, LogSource.to_native_string(machine_identifier))
+                 for log_source_id, machine_identifier in values))
+
+    @staticmethod
+    def _restore_hostname_resolution(hostname_resolver, values):
+        device_ips = dict((LogSource.to_native_string(machine_identifier), LogSource.to_native_string(device_ip))
+                          for machine_identifier, device_ip in values.items())
+        hostname_resolver.add_lookups(device_ips)
+        return device_ips
+
+    def _build_phase_scheduler(self, hostname_resolver, spill_store):
+        # Phases that query the database, ariel or dns are checkpointed so an interrupted run can be resumed
+        checkpoint = self.phase_checkpoint
+        scheduler = PhaseScheduler()
+        scheduler.add_task('permission check', self._check_permissions)
+        scheduler.add_task('windows server qids', self._load_windows_server_qids)
+        scheduler.add_task(
+            'log source load',
+            checkpoint.wrap('log source load', lambda _: self._build_log_source_map(), self._encode_log_source_map,
+                            self._decode_log_source_map), ['permission check'])
+        scheduler.add_task(
+            'domain count',
+            checkpoint.wrap('domain count', lambda _: self._store_domain_setup(), decode=self._restore_domain_setup),
+            ['permission check'])
+        scheduler.add_task(
+            'domain search',
+            checkpoint.wrap('domain search', self._append_domains, self._encode_log_source_map,
+                            self._decode_log_source_map), ['log source load', 'domain count'])
+        scheduler.add_task(
+            'identify',
+            checkpoint.wrap('identify', self._identify_log_sources, self._encode_machine_identifiers,
+                            self._restore_identified_log_sources), ['log source load'])
+        scheduler.add_task(
+            'hostname resolution',
+            checkpoint.wrap(
+                'hostname resolution',
+                lambda machine_identifiers: self._resolve_machine_identifiers(hostname_resolver, machine_identifiers),
+                decode=lambda device_ips, _: self._restore_hostname_resolution(hostname_resolver, device_ips)),
+            ['identify'])
+        scheduler.add_task(
+            'log source processing', lambda log_source_map, machine_identifiers, *_: self._process_log_sources(
+                log_source_map, machine_identifiers, hostname_resolver, spill_store),
+            ['domain search', 'identify', 'hostname resolution', 'windows server qids'])
+        scheduler.add_task('output',
+                           lambda log_source_processor: self._output_results(log_source_processor.get_mvs_results()),
+                           ['log source processing'])
+        return scheduler
+
+    def _run_phases(self):
+        hostname_resolver = HostnameResolver(self.command_line_parser.get_dns_workers(),
+                                             self.command_line_parser.get_dns_timeout(),
+                                             self.command_line_parser.get_dns_overall_timeout())
+        spill_store = SpillStore(self.command_line_parser.get_memory_limit())
+        if self.command_line_parser.is_cache_identifiers():
+            self.identifier_cache = IdentifierCache(IdentifierCache.DEFAULT_STATE_FILE)
+            self.identifier_cache.load()
+        # Checkpoints are only resumed against the same console and time period
+        self.phase_checkpoint = PhaseCheckpoint(
+            PhaseCheckpoint.DEFAULT_DIRECTORY,
+            {'console': self.console_hostname, 'period_in_days': self.period_in_days})
+        self.phase_checkpoint.start(self.command_line_parser.is_resume())
+        scheduler = self._build_phase_scheduler(hostname_resolver, spill_store)
+        dns_cache = DNSCache(ttl=self.command_line_parser.get_dns_cache_ttl(),
+                             negative_ttl=self.command_line_parser.get_dns_negative_ttl(),
+                             override_file=self.command_line_parser.get_dns_overrides())
+        dns_cache.load()
+        IPParser.set_dns_cache(dns_cache)
+        try:
+            scheduler.run()
+            # A completed run has nothing left to resume
+            self.phase_checkpoint.clear()
+        finally:
+            IPParser.set_dns_cache(None)
+            dns_cache.save()
+            spill_store.close()
+            if self.identifier_cache:
+                self.identifier_cache.close()
+            self._log_phase_timings(scheduler)
+        if self.phase_checkpoint.get_resumed_phases():
+            logging.info('Phases resumed from checkpoints = %s', ', '.join(self.phase_checkpoint.get_resumed_phases()))
+        if spill_store.get_spilled_count():
+            logging.info('Log sources kept on disk = %d', spill_store.get_spilled_count())
+        logging.info('DNS cache hits = %d, misses = %d', dns_cache.get_hit_count(), dns_cache.get_miss_count())
+        return scheduler.get_result('log source processing')
+
     def _output_results(self, mvs_results):
         skip_windows_check = self.command_line_parser.is_skip_windows_check()
-        results_generator = ResultsGenerator(mvs_results, self.period_in_days, skip_windows_check)
-        results_generator.write_results_to_csv(self.command_line_parser.get_csv_file())
+        results_generator = ResultsGenerator(mvs_results, self.period_in_days, skip_windows_check, self.request_stats)
+        compression = self.command_line_parser.get_compression()
+        if self.command_line_parser.is_split_output():
+            detail_files = results_generator.write_split_results_to_csv(self.command_line_parser.get_csv_file(),
+                                                                        compression)
+            logging.info('Detail files written = %s', ', '.join(detail_files))
+        else:
+            results_generator.write_results_to_csv(self.command_line_parser.get_csv_file(), compression)
+        if self.command_line_parser.is_json_output():
+            json_files = results_generator.write_results_to_json(self.command_line_parser.get_csv_file(), compression)
+            logging.info('JSON results written = %s', ', '.join(json_files))
+        if self.command_line_parser.get_results_db():
+            run_id = ResultsDatabase(self.command_line_parser.get_results_db()).write_results(
+                mvs_results, self.period_in_days, skip_windows_check)
+            logging.info('Results added to %s as run %d', self.command_line_parser.get_results_db(), run_id)
         results_generator.output_results()
+        self._record_run_history(mvs_results, results_generator)
+
+    def _record_run_history(self, mvs_results, results_generator):
+        run_history = RunHistoryStore(RunHistoryStore.DEFAULT_STORE_FILE)
+        try:
+            run_history.load()
+            device_domains = RunHistoryStore.get_device_domains(mvs_results)
+            run_id = run_history.record_run(device_domains, mvs_results.get_mvs_count(), self.period_in_days)
+            logging.info('Run recorded in run history as run %d', run_id)
+            diff_run_id = self.command_line_parser.get_diff_run_id()
+            if diff_run_id is None:
+                return
+            previous_run_id = diff_run_id or run_history.get_previous_run_id(run_id)
+            if previous_run_id is None or not run_history.get_run(previous_run_id):
+                print('No previous run {}found in the run history to compare with'.format(
+                    '{} '.format(diff_run_id) if diff_run_id else ''))
+                return
+            run_diff = RunHistoryStore.diff(run_history.get_run_device_domains(previous_run_id), device_domains)
+            diff_filename = ResultsGenerator.get_diff_filename(self.command_line_parser.get_csv_file())
+            results_generator.write_run_diff_to_csv(diff_filename, previous_run_id, run_diff)
+            results_generator.output_run_diff(previous_run_id, run_diff)
+        except sqlite3.Error as err:
+            # The report has already been written, an unusable run history only loses the history
+            logging.warning('Unable to update run history %s, Reason [%s]', RunHistoryStore.DEFAULT_STORE_FILE, err)
+            if self.command_line_parser.get_diff_run_id() is not None:
+                print('Unable to compare with a previous run, the run history could not be read')
+        finally:
+            run_history.close()
 
     def _close_db_connection(self):
+        if self.db_prefetcher and self.db_prefetcher.is_running():
+            # The connection is still in use by the prefetch, it is closed when the process exits
+            return
         if self.db_client:
             self.db_client.close()
 
+    def _get_time_period(self, period_in_days):
+        return int(round(time.time() * 1000)) - (int(period_in_days) * self.DAY_IN_MILLISECONDS)
+
+    def _start_db_prefetch(self):
+        self.db_prefetcher = DatabasePrefetcher(self._init_db_service,
+                                                self._get_time_period(self.MAXIMUM_PERIOD_IN_DAYS),
+                                                not self.command_line_parser.is_skip_windows_check())
+        self.db_prefetcher.start()
+
     def _build_log_source_map(self):
+        yesterday = self._get_time_period(self.period_in_days)
+        if self.db_prefetcher:
+            return self.db_prefetcher.get_log_source_map(yesterday)
         self._init_db_service()
-        yesterday = int(round(time.time() * 1000)) - (int(self.period_in_days) * self.DAY_IN_MILLISECONDS)
         return self.db_service.build_log_source_map(yesterday)
 
     def _store_domain_setup(self):
-        domain_count = self.db_service.get_domain_count()
+        if self.db_prefetcher:
+            domain_count = self.db_prefetcher.get_domain_count()
+        else:
+            domain_count = self.db_service.get_domain_count()
         if domain_count > 1:
             self.multi_domain = True
         logging.info('Count of domains is %d', domain_count)
         logging.info('Multi-Domain system is %s', self.multi_domain)
+        return self.multi_domain
 
     def _display_skip_workstation_check_notice(self):
         if self.command_line_parser.is_skip_windows_check():
@@ -1591,24 +4557,47 @@ class MVSProcessor(object):
         self.period_in_days = time_period_reader.prompt_for_time_period(self.DEFAULT_PERIOD_IN_DAYS,
                                                                         self.MAXIMUM_PERIOD_IN_DAYS)
 
-    def _build_log_sources_list(self):
-        log_source_map = self._build_log_source_map()
-        self._store_domain_setup()
-        self._append_domains(log_source_map)
-        return log_source_map.values()
+    def _log_request_summary(self):
+        if self.request_stats:
+            logging.info('API requests = %d, retries = %d, failures = %d, average latency = %dms, max latency = %dms',
+                         self.request_stats.get_request_count(), self.request_stats.get_retry_count(),
+                         self.request_stats.get_failure_count(), self.request_stats.get_average_latency_ms(),
+                         self.request_stats.get_max_latency_ms())
+
+    @staticmethod
+    def _log_pipeline_summary(log_source_processor):
+        for summary in log_source_processor.get_pipeline_summary():
+            logging.info('Pipeline stage %s: items in = %d, items out = %d, seconds = %s, items per second = %d',
+                         summary['stage'], summary['items_in'], summary['items_out'], summary['seconds'],
+                         summary['throughput'])
+
+    @staticmethod
+    def _log_phase_timings(scheduler):
+        for timing in scheduler.get_timings():
+            logging.info('Phase %s: started after %s seconds, seconds = %s', timing['task'], timing['started'],
+                         timing['seconds'])
+
+    def _log_governor_summary(self):
+        governor = self.aql_client.get_governor()
+        if isinstance(governor, AQLConcurrencyGovernor):
+            summary = governor.get_summary()
+            logging.info(
+                'Peak concurrent ariel searches = %d, peak concurrent ariel requests = %d, '
+                'throttled responses = %d', summary['peak_searches'], summary['peak_requests'],
+                summary['throttled_responses'])
 
     def _generate_mvs_results(self):
+        Validator.check_compression(self.command_line_parser.get_compression())
+        self._start_db_prefetch()
         self._display_skip_workstation_check_notice()
         self._store_period_in_days()
         self._init_aql_client(self.command_line_parser.is_insecure())
-        permission_check_result = Validator.perform_api_permission_check(self.aql_client)
-        if not permission_check_result.is_successful():
-            raise ValidatorException(permission_check_result.get_error_message())
-        log_sources = self._build_log_sources_list()
-        log_source_processor = self._process_log_sources(log_sources)
+        log_source_processor = self._run_phases()
+        self._log_pipeline_summary(log_source_processor)
         mvs_results = log_source_processor.get_mvs_results()
-        self._output_results(mvs_results)
         logging.info('Total log sources considered = %s', mvs_results.get_log_source_count())
+        self._log_request_summary()
+        self._log_governor_summary()
 
     def run(self):
         try:
@@ -1619,7 +4608,7 @@ class MVSProcessor(object):
             self._generate_mvs_results()
             return 0
         except (DatabaseError, DomainRetrievalException, IOError, LogSourceRetrievalException, ValidatorException,
-                WindowsWorkstationRetrievalException, MyVerException) as err:
+                WindowsWorkstationRetrievalException, MyVerException, MVSCountException) as err:
             print(err)
             return 1
         except KeyboardInterrupt:
@@ -1,9 +1,12 @@
 #! /usr/bin/env python
 
+import threading
+import time
 from mock import Mock
 import pytest
 from psycopg2 import DatabaseError
-from countMVS import DatabaseService, DomainRetrievalException, LogSource, LogSourceRetrievalException, TooManyResultsError
+from countMVS import DatabaseService, DomainRetrievalException, LogSource, LogSourceRetrievalException, TooManyResultsError, \
+WindowsServerQIDCache
 from tests.utils import read_db_row_from_file, read_db_rows_from_file
 
 LOG_SOURCE_ROWS_HAPPY_PATH_JSON_FILE = 'log_source_rows_happy_path.json'
@@ -55,6 +58,25 @@ def test_get_machine_identifier_exception_handled():
     assert db_service.get_machine_identifier(log_source) == "1.1.1.1"
 
 
+def test_find_machine_identifier_raises_database_error():
+    row = read_db_row_from_file(SINGLE_LOG_SOURCE_NON_ZERO_SPCONFIG_JSON_FILE)
+    log_source = LogSource.load_from_db_row(row)
+    db_client = Mock()
+    db_client.fetch_one.side_effect = DatabaseError(DATABASE_DUMMY_ERROR)
+    db_service = DatabaseService(db_client)
+    with pytest.raises(DatabaseError):
+        db_service.find_machine_identifier(log_source)
+
+
+def test_get_protocol_configs():
+    db_client = Mock()
+    db_client.fetch_all.return_value = [{'id': 1, 'spid': 2, 'value': '2.2.2.2'},
+                                        {'id': 1, 'spid': 2, 'value': '1.1.1.1'}, {'id': 3, 'spid': 0, 'value': None}]
+    db_service = DatabaseService(db_client)
+    assert db_service.get_protocol_configs() == {1: '2|1.1.1.1|2.2.2.2', 3: '0|'}
+    assert "IN ('ESXIP'," in db_client.fetch_all.call_args[0][0]
+
+
 def test_build_log_source_map_happy_path():
     rows = read_db_rows_from_file(LOG_SOURCE_ROWS_HAPPY_PATH_JSON_FILE)
     db_client = Mock()
@@ -118,3 +140,72 @@ def test_get_windows_server_qids():
     db_client.fetch_all.return_value = qids
     db_service = DatabaseService(db_client)
     assert all(elem in db_service.get_windows_server_qids() for elem in [5000921, 5000569, 5002963, 5000899])
+
+
+def test_windows_server_qids_only_queried_once():
+    db_client = Mock()
+    db_client.fetch_all.return_value = read_db_row_from_file(QIDS_JSON_FILE)
+    db_service = DatabaseService(db_client)
+    assert db_service.get_windows_server_qids() == db_service.get_windows_server_qids()
+    assert db_client.fetch_all.call_count == 1
+
+
+def test_windows_server_qids_loaded_once_by_concurrent_callers():
+    db_client = Mock()
+
+    def fetch_qids(_):
+        time.sleep(0.1)
+        return read_db_row_from_file(QIDS_JSON_FILE)
+
+    db_client.fetch_all.side_effect = fetch_qids
+    db_service = DatabaseService(db_client)
+    fragments = []
+    threads = [
+        threading.Thread(target=lambda: fragments.append(db_service.get_windows_server_qid_fragment()))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert db_client.fetch_all.call_count == 1
+    assert len(set(fragments)) == 1 and fragments[0]
+
+
+def build_qid_cache_db_client(content_hash='a1b2'):
+    db_client = Mock()
+    db_client.fetch_one.return_value = {'count': 4, 'content_hash': content_hash}
+    db_client.fetch_all.return_value = read_db_row_from_file(QIDS_JSON_FILE)
+    return db_client
+
+
+def test_windows_server_qids_reused_until_dsm_changes(tmpdir):
+    qid_cache = WindowsServerQIDCache(str(tmpdir.join('state', 'windows_server_qids.json')))
+    db_client = build_qid_cache_db_client()
+    db_service = DatabaseService(db_client, qid_cache)
+    qids = db_service.get_windows_server_qids()
+    assert db_service.get_windows_server_qid_fragment() == ','.join(str(qid) for qid in qids)
+    db_client = build_qid_cache_db_client()
+    db_service = DatabaseService(db_client, qid_cache)
+    assert db_service.get_windows_server_qids() == qids
+    assert db_service.get_windows_server_qid_fragment() == ','.join(str(qid) for qid in qids)
+    db_client.fetch_all.assert_not_called()
+    # An edited qid or device event id only changes the hash of the mapped rows
+    db_client = build_qid_cache_db_client(content_hash='c3d4')
+    DatabaseService(db_client, qid_cache).get_windows_server_qids()
+    assert db_client.fetch_all.call_count == 1
+
+
+def test_windows_server_qids_queried_when_fingerprint_fails(tmpdir):
+    qid_cache = WindowsServerQIDCache(str(tmpdir.join('windows_server_qids.json')))
+    db_client = build_qid_cache_db_client()
+    db_client.fetch_one.side_effect = DatabaseError(DATABASE_DUMMY_ERROR)
+    db_service = DatabaseService(db_client, qid_cache)
+    assert 5000921 in db_service.get_windows_server_qids()
+    assert not tmpdir.join('windows_server_qids.json').exists()
+
+
+def test_corrupt_windows_server_qid_cache_ignored(tmpdir):
+    cache_file = tmpdir.join('windows_server_qids.json')
+    cache_file.write('not json')
+    assert WindowsServerQIDCache(str(cache_file)).load('fingerprint') is None
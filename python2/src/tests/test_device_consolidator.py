@@ -0,0 +1,42 @@
+#! /usr/bin/env python
+
+from countMVS import DeviceConsolidator
+
+DNS = DeviceConsolidator.DNS_MERGE_REASON
+
+
+def test_unmerged_identifier_is_own_representative():
+    consolidator = DeviceConsolidator()
+    consolidator.add('1.1.1.1')
+    assert consolidator.get_representative('1.1.1.1') == '1.1.1.1'
+    assert consolidator.is_merged('1.1.1.1') is False
+    assert not consolidator.get_merges()
+
+
+def test_target_representative_kept():
+    consolidator = DeviceConsolidator()
+    consolidator.union('a.test.com', '1.1.1.1', DNS)
+    consolidator.union('b.test.com', '1.1.1.1', DNS)
+    consolidator.union('c.test.com', 'b.test.com', 'alias')
+    for identifier in ['a.test.com', 'b.test.com', 'c.test.com', '1.1.1.1']:
+        assert consolidator.get_representative(identifier) == '1.1.1.1'
+        assert consolidator.is_merged(identifier) is True
+    assert consolidator.get_merges() == {
+        'a.test.com': ('1.1.1.1', DNS), 'b.test.com': ('1.1.1.1', DNS), 'c.test.com': ('b.test.com', 'alias')
+    }
+
+
+def test_merging_same_set_records_nothing():
+    consolidator = DeviceConsolidator()
+    consolidator.union('a.test.com', '1.1.1.1', DNS)
+    consolidator.union('1.1.1.1', 'a.test.com', DNS)
+    assert consolidator.get_representative('a.test.com') == '1.1.1.1'
+    assert list(consolidator.get_merges().keys()) == ['a.test.com']
+
+
+def test_long_merge_chains_resolved():
+    consolidator = DeviceConsolidator()
+    for index in range(10000):
+        consolidator.union('host{}'.format(index), 'host{}'.format(index + 1), DNS)
+    assert consolidator.get_representative('host0') == 'host10000'
+    assert consolidator.get_representative('host5000') == 'host10000'
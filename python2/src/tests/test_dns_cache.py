@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+
+import socket
+from socket import gaierror
+from mock import patch
+from countMVS import DNSCache, IPParser
+
+DUMMY_IP = '1.1.1.1'
+DUMMY_HOSTNAME = 'test.com'
+
+
+def build_dns_cache(tmpdir, ttl=DNSCache.DEFAULT_TTL_SECONDS, override_file=None):
+    dns_cache = DNSCache(str(tmpdir.join('state', 'dns_cache.json')), ttl=ttl, override_file=override_file)
+    dns_cache.load()
+    return dns_cache
+
+
+def test_entries_persisted_between_runs(tmpdir):
+    dns_cache = build_dns_cache(tmpdir)
+    dns_cache.store(DUMMY_HOSTNAME, DUMMY_IP)
+    dns_cache.store('unknown.test.com', None)
+    dns_cache.save()
+    dns_cache = build_dns_cache(tmpdir)
+    assert dns_cache.lookup(DUMMY_HOSTNAME) == (True, DUMMY_IP)
+    assert dns_cache.lookup('unknown.test.com') == (True, None)
+    assert dns_cache.lookup('other.test.com') == (False, None)
+    assert dns_cache.get_hit_count() == 2
+    assert dns_cache.get_miss_count() == 1
+
+
+def test_expired_entries_not_returned(tmpdir):
+    dns_cache = build_dns_cache(tmpdir)
+    dns_cache.store(DUMMY_HOSTNAME, DUMMY_IP)
+    dns_cache.save()
+    dns_cache = build_dns_cache(tmpdir, ttl=0)
+    assert dns_cache.lookup(DUMMY_HOSTNAME) == (False, None)
+
+
+def test_unreadable_cache_file_ignored(tmpdir):
+    tmpdir.join('state', 'dns_cache.json').write('not json', ensure=True)
+    dns_cache = build_dns_cache(tmpdir)
+    assert dns_cache.lookup(DUMMY_HOSTNAME) == (False, None)
+
+
+def test_override_file_used(tmpdir):
+    override_file = tmpdir.join('hosts')
+    override_file.write('# static entries\n2.2.2.2 internal.test.com internal\n')
+    dns_cache = build_dns_cache(tmpdir, override_file=str(override_file))
+    assert dns_cache.lookup('internal.test.com') == (True, '2.2.2.2')
+    assert dns_cache.lookup('internal') == (True, '2.2.2.2')
+
+
+def test_override_hostnames_normalized(tmpdir):
+    override_file = tmpdir.join('hosts')
+    override_file.write('3.3.3.3 FileServer01.Corp.Local host.corp.\n')
+    dns_cache = build_dns_cache(tmpdir, override_file=str(override_file))
+    assert dns_cache.lookup('fileserver01.corp.local') == (True, '3.3.3.3')
+    assert dns_cache.lookup('host.corp') == (True, '3.3.3.3')
+
+
+def test_ip_parser_uses_cache(tmpdir):
+    dns_cache = build_dns_cache(tmpdir)
+    IPParser.set_dns_cache(dns_cache)
+    try:
+        with patch('socket.gethostbyname', return_value=DUMMY_IP) as mock_gethostbyname:
+            assert IPParser.get_device_ip(DUMMY_HOSTNAME) == DUMMY_IP
+            assert IPParser.get_device_ip(DUMMY_HOSTNAME) == DUMMY_IP
+            assert mock_gethostbyname.call_count == 1
+    finally:
+        IPParser.set_dns_cache(None)
+
+
+def test_ip_parser_caches_failed_lookups(tmpdir):
+    dns_cache = build_dns_cache(tmpdir)
+    IPParser.set_dns_cache(dns_cache)
+    try:
+        with patch('socket.gethostbyname', side_effect=gaierror(socket.EAI_NONAME, 'Name or service not known')):
+            assert IPParser.get_device_ip(DUMMY_HOSTNAME) is None
+        with patch('socket.gethostbyname', side_effect=gaierror(socket.EAI_AGAIN, 'Temporary failure')):
+            assert IPParser.get_device_ip('other.test.com') is None
+        assert dns_cache.lookup(DUMMY_HOSTNAME) == (True, None)
+        assert dns_cache.lookup('other.test.com') == (False, None)
+    finally:
+        IPParser.set_dns_cache(None)
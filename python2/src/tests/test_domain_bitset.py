@@ -0,0 +1,29 @@
+#! /usr/bin/env python
+
+from countMVS import DomainBitset
+
+
+def test_domains_interned_as_bits():
+    domain_bitset = DomainBitset()
+    assert domain_bitset.get_mask(['Domain One']) == 1
+    assert domain_bitset.get_mask(['Domain Two', 'Domain One']) == 3
+    assert domain_bitset.get_mask(['Domain Three']) == 4
+    assert domain_bitset.get_domain_id('Domain Two') == 1
+
+
+def test_mask_converted_back_to_domains():
+    domain_bitset = DomainBitset()
+    mask = domain_bitset.get_mask(['Domain One', 'Domain Two']) | domain_bitset.get_mask(['Domain Three'])
+    assert domain_bitset.get_domains(mask) == ['Domain One', 'Domain Two', 'Domain Three']
+    assert DomainBitset.count(mask) == 3
+    assert not domain_bitset.get_domains(0)
+
+
+def test_domains_counted_across_devices():
+    domain_bitset = DomainBitset()
+    masks = [
+        domain_bitset.get_mask(['Domain One', 'Domain Two']),
+        domain_bitset.get_mask(['Domain One']),
+        domain_bitset.get_mask(['Domain Two', 'Domain One'])
+    ]
+    assert domain_bitset.count_domains(masks) == {'Domain One': 3, 'Domain Two': 2}
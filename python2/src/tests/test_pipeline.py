@@ -0,0 +1,26 @@
+#! /usr/bin/env python
+
+from countMVS import PipelineStage
+
+
+def keep_even(value):
+    if value % 2 == 0:
+        return value
+    return None
+
+
+def test_stage_drops_none_results():
+    stage = PipelineStage('even', keep_even)
+    assert list(stage.run(range(10))) == [0, 2, 4, 6, 8]
+    summary = stage.get_summary()
+    assert summary['stage'] == 'even'
+    assert summary['items_in'] == 10
+    assert summary['items_out'] == 5
+
+
+def test_batch_stage_recorded():
+    stage = PipelineStage('batch')
+    items = [1, 2, 3]
+    stage.run_batch(items.pop, 3, lambda: len(items))
+    assert stage.get_summary()['items_in'] == 3
+    assert stage.get_summary()['items_out'] == 2
@@ -1,9 +1,10 @@
 #! /usr/bin/env python
 
 import pytest
-from requests.exceptions import RequestException
+from requests.exceptions import ChunkedEncodingError, ConnectTimeout, ReadTimeout, RequestException
 from mock import Mock, patch
-from countMVS import APIException, ArielSearch, AQLClient, Auth, DomainAppender, RESTClient, RESTException
+from countMVS import APIException, ArielSearch, AQLClient, Auth, DomainAppender, RESTClient, RESTException, \
+RetryPolicy
 from tests.utils import read_response_from_file
 
 
@@ -185,3 +186,135 @@ def test_rest_client_post_request_error():
         with pytest.raises(APIException) as exception:
             rest_client.post(path=AQLClient.ARIEL_SEARCHES_ENDPOINT, params=query_params)
         assert 'error' in str(exception)
+
+
+def build_response_mock(status_code, response_file='post_search.json'):
+    response_mock = Mock()
+    response_mock.status_code = status_code
+    response_mock.json.return_value = read_response_from_file(response_file)
+    return response_mock
+
+
+def build_retrying_rest_client(max_retries=3):
+    rest_client = RESTClient('test', retry_policy=RetryPolicy(max_retries=max_retries, backoff_seconds=0))
+    client_auth = Auth()
+    client_auth.set_password('test')
+    rest_client.set_client_auth(client_auth)
+    return rest_client
+
+
+def test_rest_client_get_retried_after_request_error():
+    rest_client = build_retrying_rest_client()
+    with patch("requests.get") as mock_requests_get, patch("time.sleep"):
+        mock_requests_get.side_effect = [RequestException('error'), build_response_mock(200)]
+        response_json = rest_client.get(path=AQLClient.ARIEL_SEARCH_ENDPOINT.format('test'))
+        assert ArielSearch.from_json(response_json).get_status() == 'WAIT'
+        assert mock_requests_get.call_count == 2
+        assert rest_client.get_request_stats().get_request_count() == 2
+        assert rest_client.get_request_stats().get_retry_count() == 1
+
+
+def test_rest_client_get_retried_after_gateway_error():
+    rest_client = build_retrying_rest_client()
+    with patch("requests.get") as mock_requests_get, patch("time.sleep"):
+        mock_requests_get.side_effect = [build_response_mock(502), build_response_mock(200)]
+        rest_client.get(path=AQLClient.ARIEL_SEARCH_ENDPOINT.format('test'))
+        assert mock_requests_get.call_count == 2
+
+
+def test_rest_client_get_not_retried_after_server_error():
+    rest_client = build_retrying_rest_client()
+    with patch("requests.get") as mock_requests_get, patch("time.sleep"):
+        mock_requests_get.return_value = build_response_mock(500, 'unauthorized.json')
+        with pytest.raises(RESTException):
+            rest_client.get(path=AQLClient.ARIEL_SEARCH_ENDPOINT.format('test'))
+        assert mock_requests_get.call_count == 1
+        assert rest_client.get_request_stats().get_failure_count() == 1
+
+
+def test_rest_client_get_gives_up_after_max_retries():
+    rest_client = build_retrying_rest_client(max_retries=2)
+    with patch("requests.get") as mock_requests_get, patch("time.sleep"):
+        mock_requests_get.side_effect = RequestException('error')
+        with pytest.raises(APIException):
+            rest_client.get(path=AQLClient.ARIEL_SEARCH_ENDPOINT.format('test'))
+        assert mock_requests_get.call_count == 3
+
+
+def test_rest_client_post_retried_when_not_sent():
+    rest_client = build_retrying_rest_client()
+    with patch("requests.post") as mock_requests_post, patch("time.sleep"):
+        mock_requests_post.side_effect = [ConnectTimeout('error'), build_response_mock(201)]
+        response_json = rest_client.post(path=AQLClient.ARIEL_SEARCHES_ENDPOINT, success_code=201)
+        assert ArielSearch.from_json(response_json).get_status() == 'WAIT'
+        assert mock_requests_post.call_count == 2
+
+
+def test_rest_client_post_not_retried_after_read_timeout():
+    rest_client = build_retrying_rest_client()
+    with patch("requests.post") as mock_requests_post, patch("time.sleep"):
+        mock_requests_post.side_effect = ReadTimeout('error')
+        with pytest.raises(APIException):
+            rest_client.post(path=AQLClient.ARIEL_SEARCHES_ENDPOINT, success_code=201)
+        assert mock_requests_post.call_count == 1
+
+
+def test_rest_client_timeout_passed_to_requests():
+    rest_client = RESTClient('test', retry_policy=RetryPolicy(timeout=(1, 2)))
+    with patch("requests.get") as mock_requests_get:
+        mock_requests_get.return_value = build_response_mock(200)
+        rest_client.get(path=AQLClient.ARIEL_SEARCH_ENDPOINT.format('test'))
+        mock_requests_get.assert_called_with("https://test{}".format(AQLClient.ARIEL_SEARCH_ENDPOINT).format('test'),
+                                             headers={},
+                                             auth=None,
+                                             verify=True,
+                                             timeout=(1, 2))
+
+
+def test_rest_client_get_stream_requests_compressed_response():
+    rest_client = RESTClient('test')
+    with patch("requests.get") as mock_requests_get:
+        response_mock = build_response_mock(200)
+        mock_requests_get.return_value = response_mock
+        response = rest_client.get_stream(path=AQLClient.ARIEL_SEARCH_RESULTS_ENDPOINT.format('test'),
+                                          headers={'Accept': 'application/csv'})
+        assert response is response_mock
+        mock_requests_get.assert_called_with("https://test{}".format(
+            AQLClient.ARIEL_SEARCH_RESULTS_ENDPOINT).format('test'),
+                                             headers={'Accept': 'application/csv', 'Accept-Encoding': 'gzip, deflate'},
+                                             auth=None,
+                                             verify=True,
+                                             stream=True)
+
+
+def test_rest_client_get_stream_non_success_response_code():
+    rest_client = RESTClient('test')
+    with patch("requests.get") as mock_requests_get:
+        response_mock = build_response_mock(401, 'unauthorized.json')
+        mock_requests_get.return_value = response_mock
+        with pytest.raises(RESTException) as err:
+            rest_client.get_stream(path=AQLClient.ARIEL_SEARCH_RESULTS_ENDPOINT.format('test'))
+        assert err.value.get_api_error().get_response_code() == 401
+        response_mock.close.assert_called_once_with()
+
+
+def test_rest_client_read_stream_retried_after_broken_body():
+    rest_client = build_retrying_rest_client()
+    responses = [build_response_mock(200), build_response_mock(200)]
+    read_response = Mock(side_effect=[ChunkedEncodingError('Connection broken'), ['row']])
+    with patch("requests.get", side_effect=responses):
+        assert rest_client.read_stream(AQLClient.ARIEL_SEARCH_RESULTS_ENDPOINT.format('test'),
+                                       read_response) == ['row']
+    assert read_response.call_count == 2
+    responses[0].close.assert_called_once_with()
+    responses[1].close.assert_called_once_with()
+    assert rest_client.get_request_stats().get_retry_count() == 1
+
+
+def test_rest_client_read_stream_raises_api_exception_after_retries():
+    rest_client = build_retrying_rest_client(max_retries=1)
+    read_response = Mock(side_effect=ReadTimeout('Read timed out'))
+    with patch("requests.get", side_effect=[build_response_mock(200), build_response_mock(200)]):
+        with pytest.raises(APIException):
+            rest_client.read_stream(AQLClient.ARIEL_SEARCH_RESULTS_ENDPOINT.format('test'), read_response)
+    assert read_response.call_count == 2
@@ -1,9 +1,12 @@
 #! /usr/bin/env python
 
 import csv
+import gzip
 import io
+import json
+import os
 from mock import mock_open, patch
-from countMVS import LogSource, MVSResults, ResultsGenerator
+from countMVS import LogSource, MVSResults, ReportWriter, RequestStats, ResultsGenerator
 from tests.utils import read_db_row_from_file
 
 ZSCALAR_LOG_SOURCE_JSON_FILE = 'zscalar_log_source.json'
@@ -83,9 +86,192 @@ def test_write_results_to_csv():
         print(output.getvalue())
 
 
+def test_api_request_summary_written():
+    output = io.BytesIO()
+    request_stats = RequestStats()
+    request_stats.record_request(0.5)
+    request_stats.record_request(1.5)
+    request_stats.record_retry()
+    results_generator = ResultsGenerator(MVSResults(), 1, False, request_stats)
+    results_generator._write_api_request_summary(output)
+    summary = output.getvalue()
+    assert 'API Requests = 2\n' in summary
+    assert 'API Request Retries = 1\n' in summary
+    assert 'API Request Average Latency (ms) = 1000\n' in summary
+    assert summary.endswith('API Request Max Latency (ms) = 1500')
+
+
+def test_resolution_summary_written():
+    output = io.BytesIO()
+    mvs_results = MVSResults()
+    mvs_results.set_resolution_summary({'resolved': 3, 'failed': 2, 'timed_out': 1})
+    results_generator = ResultsGenerator(mvs_results, 1, False)
+    results_generator._write_resolution_summary(output)
+    summary = output.getvalue()
+    assert 'Hostname Lookups Resolved = 3\n' in summary
+    assert 'Hostname Lookups Failed = 2\n' in summary
+    assert summary.endswith('Hostname Lookups Timed Out = 1')
+
+
+def test_abandoned_lookups_reported(capsys):
+    output = io.BytesIO()
+    mvs_results = MVSResults()
+    mvs_results.set_resolution_summary(
+        {'resolved': 1, 'failed': 0, 'timed_out': 2, 'abandoned': ['a.test.com', 'b.test.com']})
+    results_generator = ResultsGenerator(mvs_results, 1, False)
+    results_generator._write_resolution_summary(output)
+    assert output.getvalue().endswith('Devices Counted Without Hostname Resolution = a.test.com b.test.com')
+    results_generator.output_results()
+    assert '2 devices were counted without hostname resolution' in capsys.readouterr().out
+
+
+def test_merged_identifiers_written():
+    output = io.BytesIO()
+    mvs_results = MVSResults()
+    mvs_results.set_device_map(build_mock_device_map())
+    mvs_results.set_merged_identifiers({'b.test.com': ('1.1.1.1', 'dns'), 'a.test.com': ('1.1.1.1', 'dns')})
+    results_generator = ResultsGenerator(mvs_results, 1, False)
+    results_generator._write_mvs_log_source_details(output, csv.writer(output))
+    assert 'MVS Device Id = 1.1.1.1\nMerged Machine Identifiers = a.test.com (dns), b.test.com (dns)\n' in output.getvalue(
+    )
+    assert 'MVS Device Id = 2.2.2.2\nID' in output.getvalue()
+
+
 def test_output_results():
     mvs_results = MVSResults()
     mvs_results.set_mvs_count(5)
     mvs_results.set_domain_count_map(build_mock_domain_count_map())
     results_generator = ResultsGenerator(mvs_results, 1, False)
     results_generator.output_results()
+
+
+def test_report_writer_flushes_in_blocks():
+    output = io.BytesIO()
+    report_writer = ReportWriter(output, 10)
+    report_writer.write('12345')
+    assert output.getvalue() == ''
+    report_writer.write('67890')
+    assert output.getvalue() == '1234567890'
+    report_writer.write('end')
+    report_writer.flush()
+    assert output.getvalue() == '1234567890end'
+
+
+def test_device_sections_separated(tmpdir):
+    csv_filename = str(tmpdir.join('test.csv'))
+    mvs_results = MVSResults()
+    mvs_results.set_device_map(build_mock_device_map())
+    mvs_results.add_windows_workstation('127.0.0.1', build_mock_windows_workstation_log_sources())
+    mvs_results.add_windows_workstation('127.0.0.2', build_mock_windows_workstation_log_sources())
+    ResultsGenerator(mvs_results, 1, False).write_results_to_csv(csv_filename)
+    with open(csv_filename) as csv_file:
+        report = csv_file.read()
+    device_list = report.split('MVS List:\n')[1].split('\n\nLog Source Details:\nMVS Device Id = ')[0]
+    assert sorted(device_list.split('\n')) == ['1.1.1.1', '2.2.2.2']
+    assert report.count('\n\nMVS Device Id = ') == 2
+    assert 'Windows Workstations:\nMVS Device Id = 127.0.0.' in report
+    assert report.count(ResultsGenerator.LOG_SOURCE_HEADER) == 4
+
+
+def test_log_source_rows_follow_column_order():
+    results_generator = ResultsGenerator(MVSResults(), 1, False)
+    log_sources = [LogSource(1, '1.1.1.1', ['Domain One', 'Domain Two'], 'Device', 71, 'Syslog', 1000)] * 2
+    rows = list(results_generator._get_log_source_rows(log_sources))
+    assert rows[0] == (1, 'Device', '1.1.1.1', 71, 1000, 'Syslog', str(['Domain One', 'Domain Two']))
+    assert rows[1][-1] is rows[0][-1]
+
+
+def test_write_gzip_compressed_results(tmpdir):
+    csv_filename = str(tmpdir.join('test.csv'))
+    mvs_results = MVSResults()
+    mvs_results.set_device_map(build_mock_device_map())
+    ResultsGenerator(mvs_results, 1, False).write_results_to_csv(csv_filename, 'gzip')
+    assert os.listdir(str(tmpdir)) == ['test.csv.gz']
+    with gzip.open(csv_filename + '.gz', 'rb') as csv_file:
+        report = csv_file.read().decode('utf8')
+    assert report.startswith('Results Summary:\n')
+    assert 'Log Source Details:\n' in report
+
+
+def test_write_split_results(tmpdir):
+    csv_filename = str(tmpdir.join('test.csv'))
+    mvs_results = MVSResults()
+    device_map = build_mock_device_map()
+    device_map['3.3.3.3'] = [build_log_source(3, 70, '3.3.3.3', False, ['Test Domain One'])]
+    mvs_results.set_device_map(device_map)
+    mvs_results.add_excluded_log_source(build_mock_excluded_log_source())
+    detail_files = ResultsGenerator(mvs_results, 1, False).write_split_results_to_csv(csv_filename)
+    assert [os.path.basename(detail_file) for detail_file in detail_files] == [
+        'test_domain_Test_Domain_Four.csv', 'test_domain_Test_Domain_One.csv', 'test_domain_Test_Domain_Three.csv',
+        'test_domain_Test_Domain_Two.csv', 'test_excluded.csv'
+    ]
+    with open(csv_filename) as csv_file:
+        summary = csv_file.read()
+    assert summary.startswith('Results Summary:\n')
+    assert 'Log Source Details' not in summary
+    with open(detail_files[1]) as csv_file:
+        domain_report = csv_file.read()
+    assert domain_report.startswith('Domain = Test Domain One\nDevices In Domain = 2\n\nMVS List:\n')
+    assert 'MVS Device Id = 1.1.1.1\n' in domain_report
+    assert 'MVS Device Id = 3.3.3.3\n' in domain_report
+    assert '2.2.2.2' not in domain_report
+    with open(detail_files[4]) as csv_file:
+        assert 'Non MVS Log Sources:\n' in csv_file.read()
+
+
+def test_domain_file_names_unique():
+    file_names = ResultsGenerator._get_domain_file_names(['Domain/One', 'Domain One', 'Domain:One'])
+    assert sorted(file_names.values()) == ['domain_Domain_One', 'domain_Domain_One_1', 'domain_Domain_One_2']
+    file_names = ResultsGenerator._get_domain_file_names(['a b', 'a_b_2', 'a{b', 'a}b'])
+    assert sorted(file_names.values()) == ['domain_a_b', 'domain_a_b_1', 'domain_a_b_2', 'domain_a_b_3']
+
+
+def test_write_results_to_json(tmpdir):
+    csv_filename = str(tmpdir.join('test.csv'))
+    mvs_results = MVSResults()
+    mvs_results.set_mvs_count(2)
+    mvs_results.set_domain_count_map(build_mock_domain_count_map())
+    mvs_results.set_device_map(build_mock_device_map())
+    mvs_results.set_merged_identifiers({'a.test.com': ('1.1.1.1', 'dns')})
+    mvs_results.add_windows_workstation('127.0.0.1', build_mock_windows_workstation_log_sources())
+    mvs_results.add_excluded_log_source(build_mock_excluded_log_source())
+    mvs_results.add_skipped_log_source(build_mock_skipped_log_source())
+    records_filename, summary_filename = ResultsGenerator(mvs_results, 1, False).write_results_to_json(csv_filename)
+    assert (records_filename, summary_filename) == ResultsGenerator.get_json_filenames(csv_filename)
+    with open(records_filename) as records_file:
+        records = [json.loads(line) for line in records_file]
+    devices = dict((record['machine_identifier'], record) for record in records if record['record'] == 'device')
+    assert sorted(devices) == ['1.1.1.1', '2.2.2.2']
+    assert devices['1.1.1.1']['merged_identifiers'] == {'a.test.com': 'dns'}
+    assert devices['2.2.2.2']['log_sources'][0]['domains'] == ['Test Domain Three', 'Test Domain Four']
+    assert sorted((record['record'], record.get('reason'))
+                  for record in records[2:]) == [('excluded_log_source', 'excluded_type'),
+                                                 ('excluded_log_source', 'windows_workstation'),
+                                                 ('skipped_log_source', 'no_domain')]
+    with open(summary_filename) as summary_file:
+        summary = json.load(summary_file)
+    assert summary['mvs_count'] == 2
+    assert summary['log_sources_excluded'] == 2
+    assert summary['mvs_count_by_domain'] == {'Domain One': 2, 'Domain Two': 3}
+    assert summary['records_file'] == 'test.jsonl'
+    assert summary['record_count'] == 5
+
+
+def test_run_diff_written(tmpdir, capsys):
+    csv_filename = str(tmpdir.join('test_diff.csv'))
+    run_diff = {'Domain One': (['3.3.3.3'], ['2.2.2.2']), 'Domain Two': (['2.2.2.2', '4.4.4.4'], [])}
+    results_generator = ResultsGenerator(MVSResults(), 1, False)
+    results_generator.write_run_diff_to_csv(csv_filename, 4, run_diff)
+    with open(csv_filename) as csv_file:
+        report = csv_file.read()
+    assert 'Compared With Run = 4\nMVS Devices Added = 2\nMVS Devices Removed = 0\n' in report
+    assert report.splitlines()[6:] == [
+        'Domain One,added,3.3.3.3', 'Domain One,removed,2.2.2.2', 'Domain Two,added,2.2.2.2',
+        'Domain Two,added,4.4.4.4'
+    ]
+    results_generator.output_run_diff(4, run_diff)
+    assert capsys.readouterr().out.splitlines() == [
+        'MVS devices added since run 4 is 2, removed is 0',
+        'MVS devices added in domain Domain One is 1, removed is 1',
+        'MVS devices added in domain Domain Two is 2, removed is 0'
+    ]
@@ -1,7 +1,7 @@
 #! /usr/bin/env python
 
 from mock import Mock, mock_open, patch
-from countMVS import ArielSearch, LogSource, MVSResults, WindowsDeviceProcessor
+from countMVS import ArielSearch, LogSource, MVSResults, WindowsDeviceProcessor, WindowsVerdictStore
 from tests.utils import read_db_row_from_file, read_db_rows_from_file, read_response_from_file
 
 QIDS_JSON_FILE = 'qids.json'
@@ -20,13 +20,15 @@ def build_mock_aql_client():
     aql_client.perform_search.return_value = perform_ariel_search
     aql_client.get_search.return_value = ariel_search
     aql_client.get_search_result.return_value = []
+    # Child mocks are created on first use, creating it here stops concurrent checks each creating their own
+    aql_client.release_search.return_value = None
     return aql_client
 
 
 def build_mock_db_service():
     qids = read_db_rows_from_file(QIDS_JSON_FILE)
     db_service = Mock()
-    db_service.get_windows_server_qids.return_value = qids
+    db_service.get_windows_server_qid_fragment.return_value = ','.join(str(row['qid']) for row in qids)
     return db_service
 
 
@@ -81,3 +83,48 @@ def test_windows_server_excluded():
         processor.process_devices()
         windows_workstations = processor.get_windows_workstations()
         assert len(windows_workstations) == 0
+
+
+def test_concurrent_workstation_checks():
+    aql_client = build_mock_aql_client()
+    db_service = build_mock_db_service()
+    mvs_results = build_mock_mvs_results()
+    windows_log_source_row = read_db_row_from_file(WINDOWS_WORKSTATION_LOG_SOURCE_JSON_FILE)
+    for index in range(2, 6):
+        mvs_results.get_device_map()['127.0.0.{}'.format(index)] = [
+            LogSource.load_from_db_row(dict(windows_log_source_row))
+        ]
+    mocked_open_function = mock_open()
+    with patch("__builtin__.open", mocked_open_function), patch("time.sleep"):
+        processor = WindowsDeviceProcessor(aql_client, db_service, mvs_results, max_workers=4)
+        processor.process_devices()
+        windows_workstations = processor.get_windows_workstations()
+        assert sorted(windows_workstations) == ['127.0.0.{}'.format(index) for index in range(1, 6)]
+        assert aql_client.perform_search.call_count == 5
+        assert aql_client.release_search.call_count == 5
+
+
+def test_stored_verdicts_skip_ariel_search():
+    aql_client = build_mock_aql_client()
+    db_service = build_mock_db_service()
+    verdict_store = WindowsVerdictStore()
+    verdict_store.load()
+    for _ in range(2):
+        processor = WindowsDeviceProcessor(aql_client,
+                                           db_service,
+                                           build_mock_mvs_results(),
+                                           verdict_store=verdict_store)
+        processor.process_devices()
+        assert processor.get_windows_workstations() == ['127.0.0.1']
+    assert aql_client.perform_search.call_count == 1
+    assert verdict_store.get_hit_count() == 1
+
+
+def test_windows_server_query_uses_qid_fragment():
+    aql_client = build_mock_aql_client()
+    db_service = build_mock_db_service()
+    db_service.get_windows_server_qid_fragment.return_value = '1,2'
+    processor = WindowsDeviceProcessor(aql_client, db_service, build_mock_mvs_results())
+    processor.process_devices()
+    query = aql_client.perform_search.call_args[0][0]
+    assert 'AND qid IN (1,2)' in query
@@ -0,0 +1,33 @@
+#! /usr/bin/env python
+
+import time
+import pytest
+from countMVS import WorkerPool
+
+
+def delayed_square(value):
+    time.sleep(0.01 * (5 - value))
+    return value * value
+
+
+def fail_on_three(value):
+    if value == 3:
+        raise ValueError('failed on {}'.format(value))
+    return value
+
+
+def test_results_returned_in_order():
+    worker_pool = WorkerPool(4)
+    assert worker_pool.map(delayed_square, range(5)) == [0, 1, 4, 9, 16]
+
+
+def test_single_worker_runs_inline():
+    worker_pool = WorkerPool(1)
+    assert worker_pool.map(delayed_square, [1, 2]) == [1, 4]
+
+
+def test_worker_error_raised():
+    worker_pool = WorkerPool(4)
+    with pytest.raises(ValueError) as exception:
+        worker_pool.map(fail_on_three, range(5))
+    assert 'failed on 3' in str(exception)
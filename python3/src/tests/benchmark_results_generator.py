@@ -0,0 +1,53 @@
+#! /usr/bin/env python
+
+# Measures how fast log source rows are written to the csv report, run from the src directory with
+#   python -m tests.benchmark_results_generator [row count ...]
+
+import csv
+import os
+import sys
+import time
+from countMVS import LogSource, MVSResults, ResultsGenerator
+
+DEFAULT_ROW_COUNTS = [100000, 1000000]
+DOMAIN_LISTS = [['Default Domain'], ['Domain One', 'Domain Two'], ['Domain Three']]
+
+
+def build_log_sources(row_count):
+    return [
+        LogSource(index, '10.{}.{}.{}'.format(index // 65536 % 256, index // 256 % 256,
+                                              index % 256), DOMAIN_LISTS[index % len(DOMAIN_LISTS)],
+                  'Log Source {}'.format(index), 11, 'Syslog', 1652710869350 + index) for index in range(row_count)
+    ]
+
+
+def write_dict_rows(output_file, log_sources):
+    writer = csv.DictWriter(output_file, ResultsGenerator.LOG_SOURCE_COLUMN_ORDER)
+    for log_source in log_sources:
+        writer.writerow(log_source.to_row())
+
+
+def write_tuple_rows(output_file, log_sources):
+    results_generator = ResultsGenerator(MVSResults(), 1, False)
+    results_generator._write_log_sources(output_file, csv.writer(output_file), log_sources)
+
+
+def measure(write_rows, log_sources):
+    with open(os.devnull, 'w') as output_file:
+        start_time = time.time()
+        write_rows(output_file, log_sources)
+        elapsed = time.time() - start_time
+    return len(log_sources) / elapsed if elapsed else float('inf')
+
+
+def main(row_counts):
+    for row_count in row_counts:
+        log_sources = build_log_sources(row_count)
+        dict_rate = measure(write_dict_rows, log_sources)
+        tuple_rate = measure(write_tuple_rows, log_sources)
+        print('{} rows: DictWriter {:.0f} rows/sec, row tuples {:.0f} rows/sec ({:.1f}x)'.format(
+            row_count, dict_rate, tuple_rate, tuple_rate / dict_rate))
+
+
+if __name__ == '__main__':
+    main([int(row_count) for row_count in sys.argv[1:]] or DEFAULT_ROW_COUNTS)
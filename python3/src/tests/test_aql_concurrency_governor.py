@@ -0,0 +1,119 @@
+#! /usr/bin/env python
+
+import itertools
+import pytest
+from mock import Mock, patch
+from countMVS import AIMDLimiter, APIError, AQLClient, AQLConcurrencyGovernor, ArielSearch, RESTException
+from tests.utils import read_response_from_file
+
+ARIEL_POST_RESPONSE_JSON_FILE = 'post_search.json'
+ARIEL_SEARCH_ID = '84570b06-9c87-4f4a-990b-3bd7f0a94299'
+
+
+def build_throttled_exception(response_code=429):
+    api_error = APIError()
+    api_error.set_response_code(response_code)
+    api_error.set_error_message('Too many requests')
+    return RESTException(api_error.get_error_message(), api_error)
+
+
+def build_ariel_search(status, completed):
+    ariel_search = ArielSearch(search_id=ARIEL_SEARCH_ID)
+    ariel_search.set_status(status)
+    ariel_search.set_completed(completed)
+    return ariel_search
+
+
+def test_limiter_additive_increase():
+    limiter = AIMDLimiter('test', 1, 1, 4)
+    limiter.on_success()
+    assert limiter.get_limit() == 2
+    for _ in range(3):
+        limiter.on_success()
+    assert limiter.get_limit() == 3
+    for _ in range(20):
+        limiter.on_success()
+    assert limiter.get_limit() == 4
+
+
+def test_limiter_multiplicative_decrease_once_per_cooldown():
+    limiter = AIMDLimiter('test', 8, 1, 8)
+    limiter.on_congestion('test')
+    limiter.on_congestion('test')
+    assert limiter.get_limit() == 4
+    limiter.last_decrease = 0
+    limiter.on_congestion('test')
+    assert limiter.get_limit() == 2
+    assert limiter.get_peak_limit() == 8
+
+
+def test_throttled_request_retried_and_window_reduced():
+    governor = AQLConcurrencyGovernor(max_searches=4, max_requests=4)
+    request_function = Mock(side_effect=[build_throttled_exception(503), {'status': 'COMPLETED'}])
+    with patch('time.sleep') as mock_sleep:
+        response = governor.execute_request(request_function, path='/test')
+    assert response == {'status': 'COMPLETED'}
+    assert request_function.call_count == 2
+    mock_sleep.assert_called_once()
+    assert governor.get_summary()['throttled_responses'] == 1
+
+
+def test_streamed_result_latency_not_congestion():
+    governor = AQLConcurrencyGovernor(max_searches=4, max_requests=4)
+    limit = governor.request_limiter.get_limit()
+    # Every request appears to take twice the latency threshold
+    clock = itertools.count(0, AQLConcurrencyGovernor.LATENCY_THRESHOLD_SECONDS * 2)
+    with patch('time.time', side_effect=lambda: next(clock)):
+        governor.execute_request(Mock(), False, path='/test')
+        assert governor.request_limiter.get_limit() >= limit
+        limit = governor.request_limiter.get_limit()
+        governor.execute_request(Mock(), path='/test')
+    assert governor.request_limiter.get_limit() < limit
+
+
+def test_non_throttled_error_raised():
+    governor = AQLConcurrencyGovernor()
+    request_function = Mock(side_effect=build_throttled_exception(401))
+    with pytest.raises(RESTException):
+        governor.execute_request(request_function, path='/test')
+    assert request_function.call_count == 1
+
+
+def test_completed_search_releases_slot():
+    governor = AQLConcurrencyGovernor(max_searches=4)
+    governor.acquire_search_slot()
+    governor.register_search(ARIEL_SEARCH_ID)
+    assert governor.search_limiter.in_flight == 1
+    governor.observe_search(build_ariel_search('COMPLETED', True))
+    assert governor.search_limiter.in_flight == 0
+    governor.release_search(ARIEL_SEARCH_ID)
+    assert governor.search_limiter.in_flight == 0
+
+
+def test_queued_search_reduces_search_window():
+    governor = AQLConcurrencyGovernor(max_searches=4)
+    governor.search_limiter.limit = 4.0
+    governor.observe_search(build_ariel_search('WAIT', False))
+    assert governor.search_limiter.get_limit() == 2
+
+
+def test_aql_client_registers_search_with_governor():
+    governor = AQLConcurrencyGovernor()
+    rest_client = Mock()
+    rest_client.post.return_value = read_response_from_file(ARIEL_POST_RESPONSE_JSON_FILE)
+    aql_client = AQLClient(rest_client, governor)
+    ariel_search = aql_client.perform_search('SELECT qid FROM events')
+    assert ariel_search.get_search_id() == ARIEL_SEARCH_ID
+    assert governor.search_limiter.in_flight == 1
+    aql_client.release_search(ARIEL_SEARCH_ID)
+    assert governor.search_limiter.in_flight == 0
+
+
+def test_aql_client_releases_slot_when_post_fails():
+    governor = AQLConcurrencyGovernor()
+    rest_client = Mock()
+    rest_client.post.side_effect = build_throttled_exception(401)
+    aql_client = AQLClient(rest_client, governor)
+    with pytest.raises(RESTException):
+        aql_client.perform_search('SELECT qid FROM events')
+    assert governor.search_limiter.in_flight == 0
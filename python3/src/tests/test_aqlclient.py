@@ -114,3 +114,48 @@ def test_permissions_check_with_no_permissions():
     permission_check = aql_client.check_api_permissions()
     assert permission_check.is_successful() is False
     assert permission_check.get_error_message() == APIErrorGenerator.TOKEN_PERMISSIONS_ERROR
+
+
+def build_csv_response(lines, content_type=AQLClient.CSV_CONTENT_TYPE):
+    response = Mock()
+    response.encoding = None
+    response.headers = {'Content-Type': content_type}
+    response.iter_lines.return_value = lines
+    return response
+
+
+def read_stream_from(response):
+    return lambda path, read_response, headers: read_response(response)
+
+
+def test_get_compact_search_results():
+    rest_client = build_mock_rest_client()
+    rest_client.read_stream.side_effect = read_stream_from(
+        build_csv_response(['"logsourceid","domainname_domainid"', '70,"Default Domain"', '71,"Default Domain"']))
+    aql_client = AQLClient(rest_client)
+    ariel_results = aql_client.get_compact_search_result(ARIEL_SEARCH_ID, list)
+    assert rest_client.read_stream.call_args[1]['headers'] == {'Accept': AQLClient.CSV_CONTENT_TYPE}
+    assert rest_client.read_stream.call_args[1]['path'] == AQLClient.ARIEL_SEARCH_RESULTS_ENDPOINT.format(
+        ARIEL_SEARCH_ID)
+    assert len(ariel_results) == 2
+    log_source_to_domain_map = build_log_source_to_domain_mapping(ariel_results)
+    assert log_source_to_domain_map[LOG_SOURCE_ID_ONE][0] == DEFAULT_DOMAIN_NAME
+    assert log_source_to_domain_map[LOG_SOURCE_ID_TWO][0] == DEFAULT_DOMAIN_NAME
+
+
+def test_compact_search_results_not_acceptable():
+    rest_client = build_mock_rest_client()
+    api_error = build_api_error(406)
+    rest_client.read_stream.side_effect = RESTException(api_error.get_error_message(), api_error)
+    aql_client = AQLClient(rest_client)
+    assert aql_client.get_compact_search_result(ARIEL_SEARCH_ID, list) is None
+    assert aql_client.get_compact_search_result(ARIEL_SEARCH_ID, list) is None
+    assert rest_client.read_stream.call_count == 1
+
+
+def test_compact_search_results_json_response():
+    rest_client = build_mock_rest_client()
+    rest_client.read_stream.side_effect = read_stream_from(build_csv_response([], content_type='application/json'))
+    aql_client = AQLClient(rest_client)
+    assert aql_client.get_compact_search_result(ARIEL_SEARCH_ID, list) is None
+    assert not aql_client.compact_results_supported
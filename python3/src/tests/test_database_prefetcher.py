@@ -0,0 +1,59 @@
+#! /usr/bin/env python
+
+from mock import Mock
+import pytest
+from psycopg2 import DatabaseError
+from countMVS import DatabasePrefetcher, DomainRetrievalException, LogSource
+
+
+def build_mock_db_service():
+    db_service = Mock()
+    db_service.build_log_source_map.return_value = {
+        1: LogSource(device_id=1, hostname='1.1.1.1', timestamp_last_seen=1000), 2: LogSource(device_id=2,
+                                                                                              hostname='2.2.2.2',
+                                                                                              timestamp_last_seen=5000)
+    }
+    db_service.get_domain_count.return_value = 3
+    return db_service
+
+
+def test_log_source_map_filtered_to_selected_period():
+    db_service = build_mock_db_service()
+    prefetcher = DatabasePrefetcher(lambda: db_service, 500)
+    prefetcher.start()
+    assert list(prefetcher.get_log_source_map(2000).keys()) == [2]
+    assert prefetcher.get_domain_count() == 3
+    db_service.build_log_source_map.assert_called_once_with(500)
+
+
+def test_windows_server_qids_prefetched():
+    db_service = build_mock_db_service()
+    db_service.get_windows_server_qids.return_value = [5000921]
+    prefetcher = DatabasePrefetcher(lambda: db_service, 500)
+    prefetcher.start()
+    assert prefetcher.get_windows_server_qids() == [5000921]
+    db_service = build_mock_db_service()
+    prefetcher = DatabasePrefetcher(lambda: db_service, 500, windows_server_qids=False)
+    prefetcher.start()
+    prefetcher.get_domain_count()
+    db_service.get_windows_server_qids.assert_not_called()
+
+
+def test_prefetch_error_raised_when_value_needed():
+    db_service = build_mock_db_service()
+    db_service.get_domain_count.side_effect = DomainRetrievalException('Test')
+    prefetcher = DatabasePrefetcher(lambda: db_service, 500)
+    prefetcher.start()
+    assert len(prefetcher.get_log_source_map(500)) == 2
+    with pytest.raises(DomainRetrievalException):
+        prefetcher.get_domain_count()
+
+
+def test_connection_error_raised_when_value_needed():
+    init_db_service = Mock(side_effect=DatabaseError('Unable to connect to database'))
+    prefetcher = DatabasePrefetcher(init_db_service, 500)
+    prefetcher.start()
+    with pytest.raises(DatabaseError) as exception:
+        prefetcher.get_log_source_map(500)
+    assert 'Unable to connect to database' in str(exception)
+    assert not prefetcher.is_running()
@@ -125,3 +125,39 @@ def test_client_rest_exception_throws_exception():
     with pytest.raises(DomainRetrievalException) as exception:
         appender.add_domains(log_source_map)
         assert 'REST Exception' in str(exception)
+
+
+def test_adding_domains_from_compact_results():
+    aql_client = build_mock_aql_client(True)
+    rows = [{'logsourceid': str(event['logsourceid']), 'domainname_domainid': event['domainname_domainid']}
+            for event in build_mock_events(True)]
+    aql_client.get_compact_search_result.side_effect = lambda search_id, read_rows: read_rows(iter(rows))
+    log_source_map = build_mock_log_source_map()
+    appender = DomainAppender(True, aql_client, compact_results=True)
+    appender.add_domains(log_source_map)
+    assert aql_client.get_compact_search_result.call_count == 1
+    assert not aql_client.get_search_result.called
+    for log_source_id in log_source_map:
+        domains = log_source_map[log_source_id].get_domains()
+        assert sorted(domains) == ['Test Domain {}a'.format(log_source_id), 'Test Domain {}b'.format(log_source_id)]
+
+
+def test_broken_compact_results_stream_raises_domain_exception():
+    aql_client = build_mock_aql_client(True)
+    aql_client.get_compact_search_result.side_effect = APIException('Connection broken')
+    appender = DomainAppender(True, aql_client, compact_results=True)
+    with pytest.raises(DomainRetrievalException):
+        appender.add_domains(build_mock_log_source_map())
+    aql_client.release_search.assert_called_once_with(aql_client.perform_search.return_value.get_search_id())
+
+
+def test_compact_results_fall_back_to_paged_results():
+    aql_client = build_mock_aql_client()
+    aql_client.get_compact_search_result.return_value = None
+    log_source_map = build_mock_log_source_map()
+    appender = DomainAppender(True, aql_client, compact_results=True)
+    appender.add_domains(log_source_map)
+    assert aql_client.get_compact_search_result.call_count == 1
+    assert aql_client.get_search_result.call_count == 1
+    for log_source_id in log_source_map:
+        assert log_source_map[log_source_id].get_first_domain() == 'Test Domain {}'.format(log_source_id)
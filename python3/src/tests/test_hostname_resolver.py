@@ -0,0 +1,96 @@
+#! /usr/bin/env python
+
+import threading
+import time
+from mock import patch
+from countMVS import HostnameResolver
+
+SLOW_HOSTNAME = 'slow.test.com'
+
+
+def get_device_ip(hostname):
+    if hostname == 'unknown.test.com':
+        return None
+    if hostname == 'error.test.com':
+        raise ValueError('lookup failed')
+    return '1.1.1.{}'.format(len(hostname))
+
+
+def test_hostnames_resolved():
+    with patch('countMVS.IPParser.get_device_ip', side_effect=get_device_ip):
+        resolver = HostnameResolver(max_workers=4)
+        device_ips = resolver.resolve(['a.test.com', 'bb.test.com', 'unknown.test.com', 'error.test.com'])
+        assert device_ips == {'a.test.com': '1.1.1.10', 'bb.test.com': '1.1.1.11'}
+        assert resolver.get_summary() == {'resolved': 2, 'failed': 2, 'timed_out': 0}
+
+
+def test_slow_lookup_times_out():
+    release = threading.Event()
+
+    def slow_get_device_ip(hostname):
+        if hostname == SLOW_HOSTNAME:
+            release.wait(5)
+        return get_device_ip(hostname)
+
+    try:
+        with patch('countMVS.IPParser.get_device_ip', side_effect=slow_get_device_ip):
+            resolver = HostnameResolver(max_workers=2, lookup_timeout=0.2)
+            device_ips = resolver.resolve([SLOW_HOSTNAME, 'a.test.com'])
+            assert device_ips == {'a.test.com': '1.1.1.10'}
+            assert resolver.get_summary() == {'resolved': 1, 'failed': 0, 'timed_out': 1}
+            assert resolver.get_abandoned() == set([SLOW_HOSTNAME])
+    finally:
+        release.set()
+
+
+def test_abandoned_lookup_keeps_its_worker():
+    release = threading.Event()
+
+    def slow_get_device_ip(hostname):
+        if hostname == SLOW_HOSTNAME:
+            release.wait(5)
+        return get_device_ip(hostname)
+
+    try:
+        with patch('countMVS.IPParser.get_device_ip', side_effect=slow_get_device_ip) as mock_get_device_ip:
+            resolver = HostnameResolver(max_workers=1, lookup_timeout=0.2, overall_timeout=0.6)
+            assert not resolver.resolve([SLOW_HOSTNAME, 'a.test.com'])
+            # The only worker is still waiting on the slow lookup so no second lookup was started
+            assert mock_get_device_ip.call_count == 1
+            assert len(resolver.workers) == 1
+            assert resolver.get_abandoned() == set([SLOW_HOSTNAME, 'a.test.com'])
+            release.set()
+            while not resolver.result_queue.qsize():
+                time.sleep(0.01)
+            # The late result is used, the lookup abandoned at the deadline is not retried
+            assert resolver.resolve([SLOW_HOSTNAME, 'a.test.com']) == {SLOW_HOSTNAME: '1.1.1.13'}
+            assert mock_get_device_ip.call_count == 1
+    finally:
+        release.set()
+
+
+def test_overall_deadline_abandons_remaining_lookups():
+    release = threading.Event()
+
+    def slow_get_device_ip(hostname):
+        release.wait(5)
+        return get_device_ip(hostname)
+
+    try:
+        with patch('countMVS.IPParser.get_device_ip', side_effect=slow_get_device_ip):
+            resolver = HostnameResolver(max_workers=1, lookup_timeout=5, overall_timeout=0.2)
+            device_ips = resolver.resolve(['a.test.com', 'b.test.com', 'c.test.com'])
+            assert not device_ips
+            assert resolver.get_summary() == {'resolved': 0, 'failed': 0, 'timed_out': 3}
+    finally:
+        release.set()
+
+
+def test_completed_lookups_not_repeated():
+    with patch('countMVS.IPParser.get_device_ip', side_effect=get_device_ip) as mock_get_device_ip:
+        resolver = HostnameResolver(max_workers=4)
+        resolver.resolve(['a.test.com', 'unknown.test.com'])
+        device_ips = resolver.resolve(['a.test.com', 'unknown.test.com', 'bb.test.com'])
+        assert device_ips == {'a.test.com': '1.1.1.10', 'bb.test.com': '1.1.1.11'}
+        assert mock_get_device_ip.call_count == 3
+        assert resolver.get_summary() == {'resolved': 2, 'failed': 1, 'timed_out': 0}
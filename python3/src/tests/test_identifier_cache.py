@@ -0,0 +1,96 @@
+#! /usr/bin/env python
+
+import os
+from countMVS import IdentifierCache, LogSource
+
+PROTOCOL_CONFIGS = {7: '2|1.1.1.1'}
+
+
+def build_cache(tmpdir, max_age=IdentifierCache.DEFAULT_MAX_AGE_SECONDS, protocol_configs=None):
+    identifier_cache = IdentifierCache(os.path.join(str(tmpdir), 'state', 'identifier_cache.db'), max_age)
+    identifier_cache.load()
+    identifier_cache.set_protocol_configs(protocol_configs or PROTOCOL_CONFIGS)
+    return identifier_cache
+
+
+def build_log_source(device_id=1, hostname='host1'):
+    return LogSource(device_id, hostname, ['Domain One'], devicetypeid=12, spconfig=7)
+
+
+def save_first_run(tmpdir, machine_identifier='host1.test.com'):
+    identifier_cache = build_cache(tmpdir)
+    assert identifier_cache.identify(build_log_source(), lambda log_source: machine_identifier) == machine_identifier
+    assert identifier_cache.get_changed_count() == 1
+    identifier_cache.save()
+    identifier_cache.close()
+
+
+def test_unchanged_log_source_not_identified_again(tmpdir):
+    save_first_run(tmpdir)
+    identifier_cache = build_cache(tmpdir)
+    assert identifier_cache.identify(build_log_source(), lambda log_source: 'other.test.com') == 'host1.test.com'
+    assert identifier_cache.get_unchanged_count() == 1
+    assert identifier_cache.get_changed_count() == 0
+    identifier_cache.close()
+
+
+def test_changed_log_source_identified_again(tmpdir):
+    save_first_run(tmpdir)
+    identifier_cache = build_cache(tmpdir)
+    changed_log_source = build_log_source(hostname='host2')
+    assert identifier_cache.identify(changed_log_source, lambda log_source: 'host2.test.com') == 'host2.test.com'
+    assert identifier_cache.get_changed_count() == 1
+    identifier_cache.close()
+
+
+def test_changed_identifier_parameter_identified_again(tmpdir):
+    save_first_run(tmpdir)
+    identifier_cache = build_cache(tmpdir, protocol_configs={7: '2|2.2.2.2'})
+    assert identifier_cache.identify(build_log_source(), lambda log_source: '2.2.2.2') == '2.2.2.2'
+    assert identifier_cache.get_unchanged_count() == 0
+    identifier_cache.close()
+
+
+def test_nothing_reused_without_protocol_configs(tmpdir):
+    save_first_run(tmpdir)
+    identifier_cache = build_cache(tmpdir)
+    identifier_cache.set_protocol_configs(None)
+    assert identifier_cache.identify(build_log_source(), lambda log_source: 'host2.test.com') == 'host2.test.com'
+    assert identifier_cache.get_changed_count() == 1
+    identifier_cache.close()
+
+
+def test_failed_identification_not_kept(tmpdir):
+    identifier_cache = build_cache(tmpdir)
+
+    def fail_identification(log_source):
+        identifier_cache.add_failed_log_source(log_source)
+        return log_source.get_hostname()
+
+    assert identifier_cache.identify(build_log_source(), fail_identification) == 'host1'
+    identifier_cache.save()
+    identifier_cache.close()
+    identifier_cache = build_cache(tmpdir)
+    assert not identifier_cache.previous_state
+    identifier_cache.close()
+
+
+def test_expired_state_identified_again(tmpdir):
+    save_first_run(tmpdir)
+    identifier_cache = build_cache(tmpdir, 0)
+    assert identifier_cache.identify(build_log_source(), lambda log_source: 'host2.test.com') == 'host2.test.com'
+    assert identifier_cache.get_unchanged_count() == 0
+    identifier_cache.close()
+
+
+def test_without_state_file_nothing_kept():
+    identifier_cache = IdentifierCache()
+    identifier_cache.load()
+    identifier_cache.set_protocol_configs(PROTOCOL_CONFIGS)
+    identifier_cache.identify(build_log_source(), lambda log_source: 'host1.test.com')
+    identifier_cache.save()
+    identifier_cache.close()
+    identifier_cache = IdentifierCache()
+    identifier_cache.load()
+    assert not identifier_cache.previous_state
+    identifier_cache.close()
@@ -0,0 +1,40 @@
+#! /usr/bin/env python
+
+from countMVS import LogSource
+
+
+def test_log_source_has_no_instance_dict():
+    log_source = LogSource(device_id=1, hostname='1.1.1.1')
+    assert not hasattr(log_source, '__dict__')
+
+
+def test_domain_lists_shared_between_log_sources():
+    log_source_one = LogSource(device_id=1)
+    log_source_two = LogSource(device_id=2)
+    log_source_one.add_domain('Default Domain')
+    log_source_two.set_domains(['Default Domain', 'Default Domain'])
+    assert log_source_one.get_domains() == ('Default Domain', )
+    assert log_source_one.get_domains() is log_source_two.get_domains()
+
+
+def test_domains_keep_first_seen_order():
+    log_source = LogSource(device_id=1)
+    log_source.set_domains(['Domain Two', 'Domain One', 'Domain Two'])
+    log_source.add_domain('Domain Three')
+    assert log_source.get_domains() == ('Domain Two', 'Domain One', 'Domain Three')
+    assert log_source.is_multi_domain() is True
+    assert log_source.get_first_domain() == 'Domain Two'
+
+
+def test_row_contains_all_fields():
+    log_source = LogSource(device_id=1,
+                           hostname='1.1.1.1',
+                           domains=['Default Domain'],
+                           devicename='Test',
+                           devicetypeid=12,
+                           spconfig='0',
+                           timestamp_last_seen=1648718388682)
+    assert log_source.to_row() == {
+        'sensor_device_id': 1, 'hostname': '1.1.1.1', 'device_name': 'Test', 'domains': ['Default Domain'],
+        'device_type_id': 12, 'sp_config': '0', 'timestamp_last_seen': 1648718388682
+    }
@@ -1,7 +1,8 @@
 #! /usr/bin/env python
 
 from mock import Mock, patch
-from countMVS import APIException, ArielSearch, LogSourceProcessor, LogSource, WindowsDeviceProcessor
+from countMVS import APIException, ArielSearch, LogSourceProcessor, LogSource, SpillStore, \
+WindowsDeviceProcessor
 
 
 def build_mock_aql_client(search_status='COMPLETED', raised_exception=None):
@@ -251,4 +252,69 @@ def test_hostname_to_ip_resolution_with_ips_and_hostnames():
         log_sources = build_multi_domain_log_sources_with_duplicate_hostnames_two()
         processor.process_log_sources(log_sources)
         mvs_results = processor.get_mvs_results()
-        assert mvs_results.get_mvs_count() == 4
+        # IP address identifiers are never resolved, each hostname is merged into the IP it resolves to
+        assert sorted(mvs_results.get_device_map().keys()) == ['1.1.1.1', '2.2.2.2']
+        assert mvs_results.get_mvs_count() == 8
+
+
+def test_equivalent_identifiers_counted_once():
+    with patch('countMVS.IPParser.get_device_ip', return_value=None) as mock_get_device_ip:
+        db_service = build_mock_db_service()
+        aql_client = build_mock_aql_client()
+        processor = LogSourceProcessor(db_service, aql_client)
+        log_sources = [
+            build_log_source(1, 71, 'Microsoft.Test.com.'),
+            build_log_source(2, 72, 'microsoft.test.com:514'),
+            build_log_source(3, 73, '[2001:DB8::0001]:443'),
+            build_log_source(4, 74, '2001:db8:0:0::1')
+        ]
+        processor.process_log_sources(log_sources, skip_windows_check=True)
+        mvs_results = processor.get_mvs_results()
+        assert sorted(mvs_results.get_device_map().keys()) == ['2001:db8::1', 'microsoft.test.com']
+        assert mvs_results.get_mvs_count() == 2
+        mock_get_device_ip.assert_called_once_with('microsoft.test.com')
+
+
+def test_pipeline_stages_reported():
+    db_service = build_mock_db_service()
+    aql_client = build_mock_aql_client()
+    processor = LogSourceProcessor(db_service, aql_client)
+    processor.process_log_sources(iter(build_excluded_log_sources_list()), skip_windows_check=True)
+    assert processor.get_mvs_results().get_log_source_count() == 2
+    stage_summaries = processor.get_pipeline_summary()
+    stages = dict((summary['stage'], summary) for summary in stage_summaries)
+    assert [summary['stage'] for summary in stage_summaries] == ['load', 'exclude', 'group', 'resolve', 'count']
+    assert stages['exclude']['items_in'] == 2
+    assert stages['exclude']['items_out'] == 1
+    assert stages['group']['items_out'] == 1
+    assert stages['count']['items_out'] == 1
+
+
+def test_precomputed_machine_identifiers_used():
+    db_service = build_mock_db_service()
+    aql_client = build_mock_aql_client()
+    processor = LogSourceProcessor(db_service, aql_client, machine_identifiers={1: '3.3.3.3'})
+    processor.process_log_sources(build_single_domain_log_source_list(), skip_windows_check=True)
+    assert sorted(processor.get_mvs_results().get_device_map().keys()) == ['2.2.2.2', '3.3.3.3']
+    assert db_service.get_machine_identifier.call_count == 1
+
+
+def test_spilled_device_map_matches_in_memory(tmpdir):
+    with patch('countMVS.IPParser.get_device_ip', side_effect=get_device_ip), \
+    patch('countMVS.SpillStore.get_resident_memory', return_value=2 * 1024 * 1024):
+        results = []
+        for memory_limit in [0, 1]:
+            spill_store = SpillStore(memory_limit, str(tmpdir))
+            spill_store.MEMORY_CHECK_INTERVAL = 1
+            processor = LogSourceProcessor(build_mock_db_service(),
+                                           build_mock_aql_client(),
+                                           True,
+                                           spill_store=spill_store)
+            processor.process_log_sources(build_multi_domain_log_sources_with_duplicate_hostnames())
+            mvs_results = processor.get_mvs_results()
+            device_map = [(machine_identifier, [log_source.get_sensor_device_id() for log_source in log_sources])
+                          for machine_identifier, log_sources in mvs_results.get_device_map().items()]
+            results.append((mvs_results.get_mvs_count(), mvs_results.get_domain_count_map(), device_map))
+            assert spill_store.is_spilling() == bool(memory_limit)
+            spill_store.close()
+        assert results[0] == results[1]
@@ -1,5 +1,9 @@
+import os
 from mock import patch, Mock
-from countMVS import Auth, MVSProcessor, PermissionCheckResult, QuitSelected
+import pytest
+from psycopg2 import DatabaseError
+from countMVS import Auth, DatabaseService, IdentifierCache, LogSource, MVSProcessor, MVSResults, PermissionCheckResult, \
+    PhaseCheckpoint, QuitSelected, RunHistoryStore
 
 
 def test_not_running_on_console(capsys):
@@ -50,7 +54,9 @@ def test_permissions_check(capsys):
         assert captured.out == 'Test Error\n'
 
 
-def test_clients_initialized(capsys):
+def test_clients_initialized(capsys, monkeypatch, tmpdir):
+    # State files written during the run stay out of the working directory
+    monkeypatch.chdir(str(tmpdir))
     with patch('countMVS.AuthReader') as mock_auth_reader, \
          patch('countMVS.TimePeriodReader') as mock_time_period_reader, \
          patch('countMVS.Validator') as mock_validator, \
@@ -62,7 +68,7 @@ def test_clients_initialized(capsys):
         mock_auth = Auth()
         mock_auth.set_password('test')
         mock_permission_check_result = PermissionCheckResult(mock_auth)
-        mock_time_period_reader.prompt_for_time_period.return_value = 3
+        mock_time_period_reader.return_value.prompt_for_time_period.return_value = 3
         mock_auth_reader.prompt_for_auth_method.return_value = mock_auth
         mock_validator.is_console.return_value = True
         mock_validator.perform_api_permission_check.return_value = mock_permission_check_result
@@ -72,3 +78,81 @@ def test_clients_initialized(capsys):
         captured = capsys.readouterr()
         assert exit_code == 0
         assert captured.out == 'MVS count for the deployment is 0\n'
+
+
+def test_resumed_from_checkpoint(monkeypatch, tmpdir):
+    monkeypatch.chdir(str(tmpdir))
+    PhaseCheckpoint(PhaseCheckpoint.DEFAULT_DIRECTORY,
+                    {'console': 'console.test.com', 'period_in_days': 3}).save('domain count', True)
+    with patch('countMVS.AuthReader') as mock_auth_reader, \
+         patch('countMVS.TimePeriodReader') as mock_time_period_reader, \
+         patch('countMVS.Validator') as mock_validator, \
+         patch('countMVS.MyVer') as mock_my_ver, \
+         patch('countMVS.DatabaseClient'), \
+         patch('countMVS.DatabaseService.get_domain_count', return_value=1), \
+         patch('countMVS.DatabaseService.build_log_source_map', return_value={}), \
+         patch('countMVS.MVSProcessor._parse_arguments'):
+        mock_auth = Auth()
+        mock_auth.set_password('test')
+        mock_time_period_reader.return_value.prompt_for_time_period.return_value = 3
+        mock_auth_reader.prompt_for_auth_method.return_value = mock_auth
+        mock_validator.is_console.return_value = True
+        mock_validator.perform_api_permission_check.return_value = PermissionCheckResult(mock_auth)
+        mock_my_ver.get_hostname.return_value = 'console.test.com'
+        processor = MVSProcessor()
+        processor.command_line_parser.parse_args({'resume': True})
+        assert processor.run() == 0
+        assert processor.multi_domain
+        assert processor.phase_checkpoint.get_resumed_phases() == ['domain count']
+        assert not os.listdir(PhaseCheckpoint.DEFAULT_DIRECTORY)
+
+
+def test_unreadable_run_history_ignored(capsys, monkeypatch, tmpdir):
+    monkeypatch.chdir(str(tmpdir))
+    tmpdir.join(RunHistoryStore.DEFAULT_STORE_FILE).write('not a database' * 100, ensure=True)
+    processor = MVSProcessor()
+    processor.command_line_parser.parse_args({'diff': 0})
+    processor._record_run_history(MVSResults(), Mock())
+    assert capsys.readouterr().out == 'Unable to compare with a previous run, the run history could not be read\n'
+
+
+def test_cached_identifier_after_database_error_not_kept():
+    processor = MVSProcessor(db_service=Mock())
+    processor.db_service.get_protocol_configs.return_value = {7: '2|1.1.1.1'}
+    processor.db_service.find_machine_identifier.side_effect = DatabaseError('test error')
+    processor.identifier_cache = IdentifierCache()
+    processor.identifier_cache.load()
+    assert processor._identify_log_sources({1: LogSource(1, 'host1', ['Domain One'], spconfig=7)}) == {1: 'host1'}
+    assert processor.identifier_cache.get_changed_count() == 1
+    assert not processor.identifier_cache.current_state
+    processor.identifier_cache.close()
+
+
+def test_identify_progress_resumed_from_checkpoint(tmpdir):
+    log_source_map = {1: LogSource(1, 'host1', ['Domain One'], spconfig=7), 2: LogSource(2, 'host2', ['Domain One'])}
+    processor = MVSProcessor(db_service=Mock())
+    processor.IDENTIFY_CHECKPOINT_SECONDS = 0
+    processor.phase_checkpoint = PhaseCheckpoint(str(tmpdir), {'period_in_days': 1})
+    processor.db_service.find_machine_identifier.side_effect = ['host1.test.com', RuntimeError('interrupted')]
+    with pytest.raises(RuntimeError):
+        processor._identify_log_sources(log_source_map)
+    processor = MVSProcessor(db_service=Mock())
+    processor.phase_checkpoint = PhaseCheckpoint(str(tmpdir), {'period_in_days': 1})
+    processor.db_service.find_machine_identifier.return_value = 'host2.test.com'
+    _, values = processor.phase_checkpoint.load('identify')
+    assert processor._restore_identified_log_sources(values,
+                                                     log_source_map) == {1: 'host1.test.com', 2: 'host2.test.com'}
+    assert processor.db_service.find_machine_identifier.call_count == 1
+
+
+def test_windows_server_qids_taken_from_prefetch():
+    processor = MVSProcessor(db_service=Mock())
+    processor.db_prefetcher = Mock()
+    processor.db_prefetcher.get_windows_server_qids.side_effect = DatabaseError('Test')
+    with patch('countMVS.DatabaseClient') as mock_db_client:
+        processor._load_windows_server_qids()
+    processor.db_prefetcher.get_windows_server_qids.assert_called_once_with()
+    mock_db_client.assert_not_called()
+    processor.db_prefetcher.get_windows_server_qids.side_effect = ValueError('Test')
+    with pytest.raises(ValueError):
+        processor._load_windows_server_qids()
@@ -17,6 +17,37 @@ def test_url_parsed_as_ip():
     assert machine_identifier_from_url == DUMMY_IP and machine_identifier_ip == DUMMY_IP
 
 
+def test_url_with_userinfo_and_port_parsed():
+    parser = MachineIdentifierParser()
+    assert parser.parse_machine_identifier('https://user:secret@{}:8443/path'.format(DUMMY_IP)) == DUMMY_IP
+    assert parser.parse_machine_identifier('https://[2001:db8::1]:8443/path') == '2001:db8::1'
+
+
+def test_machine_identifiers_normalized():
+    assert MachineIdentifierParser.normalize_machine_identifier(' Test.COM. ') == DUMMY_HOSTNAME
+    assert MachineIdentifierParser.normalize_machine_identifier('ssh://admin@test.com:22') == DUMMY_HOSTNAME
+    assert MachineIdentifierParser.normalize_machine_identifier('//admin@Test.com') == DUMMY_HOSTNAME
+    assert MachineIdentifierParser.normalize_machine_identifier('HTTPS://Test.com:443/') == DUMMY_HOSTNAME
+    assert MachineIdentifierParser.normalize_machine_identifier('[2001:DB8:0::1]:514') == '2001:db8::1'
+    assert MachineIdentifierParser.normalize_machine_identifier('2001:0db8::0001') == '2001:db8::1'
+    assert MachineIdentifierParser.normalize_machine_identifier('{}:514'.format(DUMMY_IP)) == DUMMY_IP
+    assert MachineIdentifierParser.normalize_machine_identifier(None) is None
+
+
+def test_bare_userinfo_identifiers_kept_distinct():
+    alice = MachineIdentifierParser.normalize_machine_identifier('alice@corp.com')
+    bob = MachineIdentifierParser.normalize_machine_identifier('bob@corp.com:22')
+    assert alice == 'alice@corp.com'
+    assert bob == 'bob@corp.com'
+
+
+def test_ip_address_detected():
+    assert MachineIdentifierParser.is_ip_address(DUMMY_IP) is True
+    assert MachineIdentifierParser.is_ip_address('::1') is True
+    assert MachineIdentifierParser.is_ip_address(DUMMY_HOSTNAME) is False
+    assert MachineIdentifierParser.is_ip_address('1.1.1') is False
+
+
 def test_ip_parsed_for_hostname():
     with patch('socket.gethostbyname', return_value=DUMMY_IP):
         parser = IPParser()
@@ -0,0 +1,71 @@
+#! /usr/bin/env python
+
+import os
+from countMVS import LogSource, MVSProcessor, PhaseCheckpoint
+
+
+def build_checkpoint(tmpdir, period_in_days=1, max_age=PhaseCheckpoint.DEFAULT_MAX_AGE_SECONDS):
+    return PhaseCheckpoint(os.path.join(str(tmpdir), 'checkpoints'), {'period_in_days': period_in_days}, max_age)
+
+
+def test_checkpoint_saved_and_loaded(tmpdir):
+    build_checkpoint(tmpdir).save('identify', [[1, 'host1.test.com'], [2, None]])
+    checkpoint = build_checkpoint(tmpdir)
+    assert checkpoint.load('identify') == (True, [[1, 'host1.test.com'], [2, None]])
+    assert checkpoint.get_resumed_phases() == ['identify']
+    assert not [file_name for file_name in os.listdir(checkpoint.directory) if file_name.endswith('.tmp')]
+
+
+def test_checkpoint_of_different_run_not_used(tmpdir):
+    build_checkpoint(tmpdir).save('domain count', True)
+    assert build_checkpoint(tmpdir, period_in_days=7).load('domain count') == (False, None)
+
+
+def test_expired_checkpoint_not_used(tmpdir):
+    build_checkpoint(tmpdir).save('domain count', True)
+    assert build_checkpoint(tmpdir, max_age=0).load('domain count') == (False, None)
+
+
+def test_wrapped_phase_only_runs_without_checkpoint(tmpdir):
+    calls = []
+
+    def count_domains(permissions):
+        calls.append(permissions)
+        return 2
+
+    checkpoint = build_checkpoint(tmpdir)
+    assert checkpoint.wrap('domain count', count_domains)(None) == 2
+    assert checkpoint.wrap('domain count', count_domains, decode=lambda value, _: value + 1)(None) == 3
+    assert len(calls) == 1
+
+
+def test_start_without_resume_clears_checkpoints(tmpdir):
+    build_checkpoint(tmpdir).save('domain count', True)
+    checkpoint = build_checkpoint(tmpdir)
+    checkpoint.start(True)
+    assert checkpoint.load('domain count') == (True, True)
+    checkpoint.start(False)
+    assert checkpoint.load('domain count') == (False, None)
+
+
+def test_log_source_map_restored_from_checkpoint(tmpdir):
+    log_source_map = {
+        1: LogSource(1, 'host1', ['Domain One', 'Domain Two'], 'device1', 12, 'hostname=host1', 1000),
+        2: LogSource(2, 'host2', [], LogSource.to_native_string(u'Caf\u00e9 server'), 13, 'hostname=host2', 2000)
+    }
+    build_checkpoint(tmpdir).save('domain search', MVSProcessor._encode_log_source_map(log_source_map))
+    _, values = build_checkpoint(tmpdir).load('domain search')
+    restored_map = MVSProcessor._decode_log_source_map(values)
+    assert sorted(restored_map.keys()) == [1, 2]
+    assert restored_map[1].get_domains() == ('Domain One', 'Domain Two')
+    assert restored_map[2].get_sp_config() == 'hostname=host2'
+    assert restored_map[2].get_timestamp_last_seen() == 2000
+    # Text comes back as the same native string type as it was read from the database
+    assert isinstance(restored_map[2].device_name, str)
+    assert restored_map[2].device_name == log_source_map[2].device_name
+
+
+def test_no_checkpoints_without_directory():
+    checkpoint = PhaseCheckpoint()
+    checkpoint.save('domain count', True)
+    assert checkpoint.load('domain count') == (False, None)
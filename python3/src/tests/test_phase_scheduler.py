@@ -0,0 +1,60 @@
+#! /usr/bin/env python
+
+import threading
+import pytest
+from countMVS import PhaseScheduler
+
+
+def test_dependency_results_passed_in_order():
+    scheduler = PhaseScheduler()
+    scheduler.add_task('sum', lambda first, second: first + second, ['first', 'second'])
+    scheduler.add_task('first', lambda: 1)
+    scheduler.add_task('second', lambda: 2)
+    results = scheduler.run()
+    assert results['sum'] == 3
+    assert scheduler.get_result('sum') == 3
+    timings = dict((timing['task'], timing) for timing in scheduler.get_timings())
+    assert sorted(timings.keys()) == ['first', 'second', 'sum']
+    assert timings['sum']['started'] >= timings['first']['started']
+
+
+def test_independent_tasks_run_concurrently():
+    # Each task waits for the other to start, so the run only completes if both run at the same time
+    first_started = threading.Event()
+    second_started = threading.Event()
+
+    def first():
+        first_started.set()
+        return second_started.wait(5)
+
+    def second():
+        second_started.set()
+        return first_started.wait(5)
+
+    scheduler = PhaseScheduler(max_workers=2)
+    scheduler.add_task('first', first)
+    scheduler.add_task('second', second)
+    assert scheduler.run() == {'first': True, 'second': True}
+
+
+def test_task_error_raised_and_dependents_not_run():
+    dependent_calls = []
+
+    def fail():
+        raise ValueError('phase failed')
+
+    scheduler = PhaseScheduler()
+    scheduler.add_task('fail', fail)
+    scheduler.add_task('dependent', dependent_calls.append, ['fail'])
+    with pytest.raises(ValueError) as exception:
+        scheduler.run()
+    assert 'phase failed' in str(exception)
+    assert not dependent_calls
+
+
+def test_unsatisfiable_dependencies_raise():
+    scheduler = PhaseScheduler()
+    scheduler.add_task('first', lambda _: 1, ['missing'])
+    with pytest.raises(ValueError) as exception:
+        scheduler.run()
+    assert 'first' in str(exception)
@@ -0,0 +1,78 @@
+#! /usr/bin/env python
+
+import sqlite3
+import pytest
+from mock import patch
+from countMVS import LogSource, MVSCountException, MVSResults, ResultsDatabase
+
+
+def build_log_source(sensor_id, hostname, domains, device_type_id=71):
+    return LogSource(sensor_id, hostname, domains, 'Device {}'.format(sensor_id), device_type_id, 'Syslog', 1000)
+
+
+def build_mvs_results():
+    mvs_results = MVSResults()
+    mvs_results.set_mvs_count(3)
+    mvs_results.set_domain_count_map({'Domain One': 2, 'Domain Two': 1})
+    mvs_results.set_device_map({
+        '1.1.1.1': [build_log_source(1, '1.1.1.1', ['Domain One']),
+                    build_log_source(2, 'a.test.com', ['Domain Two'])],
+        '2.2.2.2': [build_log_source(3, '2.2.2.2', ['Domain One'])]
+    })
+    mvs_results.set_merged_identifiers({'a.test.com': ('1.1.1.1', 'dns')})
+    mvs_results.add_windows_workstation('3.3.3.3', [build_log_source(4, '3.3.3.3', ['Domain One'], 12)])
+    mvs_results.add_excluded_log_source(build_log_source(5, '5.5.5.5', ['Domain One'], 331))
+    mvs_results.add_skipped_log_source(build_log_source(6, '6.6.6.6', []))
+    return mvs_results
+
+
+def test_results_written(tmpdir):
+    db_file = str(tmpdir.join('results.db'))
+    run_id = ResultsDatabase(db_file).write_results(build_mvs_results(), 1, False)
+    conn = sqlite3.connect(db_file)
+    assert conn.execute('SELECT mvs_count, period_in_days, log_sources_excluded FROM runs WHERE run_id = ?',
+                        (run_id, )).fetchall() == [(3, 1, 2)]
+    assert sorted(conn.execute('SELECT machine_identifier, log_source_count FROM devices').fetchall()) == [
+        ('1.1.1.1', 2), ('2.2.2.2', 1)
+    ]
+    assert conn.execute('SELECT merged_into, reason FROM merged_identifiers WHERE machine_identifier = ?',
+                        ('a.test.com', )).fetchall() == [('1.1.1.1', 'dns')]
+    assert sorted(conn.execute('SELECT log_source_id, status FROM log_sources').fetchall()) == [
+        (1, 'counted'), (2, 'counted'), (3, 'counted'), (4, 'windows_workstation'), (5, 'excluded'), (6, 'skipped')
+    ]
+    assert conn.execute('SELECT machine_identifier, verdict FROM workstation_verdicts').fetchall() == [('3.3.3.3',
+                                                                                                        'workstation')]
+    assert conn.execute('SELECT mvs_count FROM domains WHERE domain = ?', ('Domain One', )).fetchall() == [(2, )]
+    assert sorted(
+        conn.execute(
+            'SELECT l.machine_identifier FROM log_source_domains d JOIN log_sources l '
+            'ON l.log_source_id = d.log_source_id WHERE d.domain = ? AND l.status = ?',
+            ('Domain One', 'counted')).fetchall()) == [('1.1.1.1', ), ('2.2.2.2', )]
+    indexes = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+    assert 'log_sources_machine_identifier' in indexes
+    assert 'log_source_domains_domain' in indexes
+    conn.close()
+
+
+def test_runs_added_to_existing_database(tmpdir):
+    db_file = str(tmpdir.join('results.db'))
+    results_database = ResultsDatabase(db_file)
+    first_run_id = results_database.write_results(build_mvs_results(), 1, False)
+    second_run_id = results_database.write_results(build_mvs_results(), 2, True)
+    assert second_run_id == first_run_id + 1
+    conn = sqlite3.connect(db_file)
+    assert conn.execute('SELECT COUNT(*) FROM devices WHERE run_id = ?', (second_run_id, )).fetchone() == (2, )
+    conn.close()
+
+
+def test_failed_write_leaves_no_rows(tmpdir):
+    db_file = str(tmpdir.join('results.db'))
+    results_database = ResultsDatabase(db_file)
+    results_database.write_results(build_mvs_results(), 1, False)
+    with patch.object(ResultsDatabase, 'CREATE_INDEX_QUERIES', ['CREATE INDEX broken ON missing_table (column)']):
+        with pytest.raises(MVSCountException):
+            results_database.write_results(build_mvs_results(), 1, False)
+    conn = sqlite3.connect(db_file)
+    assert conn.execute('SELECT COUNT(*) FROM runs').fetchone() == (1, )
+    assert conn.execute('SELECT COUNT(*) FROM log_sources').fetchone() == (6, )
+    conn.close()
@@ -0,0 +1,49 @@
+#! /usr/bin/env python
+
+import os
+from countMVS import LogSource, MVSResults, RunHistoryStore
+
+
+def build_store(tmpdir, max_runs=RunHistoryStore.DEFAULT_MAX_RUNS):
+    run_history = RunHistoryStore(os.path.join(str(tmpdir), 'state', 'run_history.db'), max_runs)
+    run_history.load()
+    return run_history
+
+
+def test_device_domains_from_results():
+    mvs_results = MVSResults()
+    mvs_results.set_device_map({
+        '1.1.1.1': [LogSource(1, '1.1.1.1', ['Domain One']),
+                    LogSource(2, '1.1.1.1', ['Domain Two'])], '2.2.2.2': [LogSource(3, '2.2.2.2', ['Domain One'])]
+    })
+    assert RunHistoryStore.get_device_domains(mvs_results) == {
+        'Domain One': set(['1.1.1.1', '2.2.2.2']), 'Domain Two': set(['1.1.1.1'])
+    }
+
+
+def test_runs_kept_between_runs(tmpdir):
+    run_history = build_store(tmpdir)
+    first_run_id = run_history.record_run({'Domain One': set(['1.1.1.1', '2.2.2.2'])}, 2, 1)
+    run_history.close()
+    run_history = build_store(tmpdir)
+    second_run_id = run_history.record_run({'Domain One': set(['1.1.1.1']), 'Domain Two': set(['3.3.3.3'])}, 2, 1)
+    assert run_history.get_previous_run_id(second_run_id) == first_run_id
+    assert run_history.get_previous_run_id(first_run_id) is None
+    assert run_history.get_run(first_run_id)[3] == 2
+    assert run_history.get_run_device_domains(first_run_id) == {'Domain One': set(['1.1.1.1', '2.2.2.2'])}
+    run_history.close()
+
+
+def test_diff_reports_added_and_removed_per_domain():
+    previous_device_domains = {'Domain One': set(['1.1.1.1', '2.2.2.2']), 'Domain Two': set(['4.4.4.4'])}
+    device_domains = {'Domain One': set(['1.1.1.1', '3.3.3.3']), 'Domain Two': set(['4.4.4.4'])}
+    assert RunHistoryStore.diff(previous_device_domains, device_domains) == {'Domain One': (['3.3.3.3'], ['2.2.2.2'])}
+
+
+def test_expired_runs_removed(tmpdir):
+    run_history = build_store(tmpdir, max_runs=2)
+    run_ids = [run_history.record_run({'Domain One': set([str(index)])}, 1, 1) for index in range(3)]
+    assert run_history.get_run(run_ids[0]) is None
+    assert run_history.get_run_device_domains(run_ids[2]) == {'Domain One': set(['2'])}
+    assert run_history.conn.execute('SELECT COUNT(*) FROM identifiers').fetchone() == (2, )
+    run_history.close()
@@ -0,0 +1,100 @@
+#! /usr/bin/env python
+
+import os
+from mock import patch
+from countMVS import LogSource, MVSResults, ResultsGenerator, SpillStore, SpillableDeviceMap, SpillableList
+
+
+def build_log_source(sensor_id, hostname, domains=None):
+    return LogSource(sensor_id, hostname, domains or ['Default Domain'], 'Device {}'.format(sensor_id), 71, 'Syslog',
+                     1000 + sensor_id)
+
+
+def build_spill_store(tmpdir):
+    # A 1 MB limit with memory sampled on every addition makes the store spill on the first addition
+    spill_store = SpillStore(1, os.path.join(str(tmpdir), 'state'))
+    spill_store.MEMORY_CHECK_INTERVAL = 1
+    return spill_store
+
+
+def test_log_source_values_round_trip():
+    log_source = build_log_source(1, '1.1.1.1', ['Domain One', 'Domain Two'])
+    loaded_log_source = LogSource.from_values(log_source.to_values())
+    assert loaded_log_source.to_row() == log_source.to_row()
+
+
+def test_store_without_limit_never_spills(tmpdir):
+    spill_store = SpillStore(0, str(tmpdir))
+    device_map = SpillableDeviceMap(spill_store)
+    with patch('countMVS.SpillStore.get_resident_memory') as mock_get_resident_memory:
+        for index in range(SpillStore.MEMORY_CHECK_INTERVAL * 2):
+            device_map.append('1.1.1.1', build_log_source(index, '1.1.1.1'))
+        assert not mock_get_resident_memory.called
+    assert not spill_store.is_spilling()
+    assert len(device_map['1.1.1.1']) == SpillStore.MEMORY_CHECK_INTERVAL * 2
+    assert not os.listdir(str(tmpdir))
+
+
+def test_containers_moved_to_disk_above_limit(tmpdir):
+    spill_store = build_spill_store(tmpdir)
+    device_map = SpillableDeviceMap(spill_store)
+    log_source_list = SpillableList(spill_store)
+    with patch('countMVS.SpillStore.get_resident_memory', return_value=0):
+        device_map['1.1.1.1'] = [build_log_source(1, '1.1.1.1')]
+        log_source_list.append(build_log_source(2, '2.2.2.2'))
+    assert not spill_store.is_spilling()
+    with patch('countMVS.SpillStore.get_resident_memory', return_value=2 * 1024 * 1024):
+        device_map.append('3.3.3.3', build_log_source(3, '3.3.3.3'))
+        device_map.append('1.1.1.1', build_log_source(4, '1.1.1.1'))
+        log_source_list.append(build_log_source(5, '5.5.5.5'))
+    assert spill_store.is_spilling()
+    assert spill_store.get_spilled_count() == 5
+    assert device_map.keys() == ['1.1.1.1', '3.3.3.3']
+    assert [log_source.get_sensor_device_id() for log_source in device_map['1.1.1.1']] == [1, 4]
+    assert [log_source.get_sensor_device_id() for log_source in log_source_list] == [2, 5]
+    assert len(log_source_list) == 2
+    assert isinstance(device_map['1.1.1.1'], tuple)
+    assert isinstance(device_map['3.3.3.3'], tuple)
+    del device_map['1.1.1.1']
+    assert '1.1.1.1' not in device_map
+    assert [(machine_identifier, len(log_sources)) for machine_identifier, log_sources in device_map.items()] == \
+        [('3.3.3.3', 1)]
+    spill_store.close()
+    assert not os.listdir(os.path.join(str(tmpdir), 'state'))
+
+
+def test_results_match_after_spilling(tmpdir):
+    spill_store = build_spill_store(tmpdir)
+    with patch('countMVS.SpillStore.get_resident_memory', return_value=2 * 1024 * 1024):
+        mvs_results = MVSResults(spill_store)
+        mvs_results.set_device_map({'1.1.1.1': [build_log_source(1, '1.1.1.1')]})
+        mvs_results.add_log_source_to_device('1.1.1.1', build_log_source(2, '1.1.1.1'))
+        mvs_results.add_windows_workstation('2.2.2.2', [build_log_source(3, '2.2.2.2')])
+        mvs_results.add_excluded_log_source(build_log_source(4, '4.4.4.4'))
+    assert len(mvs_results.get_device_map()['1.1.1.1']) == 2
+    assert mvs_results.get_excluded_log_source_count() == 2
+    spill_store.close()
+
+
+def write_report(tmpdir, file_name, spill_store):
+    # The device name is utf8 text as it is read from the database
+    device_name = LogSource.to_native_string(u'Caf\u00e9 server')
+    with patch('countMVS.SpillStore.get_resident_memory', return_value=2 * 1024 * 1024):
+        mvs_results = MVSResults(spill_store)
+        mvs_results.set_mvs_count(1)
+        mvs_results.set_domain_count_map({'Default Domain': 1})
+        mvs_results.set_device_map(
+            {'1.1.1.1': [LogSource(1, '1.1.1.1', ['Default Domain'], device_name, 71, 'Syslog')]})
+    csv_filename = os.path.join(str(tmpdir), file_name)
+    ResultsGenerator(mvs_results, 1, True).write_results_to_csv(csv_filename)
+    with open(csv_filename, 'rb') as csv_file:
+        return csv_file.read()
+
+
+def test_non_ascii_report_matches_after_spilling(tmpdir):
+    spill_store = build_spill_store(tmpdir)
+    spilled_report = write_report(tmpdir, 'spilled.csv', spill_store)
+    assert spill_store.is_spilling()
+    spill_store.close()
+    assert spilled_report == write_report(tmpdir, 'in_memory.csv', None)
+    assert u'Caf\u00e9 server'.encode('utf8') in spilled_report
@@ -1,7 +1,8 @@
 #! /usr/bin/env python
 
+import pytest
 from mock import Mock, patch
-from countMVS import Validator
+from countMVS import Validator, ValidatorException
 
 
 def test_console_check_on_console():
@@ -27,3 +28,10 @@ def test_permission_check():
     mock_aql_client = Mock()
     Validator.perform_api_permission_check(mock_aql_client)
     assert mock_aql_client.check_api_permissions.called
+
+
+def test_zstd_compression_needs_zstandard():
+    Validator.check_compression('gzip')
+    with patch('countMVS.zstandard', None):
+        with pytest.raises(ValidatorException):
+            Validator.check_compression('zstd')
@@ -0,0 +1,62 @@
+#! /usr/bin/env python
+
+import os
+import time
+from mock import patch
+from countMVS import WindowsVerdictStore
+
+MACHINE_IDENTIFIER = '127.0.0.1'
+
+
+def build_store(tmpdir, ttl=WindowsVerdictStore.DEFAULT_TTL_SECONDS, legacy_file=None):
+    verdict_store = WindowsVerdictStore(os.path.join(str(tmpdir), 'state', 'windows_verdicts.db'), ttl, legacy_file)
+    verdict_store.load()
+    return verdict_store
+
+
+def test_verdicts_kept_between_runs(tmpdir):
+    verdict_store = build_store(tmpdir)
+    verdict_store.store(MACHINE_IDENTIFIER, True, 1, [1, 2])
+    verdict_store.store('127.0.0.2', False, 1, [3])
+    verdict_store.close()
+    verdict_store = build_store(tmpdir)
+    assert verdict_store.lookup(MACHINE_IDENTIFIER, 1, [2, 1]) == WindowsVerdictStore.WORKSTATION
+    assert verdict_store.lookup('127.0.0.2', 1, [3]) == WindowsVerdictStore.SERVER
+    assert verdict_store.lookup('127.0.0.3', 1, [4]) is None
+    assert verdict_store.get_hit_count() == 2
+    assert verdict_store.get_miss_count() == 1
+
+
+def test_workstation_reused_for_shorter_period_and_fewer_log_sources(tmpdir):
+    verdict_store = build_store(tmpdir)
+    verdict_store.store(MACHINE_IDENTIFIER, True, 5, [1, 2])
+    assert verdict_store.lookup(MACHINE_IDENTIFIER, 3, [1]) == WindowsVerdictStore.WORKSTATION
+    assert verdict_store.lookup(MACHINE_IDENTIFIER, 7, [1, 2]) is None
+    assert verdict_store.lookup(MACHINE_IDENTIFIER, 5, [1, 2, 3]) is None
+
+
+def test_server_reused_for_longer_period_and_more_log_sources(tmpdir):
+    verdict_store = build_store(tmpdir)
+    verdict_store.store(MACHINE_IDENTIFIER, False, 5, [1])
+    assert verdict_store.lookup(MACHINE_IDENTIFIER, 7, [1, 2]) == WindowsVerdictStore.SERVER
+    assert verdict_store.lookup(MACHINE_IDENTIFIER, 3, [1]) is None
+    assert verdict_store.lookup(MACHINE_IDENTIFIER, 5, [2]) is None
+
+
+def test_expired_verdict_revalidated(tmpdir):
+    verdict_store = build_store(tmpdir, ttl=60)
+    verdict_store.store(MACHINE_IDENTIFIER, True, 1, [1])
+    with patch('time.time', return_value=time.time() + 120):
+        assert verdict_store.lookup(MACHINE_IDENTIFIER, 1, [1]) is None
+
+
+def test_legacy_workstation_file_imported(tmpdir):
+    legacy_file = tmpdir.join('.windows_workstations')
+    legacy_file.write('{}\n\n127.0.0.2\n'.format(MACHINE_IDENTIFIER))
+    verdict_store = build_store(tmpdir, legacy_file=str(legacy_file))
+    assert verdict_store.lookup(MACHINE_IDENTIFIER, 10, [1, 2]) == WindowsVerdictStore.WORKSTATION
+    assert verdict_store.lookup('127.0.0.2', 1, []) == WindowsVerdictStore.WORKSTATION
+    verdict_store.store(MACHINE_IDENTIFIER, False, 1, [1])
+    verdict_store.close()
+    verdict_store = build_store(tmpdir, legacy_file=str(legacy_file))
+    assert verdict_store.lookup(MACHINE_IDENTIFIER, 1, [1]) == WindowsVerdictStore.SERVER